@@ -2,7 +2,7 @@ from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
 
 from .forms import CustomUserCreationForm, CustomUserChangeForm
-from .models import CustomUser
+from .models import CustomUser, Notification
 
 class CustomUserAdmin(UserAdmin):
     add_form = CustomUserCreationForm
@@ -10,4 +10,12 @@ class CustomUserAdmin(UserAdmin):
     model = CustomUser
     list_display = ['email', 'username',]
 
-admin.site.register(CustomUser, CustomUserAdmin)
\ No newline at end of file
+admin.site.register(CustomUser, CustomUserAdmin)
+
+
+class NotificationAdmin(admin.ModelAdmin):
+    list_display = ['user', 'kind', 'created_at', 'read_at']
+    list_filter = ['kind']
+    raw_id_fields = ['user', 'sentence']
+
+admin.site.register(Notification, NotificationAdmin)
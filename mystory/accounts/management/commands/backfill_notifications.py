@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from accounts.models import Notification
+
+
+class Command(BaseCommand):
+    help = 'Writes the notifications of the sentences selected before the notification feed'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            count = Notification.backfill()
+        self.stdout.write(self.style.SUCCESS(f"Wrote {count} notifications"))
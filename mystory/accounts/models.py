@@ -1,11 +1,23 @@
 # users/models.py
 from django.contrib.auth.models import AbstractUser
 from django.db import models
-from django.db.models import Q, Subquery
+from django.db.models import F, Q, Subquery
 from django.apps import apps
+from django.utils import timezone
 
 
 class CustomUser(AbstractUser):
+    # Leaderboard points, kept by Story.select_sentence
+    points = models.IntegerField(default=0)
+
+    SELECTED_SENTENCE_POINTS = 10
+    SELECTED_VOTE_POINTS = 2
+
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            models.Index(fields=['-points', 'id'], name='user_rank_idx'),
+            models.Index(fields=['date_joined'], name='user_date_joined_idx'),
+        ]
 
     @classmethod
     def num_entries_range(cls, date1, date2):
@@ -29,44 +41,191 @@ class CustomUser(AbstractUser):
 
     @classmethod
     def get_users_scored(cls):
-        stories_scored = apps.get_model('vocastory', 'Story').get_stories_scored()
+        """
+        Points computed from the sentences, source of rebuild_points
+        """
         users_scored = cls.objects.annotate(
             score=models.Count(
                 'created_sentences',
                 filter=Q(created_sentences__is_selected=True),
-                output_field=models.FloatField(),
-                distinct=True) * 10
+                distinct=True) * cls.SELECTED_SENTENCE_POINTS
                   + models.Count(
                 'voted_sentences',
                 filter=Q(voted_sentences__is_selected=True),
-                output_field=models.FloatField(),
-                distinct=True) * 2
+                distinct=True) * cls.SELECTED_VOTE_POINTS
             # + models.Avg('created_sentences__review_set__coherence')
             # + models.Avg('created_sentences__review_set__creativity')
             # + models.Avg('created_sentences__review_set__fun')
         )
         return users_scored
 
-    def get_notifications(self):
-        notifications = {}
-        voted_selected = self.voted_sentences \
-            .filter(is_selected=True).order_by('-creation_date')
-        for sentence in voted_selected:
-            notification = f"Sentence you voted for got selected: " \
-                f"{sentence.stylized_text}, +2 points!"
-            notifications[sentence.creation_date] = notification
-
-        write_selected = self.created_sentences \
-            .filter(is_selected=True).order_by('-creation_date')
-        for sentence in write_selected:
-            notification = f"Sentence you wrote selected: " \
-                f"{sentence.stylized_text}, +10 points!"
-            notifications[sentence.creation_date] = notification
-
-        notifications = [
-            i[1] for i in sorted(notifications.items(), key=lambda x: x[0])
-        ]
-        return notifications
+    @classmethod
+    def rebuild_points(cls, batch_size=500):
+        """
+        :return: number of users updated
+        """
+        updated = []
+        for user in cls.get_users_scored().order_by('pk').iterator():
+            user.points = user.score
+            updated.append(user)
+        cls.objects.bulk_update(updated, ['points'], batch_size=batch_size)
+        return len(updated)
+
+    @classmethod
+    def award_selection(cls, sentence):
+        """
+        Gives the points of a selected sentence to its writer and voters
+        """
+        cls.objects.filter(pk=sentence.creator_id) \
+            .update(points=F('points') + cls.SELECTED_SENTENCE_POINTS)
+        cls.objects.filter(voted_sentences=sentence) \
+            .update(points=F('points') + cls.SELECTED_VOTE_POINTS)
+
+    @classmethod
+    def get_leaderboard(cls):
+        """
+        Users by rank, served from the points index
+        """
+        return cls.objects.order_by('-points', 'pk')
+
+    def ranked_above(self):
+        return CustomUser.objects.filter(
+            Q(points__gt=self.points) | Q(points=self.points, pk__lt=self.pk))
+
+    def ranked_below(self):
+        return CustomUser.objects.filter(
+            Q(points__lt=self.points) | Q(points=self.points, pk__gt=self.pk))
+
+    def get_rank(self):
+        """
+        :return: 1 based rank, ties are broken by join order
+        """
+        return self.ranked_above().count() + 1
+
+    def get_neighbours(self, distance=2):
+        """
+        :return: users ranked just above, the user and users just below
+        """
+        above = list(self.ranked_above().order_by('points', '-pk')[:distance])
+        below = list(self.ranked_below().order_by('-points', 'pk')[:distance])
+        return above[::-1] + [self] + below
+
+    def get_notifications(self, limit=10):
+        """
+        :return: latest unread notifications, newest first
+        """
+        return list(self.notifications.filter(read_at__isnull=True).order_by('-pk')[:limit])
+
+    def get_notification_feed(self, before=None, limit=20):
+        """
+        Cursor paginated feed, pass the pk of the last item as before for the next page
+        :return: notifications newest first
+        """
+        feed = self.notifications.order_by('-pk')
+        if before is not None:
+            feed = feed.filter(pk__lt=before)
+        return list(feed[:limit])
+
+    def mark_notifications_read(self, up_to=None):
+        """
+        :param up_to: pk of the newest notification read, all if None
+        :return: number of notifications marked
+        """
+        unread = self.notifications.filter(read_at__isnull=True)
+        if up_to is not None:
+            unread = unread.filter(pk__lte=up_to)
+        return unread.update(read_at=timezone.now())
 
     def __str__(self):
         return self.username
+
+
+class Notification(models.Model):
+    """
+    Event of the feed of a user, written when a sentence is selected
+    """
+    WROTE_SELECTED = 'wrote_selected'
+    VOTED_SELECTED = 'voted_selected'
+    KINDS = [(k, k) for k in (WROTE_SELECTED, VOTED_SELECTED)]
+
+    user = models.ForeignKey(CustomUser,
+                             on_delete=models.CASCADE,
+                             related_name='notifications')
+    kind = models.CharField(max_length=20, choices=KINDS)
+    sentence = models.ForeignKey('vocastory.Sentence',
+                                 on_delete=models.CASCADE,
+                                 null=True)
+    text = models.TextField()
+    created_at = models.DateTimeField(default=timezone.now)
+    read_at = models.DateTimeField(null=True)
+
+    class Meta:
+        indexes = [
+            # Feed of a user
+            models.Index(fields=['user', '-id'], name='notification_feed_idx'),
+            # Unread items of a user, partial where supported
+            models.Index(fields=['user', '-id'], condition=Q(read_at__isnull=True),
+                         name='notification_unread_idx'),
+        ]
+
+    MESSAGES = {
+        WROTE_SELECTED: "Sentence you wrote selected: {}, +%d points!"
+                        % CustomUser.SELECTED_SENTENCE_POINTS,
+        VOTED_SELECTED: "Sentence you voted for got selected: {}, +%d points!"
+                        % CustomUser.SELECTED_VOTE_POINTS,
+    }
+
+    def __str__(self):
+        return f"{self.user}: {self.kind}"
+
+    @classmethod
+    def build_selection(cls, sentence, created_at=None, voters=None):
+        """
+        Unsaved notifications of the writer and the voters of a selected sentence
+        :param voters: pks of the voters, read from the votes if None
+        """
+        created_at = created_at or timezone.now()
+        if voters is None:
+            voters = CustomUser.objects.filter(voted_sentences=sentence).values_list('pk', flat=True)
+        recipients = [(sentence.creator_id, cls.WROTE_SELECTED)] \
+            + [(pk, cls.VOTED_SELECTED) for pk in voters]
+        return [cls(user_id=pk, kind=kind, sentence=sentence, created_at=created_at,
+                    text=cls.MESSAGES[kind].format(sentence.stylized_text))
+                for pk, kind in recipients]
+
+    @classmethod
+    def notify_selection(cls, sentence):
+        """
+        Fans the selection out to the feeds of the writer and the voters
+        """
+        cls.objects.bulk_create(cls.build_selection(sentence))
+
+    @classmethod
+    def backfill(cls, batch_size=500):
+        """
+        Notifications of the sentences selected before the feed existed, marked read
+        :return: number of notifications written
+        """
+        Sentence = apps.get_model('vocastory', 'Sentence')
+        Vote = apps.get_model('vocastory', 'Vote')
+        sentences = Sentence.objects.filter(is_selected=True) \
+            .exclude(pk__in=cls.objects.values('sentence')).order_by('pk')
+        count = 0
+        last = 0
+        while True:
+            batch = list(sentences.filter(pk__gt=last)[:batch_size])
+            if not batch:
+                return count
+            last = batch[-1].pk
+            voters = {}
+            for sentence, user in Vote.objects.filter(sentence__in=batch) \
+                    .values_list('sentence', 'user'):
+                voters.setdefault(sentence, []).append(user)
+            notifications = []
+            for sentence in batch:
+                notifications.extend(cls.build_selection(
+                    sentence, sentence.creation_date, voters.get(sentence.pk, [])))
+            for notification in notifications:
+                notification.read_at = notification.created_at
+            cls.objects.bulk_create(notifications)
+            count += len(notifications)
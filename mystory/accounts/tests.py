@@ -1,3 +1,97 @@
 from django.test import TestCase
+from django.urls import reverse
 
-# Create your tests here.
+from vocastory.models import Sentence, Story
+from .models import CustomUser, Notification
+
+
+class LeaderboardTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [CustomUser.objects.create_user(f'player{i}', password='pass', points=p)
+                     for i, p in enumerate([30, 10, 50, 10, 0])]
+
+    def test_rank_and_neighbours(self):
+        player0, player1, player2, player3, player4 = self.users
+        self.assertEqual([u.get_rank() for u in self.users], [2, 3, 1, 4, 5])
+        self.assertEqual(player1.get_neighbours(1), [player0, player1, player3])
+        self.assertEqual(player2.get_neighbours(2), [player2, player0, player1])
+        self.assertEqual(list(CustomUser.get_leaderboard()[:2]), [player2, player0])
+
+    def test_leaderboard_page(self):
+        self.client.login(username='player3', password='pass')
+        response = self.client.get(reverse('see_leaderboard'))
+        self.assertEqual(response.context['my_rank'], 4)
+        self.assertEqual([r for r, _ in response.context['neighbours']], [2, 3, 4, 5])
+
+
+class NotificationTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.writer, *cls.voters = [CustomUser.objects.create_user(f'player{i}', password='pass')
+                                   for i in range(4)]
+        cls.story = Story.objects.create()
+
+    def setUp(self):
+        # The selections move the poll state of the story
+        self.story = Story.objects.get(pk=self.story.pk)
+
+    def select(self, order, voters=()):
+        sentence = Sentence.objects.create(story=self.story, creator=self.writer, order=order,
+                                           text=f'Sentence {order}', stylized_text=f'Sentence {order}')
+        for voter in voters:
+            sentence.vote_sentence(voter)
+        self.story.select_sentence(sentence)
+        return sentence
+
+    def test_fan_out_on_selection(self):
+        self.select(0, self.voters)
+        self.assertEqual([n.text for n in self.writer.get_notifications()],
+                         ['Sentence you wrote selected: Sentence 0, +10 points!'])
+        self.assertEqual([n.kind for n in self.voters[2].get_notifications()],
+                         [Notification.VOTED_SELECTED])
+
+    def test_feed_and_read_state(self):
+        for order in range(5):
+            self.select(order)
+        feed = self.writer.get_notification_feed(limit=2)
+        self.assertEqual([n.sentence.order for n in feed], [4, 3])
+        feed = self.writer.get_notification_feed(before=feed[-1].pk, limit=2)
+        self.assertEqual([n.sentence.order for n in feed], [2, 1])
+
+        self.assertEqual(self.writer.mark_notifications_read(up_to=feed[0].pk), 3)
+        self.assertEqual([n.sentence.order for n in self.writer.get_notifications()], [4, 3])
+
+    def test_feed_views(self):
+        for order in range(3):
+            self.select(order)
+        self.client.force_login(self.writer)
+        data = self.client.get(reverse('notification_feed'), {'limit': 2}).json()
+        self.assertEqual(len(data['notifications']), 2)
+        data = self.client.get(reverse('notification_feed'), {'before': data['next']}).json()
+        self.assertEqual((len(data['notifications']), data['next']), (1, None))
+        # Limits below one are clamped to a single notification
+        for limit in (0, -1):
+            data = self.client.get(reverse('notification_feed'), {'limit': limit}).json()
+            self.assertEqual(len(data['notifications']), 1)
+
+        response = self.client.post(reverse('read_notifications'))
+        self.assertRedirects(response, reverse('home'))
+        self.assertEqual(self.writer.get_notifications(), [])
+
+    def test_backfill(self):
+        sentence = Sentence.objects.create(story=self.story, creator=self.writer, is_selected=True,
+                                           text='Old', stylized_text='Old')
+        sentence.vote_sentence(self.voters[0])
+        other = Sentence.objects.create(story=self.story, creator=self.writer, is_selected=True,
+                                        order=1, text='Older', stylized_text='Older')
+        for voter in self.voters:
+            other.vote_sentence(voter)
+        # Per batch: sentences, their votes and the insert
+        with self.assertNumQueries(3 * 2 + 1):
+            self.assertEqual(Notification.backfill(batch_size=1), 6)
+        self.assertEqual(Notification.backfill(), 0)
+        self.assertEqual(len(self.writer.get_notification_feed()), 2)
+        self.assertEqual(self.writer.get_notifications(), [])
@@ -5,4 +5,6 @@ from . import views
 
 urlpatterns = [
     path('signup/', views.SignUp.as_view(), name='signup'),
-]
\ No newline at end of file
+    path('notifications/', views.notification_feed, name='notification_feed'),
+    path('notifications/read/', views.read_notifications, name='read_notifications'),
+]
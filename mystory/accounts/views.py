@@ -1,12 +1,60 @@
 from django.shortcuts import render
 
 from django.contrib.auth.forms import UserCreationForm
-from django.urls import reverse_lazy
+from django.http import HttpResponseBadRequest, HttpResponseForbidden, HttpResponseRedirect, JsonResponse
+from django.urls import reverse, reverse_lazy
 from django.views import generic
+from django.views.decorators.http import require_POST
 
 from . forms import CustomUserCreationForm
 
+notification_page_size = 20
+
+
 class SignUp(generic.CreateView):
     form_class = CustomUserCreationForm
     success_url = reverse_lazy('login')
     template_name = 'registration/signup.html'
+
+
+def notification_feed(request):
+    """
+    Notifications of the user as JSON, ?before=<next> for the next page
+    """
+    if not request.user.is_authenticated:
+        return HttpResponseForbidden("Please login first!!")
+    try:
+        before = int(request.GET['before']) if 'before' in request.GET else None
+        limit = max(1, min(int(request.GET.get('limit', notification_page_size)),
+                           notification_page_size))
+    except ValueError:
+        return HttpResponseBadRequest("Invalid cursor")
+
+    feed = request.user.get_notification_feed(before, limit)
+    return JsonResponse({
+        'notifications': [{
+            'id': n.pk,
+            'kind': n.kind,
+            'text': n.text,
+            'created_at': n.created_at.isoformat(),
+            'read': n.read_at is not None,
+        } for n in feed],
+        'next': feed[-1].pk if len(feed) == limit else None,
+    })
+
+
+@require_POST
+def read_notifications(request):
+    """
+    Marks the notifications read, up to the up_to pk if given
+    """
+    if not request.user.is_authenticated:
+        return HttpResponseForbidden("Please login first!!")
+    try:
+        up_to = int(request.POST['up_to']) if request.POST.get('up_to') else None
+    except ValueError:
+        return HttpResponseBadRequest("Invalid notification")
+    count = request.user.mark_notifications_read(up_to)
+    if request.is_ajax():
+        return JsonResponse({'read': count})
+    return HttpResponseRedirect(reverse('home'))
@@ -1,3 +1,12 @@
 from django.contrib import admin
 
-# Register your models here.
+from .models import ActivityRollup, RollupState
+
+
+@admin.register(ActivityRollup)
+class ActivityRollupAdmin(admin.ModelAdmin):
+    list_display = ['bucket_start'] + ActivityRollup.COUNTERS
+    date_hierarchy = 'bucket_start'
+
+
+admin.site.register(RollupState)
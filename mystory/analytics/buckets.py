@@ -0,0 +1,80 @@
+from itertools import accumulate
+
+from django.db.models import Count
+from django.db.models.functions import TruncDay, TruncHour, TruncMinute
+from django.utils import timezone
+
+# Coarsest truncation first, the first one dividing the bucket width is used
+TRUNCATIONS = [
+    (timezone.timedelta(days=1), TruncDay),
+    (timezone.timedelta(hours=1), TruncHour),
+    (timezone.timedelta(minutes=1), TruncMinute),
+]
+
+
+def get_truncation(start, width):
+    """
+    Truncation whose unit divides the bucket width and the start time of day
+    """
+    offset = start - start.replace(hour=0, minute=0, second=0, microsecond=0)
+    for unit, trunc in TRUNCATIONS:
+        if width % unit == timezone.timedelta(0) and offset % unit == timezone.timedelta(0):
+            return trunc
+    raise ValueError(f"Buckets of {width} from {start} are not aligned to whole minutes")
+
+
+def bucket_starts(start, end, width):
+    """
+    :return: start of each bucket in [start, end)
+    """
+    starts = []
+    cur_date = start
+    while cur_date < end:
+        starts.append(cur_date)
+        cur_date += width
+    return starts
+
+
+def bucket_counts(queryset, field, start, end, width):
+    """
+    Counts the rows of the queryset per bucket of the given width,
+    in one GROUP BY over the timestamp truncated to the day, hour or minute
+    :param field: name of the timestamp field
+    :return: list of (bucket start, count) covering [start, end)
+    """
+    trunc = get_truncation(start, width)
+    rows = queryset.order_by() \
+        .filter(**{f'{field}__gte': start, f'{field}__lt': end}) \
+        .annotate(unit=trunc(field, tzinfo=start.tzinfo)) \
+        .values('unit').annotate(count=Count('pk')).values_list('unit', 'count')
+    return fold_counts(rows, start, end, width)
+
+
+def fold_counts(rows, start, end, width):
+    """
+    Sums finer grained counts into buckets of the given width
+    :param rows: (unit start, count) pairs inside [start, end)
+    :return: list of (bucket start, count) covering [start, end)
+    """
+    starts = bucket_starts(start, end, width)
+    counts = [0] * len(starts)
+    for unit, count in rows:
+        counts[(unit - start) // width] += count
+    return list(zip(starts, counts))
+
+
+def cumulative_counts(queryset, field, start, end, width, initial=0):
+    """
+    :param initial: number of rows before start
+    :return: list of (bucket start, running total at the end of the bucket)
+    """
+    return accumulate_counts(bucket_counts(queryset, field, start, end, width), initial)
+
+
+def accumulate_counts(buckets, initial=0):
+    """
+    :return: list of (bucket start, running total at the end of the bucket)
+    """
+    totals = accumulate([initial] + [count for _, count in buckets])
+    next(totals)
+    return [(s, total) for (s, _), total in zip(buckets, totals)]
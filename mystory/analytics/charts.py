@@ -0,0 +1,95 @@
+"""
+Chart rendering on isolated figures, so that concurrent requests
+never share the pyplot state, with the images cached per data version.
+matplotlib is imported on the first render, not with the URL conf
+"""
+import io
+
+from django.core.cache import cache
+
+from .buckets import accumulate_counts, fold_counts
+from .models import ActivityRollup
+
+# Rollup counter -> (y label, title)
+CHARTS = {
+    'sentences': ('Total Sentences', 'Cumulative Sentence Graph'),
+    'users': ('Total Users', 'Cumulative User Graph'),
+    'votes': ('Total Votes', 'Cumulative Vote Graph'),
+    'selections': ('Total Selections', 'Cumulative Selection Graph'),
+    'reviews': ('Total Reviews', 'Cumulative Review Graph'),
+}
+
+CHART_TIMEOUT = 60 * 60 * 24
+
+# Longer ranges are drawn as a filled area, one bar per bucket renders slowly
+MAX_BARS = 200
+MAX_TICKS = 12
+
+
+def chart_key(kind, counter, start, end, width, version):
+    hours = int(width.total_seconds()) // 3600
+    return f"chart-{kind}:{counter}:{start:%Y%m%d}:{end:%Y%m%d}:{hours}:{version}"
+
+
+def get_chart_data(counter, start, end, width, version):
+    """
+    :return: list of (bucket start, running total) of the rollup counter
+    """
+    key = chart_key('data', counter, start, end, width, version)
+    buckets = cache.get(key)
+    if buckets is None:
+        initial = ActivityRollup.get_total(counter, start)
+        rows = ActivityRollup.get_counts(counter, start, end)
+        buckets = accumulate_counts(fold_counts(rows, start, end, width), initial)
+        cache.set(key, buckets, CHART_TIMEOUT)
+    return buckets
+
+
+def render_png(buckets, ylabel, title):
+    """
+    Cumulative bar chart of the buckets
+    :return: PNG bytes
+    """
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    fig = Figure()
+    FigureCanvasAgg(fig)
+    ax = fig.subplots()
+    x = [s.strftime('%d-%H') for s, _ in buckets]
+    totals = [total for _, total in buckets]
+    if len(buckets) <= MAX_BARS:
+        ax.bar(range(len(buckets)), totals)
+    else:
+        ax.fill_between(range(len(buckets)), totals, step='mid')
+    step = -(-len(x) // MAX_TICKS) or 1
+    ax.set_xticks(range(0, len(x), step))
+    ax.set_xticklabels(x[::step], wrap=True)
+    ax.set_xlabel('Time (Day-Hour)')
+    ax.set_ylabel(ylabel)
+    ax.set_title(title)
+
+    buf = io.BytesIO()
+    fig.savefig(buf, format='png')
+    return buf.getvalue()
+
+
+def load():
+    """
+    Imports matplotlib ahead of the first chart
+    """
+    import matplotlib.backends.backend_agg  # noqa: F401
+
+
+def get_chart_png(counter, start, end, width, version):
+    """
+    Rendered once per data version and range
+    :return: PNG bytes
+    """
+    key = chart_key('png', counter, start, end, width, version)
+    png = cache.get(key)
+    if png is None:
+        ylabel, title = CHARTS[counter]
+        png = render_png(get_chart_data(counter, start, end, width, version), ylabel, title)
+        cache.set(key, png, CHART_TIMEOUT)
+    return png
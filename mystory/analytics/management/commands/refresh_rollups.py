@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from analytics.models import ActivityRollup, RollupState
+
+
+class Command(BaseCommand):
+    help = 'Refreshes the activity rollups newer than the watermark, run it periodically'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true',
+                            help='Recomputes all the rollups instead of the recent ones')
+        parser.add_argument('--overlap', type=int, default=2,
+                            help='Hours before the watermark to recompute, catches late commits')
+
+    def handle(self, *args, **options):
+        overlap = timezone.timedelta(hours=options['overlap'])
+        count = ActivityRollup.refresh(overlap=overlap, rebuild=options['rebuild'])
+        state = RollupState.get()
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {count} rollups, watermark is {state.watermark:%Y-%m-%d %H:%M} UTC"))
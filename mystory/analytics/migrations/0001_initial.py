@@ -0,0 +1,34 @@
+# Generated by Django 2.2.28 on 2026-10-18 14:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ActivityRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket_start', models.DateTimeField(unique=True)),
+                ('sentences', models.IntegerField(default=0)),
+                ('users', models.IntegerField(default=0)),
+                ('votes', models.IntegerField(default=0)),
+                ('selections', models.IntegerField(default=0)),
+                ('reviews', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='RollupState',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('watermark', models.DateTimeField(null=True)),
+                ('refreshed_at', models.DateTimeField(null=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 2.2.28 on 2026-10-18 14:27
+
+import analytics.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rollupstate',
+            name='changed_at',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AddField(
+            model_name='rollupstate',
+            name='version',
+            field=models.IntegerField(default=analytics.models.new_data_version),
+        ),
+    ]
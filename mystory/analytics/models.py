@@ -1,5 +1,170 @@
-from django.db import models
-from vocastory.models import Sentence
-# Create your models here.
+import random
+from collections import namedtuple
 
-#class Stats(models.Model):
+from django.apps import apps
+from django.core.cache import cache
+from django.db import models, transaction
+from django.db.models import Count
+from django.db.models.functions import Coalesce, TruncHour
+from django.utils import timezone
+
+# Granularity of the rollups, charts can use any whole number of hours
+ROLLUP_WIDTH = timezone.timedelta(hours=1)
+
+
+# What the charts depend on, cached so that a conditional request needs no query
+DataVersion = namedtuple('DataVersion', ['version', 'changed_at', 'first_bucket'])
+
+
+def new_data_version():
+    return random.getrandbits(31)
+
+
+def truncate_hour(date):
+    return date.replace(minute=0, second=0, microsecond=0)
+
+
+class ActivityRollup(models.Model):
+    """
+    Activity counts of an hour, the charts read these instead of the source tables
+    """
+    bucket_start = models.DateTimeField(unique=True)
+    sentences = models.IntegerField(default=0)
+    users = models.IntegerField(default=0)
+    votes = models.IntegerField(default=0)
+    selections = models.IntegerField(default=0)
+    reviews = models.IntegerField(default=0)
+
+    COUNTERS = ['sentences', 'users', 'votes', 'selections', 'reviews']
+
+    @staticmethod
+    def get_sources():
+        """
+        Counter -> (queryset, timestamp field) it is computed from, selections
+        count when their poll closed, at the creation date of their sentence
+        when that was not recorded
+        """
+        Sentence = apps.get_model('vocastory', 'Sentence')
+        Vote = apps.get_model('vocastory', 'Vote')
+        StoryReview = apps.get_model('vocastory', 'StoryReview')
+        CustomUser = apps.get_model('accounts', 'CustomUser')
+        return {
+            'sentences': (Sentence.objects.all(), 'creation_date'),
+            'users': (CustomUser.objects.all(), 'date_joined'),
+            'votes': (Vote.objects.all(), 'created_at'),
+            'selections': (Sentence.objects.filter(is_selected=True).annotate(
+                selection_date=Coalesce('selected_at', 'creation_date')), 'selection_date'),
+            'reviews': (StoryReview.objects.all(), 'creation_date'),
+        }
+
+    @classmethod
+    def compute(cls, since=None):
+        """
+        One grouped query per counter over the rows created after since
+        :return: list of unsaved rollups ordered by bucket_start
+        """
+        rollups = {}
+        for counter, (queryset, field) in cls.get_sources().items():
+            if since is not None:
+                queryset = queryset.filter(**{f'{field}__gte': since})
+            rows = queryset.order_by() \
+                .annotate(unit=TruncHour(field, tzinfo=timezone.utc)) \
+                .values('unit').annotate(count=Count('pk')).values_list('unit', 'count')
+            for unit, count in rows:
+                rollup = rollups.setdefault(unit, cls(bucket_start=unit))
+                setattr(rollup, counter, count)
+        return [rollups[k] for k in sorted(rollups)]
+
+    @classmethod
+    def refresh(cls, overlap=timezone.timedelta(0), rebuild=False, batch_size=500):
+        """
+        Recomputes the buckets from the watermark on, minus the overlap
+        for the rows committed late. The watermark
+        moves to the current hour, which is recomputed on the next refresh
+        :return: number of rollups written
+        """
+        now = timezone.now()
+        with transaction.atomic():
+            state = RollupState.get(for_update=True)
+            since = None
+            if not rebuild and state.watermark is not None:
+                since = state.watermark - overlap
+            rollups = cls.compute(since)
+            stale = cls.objects.all()
+            if since is not None:
+                stale = stale.filter(bucket_start__gte=since)
+            old = list(stale.order_by('bucket_start').values_list('bucket_start', *cls.COUNTERS))
+            stale.delete()
+            cls.objects.bulk_create(rollups, batch_size=batch_size)
+            # Cached charts stay valid until the counts actually change
+            if old != [r.as_row() for r in rollups]:
+                state.version = new_data_version()
+                state.changed_at = now
+            state.watermark = truncate_hour(now.astimezone(timezone.utc))
+            state.refreshed_at = now
+            state.save()
+            RollupState.clear_cache()
+        return len(rollups)
+
+    @classmethod
+    def get_counts(cls, counter, start, end):
+        """
+        :return: (bucket start, count) of the non-empty rollups in [start, end)
+        """
+        return cls.objects.filter(bucket_start__gte=start, bucket_start__lt=end) \
+            .exclude(**{counter: 0}).order_by('bucket_start') \
+            .values_list('bucket_start', counter)
+
+    @classmethod
+    def get_total(cls, counter, end):
+        """
+        :return: sum of the counter before end
+        """
+        total = cls.objects.filter(bucket_start__lt=end).aggregate(total=models.Sum(counter))
+        return total['total'] or 0
+
+    def as_row(self):
+        return (self.bucket_start,) + tuple(getattr(self, c) for c in self.COUNTERS)
+
+    def __str__(self):
+        counts = ", ".join(f"{c}: {getattr(self, c)}" for c in self.COUNTERS)
+        return f"{self.bucket_start:%Y-%m-%d %H:00} ({counts})"
+
+
+class RollupState(models.Model):
+    """
+    Single row holding the refresh watermark of the rollups
+    """
+    watermark = models.DateTimeField(null=True)
+    refreshed_at = models.DateTimeField(null=True)
+    # Changes only when a refresh changes the rollups
+    version = models.IntegerField(default=new_data_version)
+    changed_at = models.DateTimeField(null=True)
+
+    cache_key = 'rollup-state'
+
+    @classmethod
+    def get(cls, for_update=False):
+        objects = cls.objects.select_for_update() if for_update else cls.objects
+        state, _ = objects.get_or_create(pk=1)
+        return state
+
+    @classmethod
+    def get_data_version(cls):
+        """
+        DataVersion of the rollups, read through the cache
+        """
+        data_version = cache.get(cls.cache_key)
+        if data_version is None:
+            state = cls.get()
+            first_bucket = ActivityRollup.objects.order_by('bucket_start') \
+                .values_list('bucket_start', flat=True).first()
+            data_version = DataVersion(state.version, state.changed_at, first_bucket)
+            cache.set(cls.cache_key, data_version, None)
+        return data_version
+
+    @classmethod
+    def clear_cache(cls):
+        cache.delete(cls.cache_key)
+        # Readers might have cached the old state before the commit
+        transaction.on_commit(lambda: cache.delete(cls.cache_key))
@@ -1,3 +1,172 @@
+import os
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.cache import cache
 from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from accounts.models import CustomUser
+from mystory.testing import QueryBudgetMixin
+from vocastory.models import Sentence, Story, Vote
+from .buckets import bucket_counts, cumulative_counts
+from .models import ActivityRollup, RollupState
+
+
+class BucketCountTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.start = timezone.datetime(2019, 12, 1, tzinfo=timezone.utc)
+        for hours in (0, 1, 7.5, 8, 30, 47.9, 48):
+            user = CustomUser.objects.create_user(f'user{hours}', password='pass')
+            user.date_joined = cls.start + timezone.timedelta(hours=hours)
+            user.save()
+
+    def test_counts_in_one_query(self):
+        end = self.start + timezone.timedelta(days=2)
+        width = timezone.timedelta(hours=8)
+        with self.assertNumQueries(1):
+            buckets = bucket_counts(CustomUser.objects.all(), 'date_joined', self.start, end, width)
+        self.assertEqual([c for _, c in buckets], [3, 1, 0, 1, 0, 1])
+        self.assertEqual(buckets[1][0], self.start + width)
+
+    def test_cumulative_and_widths(self):
+        end = self.start + timezone.timedelta(days=3)
+        day = timezone.timedelta(days=1)
+        buckets = cumulative_counts(CustomUser.objects.all(), 'date_joined', self.start, end, day, 10)
+        self.assertEqual([c for _, c in buckets], [14, 16, 17])
+        with self.assertRaises(ValueError):
+            bucket_counts(CustomUser.objects.all(), 'date_joined', self.start, end,
+                          timezone.timedelta(seconds=90))
+
+
+class ActivityRollupTests(QueryBudgetMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.start = timezone.datetime(2019, 12, 1, tzinfo=timezone.utc)
+        cls.user = CustomUser.objects.create_user('writer', password='pass')
+        CustomUser.objects.filter(pk=cls.user.pk).update(date_joined=cls.start)
+        cls.story = Story.objects.create()
+        for hours in (0.5, 1, 1.5, 30):
+            cls.write(hours)
+
+    @classmethod
+    def write(cls, hours, selected=False):
+        sentence = Sentence.objects.create(story=cls.story, creator=cls.user,
+                                           text='A sentence.', is_selected=selected)
+        date = cls.start + timezone.timedelta(hours=hours)
+        Sentence.objects.filter(pk=sentence.pk).update(creation_date=date)
+        return sentence
+
+    def setUp(self):
+        cache.clear()
+
+    def rollups(self, counter):
+        return [(r.bucket_start.hour, getattr(r, counter))
+                for r in ActivityRollup.objects.order_by('bucket_start')]
+
+    def test_refresh(self):
+        self.assertEqual(ActivityRollup.refresh(), 3)
+        self.assertEqual(self.rollups('sentences'), [(0, 1), (1, 2), (6, 1)])
+        self.assertEqual(self.rollups('users'), [(0, 1), (1, 0), (6, 0)])
+        self.assertIsNotNone(RollupState.get().watermark)
+
+    def test_refresh_from_watermark(self):
+        ActivityRollup.refresh()
+        # Rows older than the watermark are not scanned again,
+        # the vote is counted in the hour it was cast
+        sentence = self.write(2, selected=True)
+        sentence.vote_sentence(self.user)
+        ActivityRollup.refresh()
+        self.assertEqual(self.rollups('sentences')[:3], [(0, 1), (1, 2), (6, 1)])
+        voted_at = Vote.objects.get(sentence=sentence).created_at
+        self.assertEqual(ActivityRollup.objects.get(votes=1).bucket_start,
+                         voted_at.replace(minute=0, second=0, microsecond=0))
+
+        ActivityRollup.refresh(rebuild=True)
+        self.assertEqual(self.rollups('sentences')[:4], [(0, 1), (1, 2), (2, 1), (6, 1)])
+        self.assertEqual(self.rollups('selections')[:4], [(0, 0), (1, 0), (2, 1), (6, 0)])
+
+    def test_late_selection_counts_when_the_poll_closed(self):
+        sentence = self.write(2)
+        ActivityRollup.refresh()
+        # The poll closes long after the sentence, past the watermark
+        self.assertTrue(Story.objects.get(pk=self.story.pk).select_sentence(sentence))
+        ActivityRollup.refresh()
+        selected_at = Sentence.objects.get(pk=sentence.pk).selected_at
+        self.assertEqual(ActivityRollup.objects.get(selections=1).bucket_start,
+                         selected_at.replace(minute=0, second=0, microsecond=0))
+
+    def test_data_version(self):
+        ActivityRollup.refresh()
+        version = RollupState.get().version
+        ActivityRollup.refresh()
+        self.assertEqual(RollupState.get().version, version)
+        self.write(2)
+        ActivityRollup.refresh(rebuild=True)
+        self.assertNotEqual(RollupState.get().version, version)
+
+    def test_chart_views(self):
+        ActivityRollup.refresh()
+        params = {'hours': 12, 'start': '2019-12-01', 'end': '2019-12-02'}
+        response = self.client.get(reverse('see_sentences'), params)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertWithinBudget(response)
+        # Cached until the rollups change
+        with self.assertNumQueries(0):
+            again = self.client.get(reverse('see_sentences'), params)
+        self.assertEqual(again.content, response.content)
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('see_sentences'), params,
+                                       HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+        response = self.client.get(reverse('see_users'), {'hours': 0})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(reverse('see_chart', args=['comments']))
+        self.assertEqual(response.status_code, 404)
+        self.assertWithinBudget(self.client.get(reverse('see_chart', args=['votes'])))
+
+    def test_chart_data(self):
+        ActivityRollup.refresh()
+        params = {'hours': 24, 'start': '2019-12-01', 'end': '2019-12-02'}
+        response = self.client.get(reverse('chart_data', args=['sentences']), params)
+        self.assertEqual([b['total'] for b in response.json()['buckets']], [3, 4])
+        self.assertWithinBudget(response)
+        etag = response['ETag']
+
+        self.write(2)
+        ActivityRollup.refresh(rebuild=True)
+        response = self.client.get(reverse('chart_data', args=['sentences']), params,
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual([b['total'] for b in response.json()['buckets']], [4, 5])
+
+
+class StartupTests(TestCase):
+    # Cold import of the WSGI application and the URL conf, in seconds
+    IMPORT_BUDGET = 1.5
+    DEFERRED_MODULES = ['matplotlib', 'numpy', 'spacy', 'PyDictionary']
 
-# Create your tests here.
+    def test_import_time(self):
+        env = dict(os.environ, VOCASTORY_PREWARM='', DJANGO_SETTINGS_MODULE='mystory.settings')
+        code = "import mystory.wsgi; from django.urls import get_resolver; get_resolver().url_patterns"
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                                cwd=settings.BASE_DIR, env=env, stderr=subprocess.PIPE,
+                                universal_newlines=True, check=True)
+        imports = []
+        for line in result.stderr.splitlines():
+            if not line.startswith('import time:') or 'cumulative' in line:
+                continue
+            _, cumulative, name = line.split('|')
+            imports.append((len(name) - len(name.lstrip()), int(cumulative), name.strip()))
+        modules = set(name for _, _, name in imports)
+        # Top level imports include the time of their own imports
+        top = min(depth for depth, _, _ in imports)
+        total = sum(cumulative for depth, cumulative, _ in imports if depth == top)
+        for module in self.DEFERRED_MODULES:
+            self.assertNotIn(module, modules)
+        self.assertLess(total / 1e6, self.IMPORT_BUDGET)
@@ -4,6 +4,8 @@ from . import views
 
 urlpatterns = [
     # Browse Mode
-    path('see_sentences.png', views.see_sentences, name='see_sentences'),
-    path('see_users.png', views.see_users, name='see_users')
+    path('see_sentences.png', views.see_chart, {'counter': 'sentences'}, name='see_sentences'),
+    path('see_users.png', views.see_chart, {'counter': 'users'}, name='see_users'),
+    path('chart/<str:counter>.png', views.see_chart, name='see_chart'),
+    path('chart/<str:counter>.json', views.chart_data, name='chart_data'),
 ]
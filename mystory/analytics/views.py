@@ -1,83 +1,90 @@
-from django.shortcuts import render
-from vocastory.models import Sentence
-from accounts.models import CustomUser
+import hashlib
+
+from django.http import Http404, HttpResponse, HttpResponseBadRequest, JsonResponse
 from django.utils import timezone
-import matplotlib
-matplotlib.use('agg')
-from matplotlib import pyplot as plt
-from matplotlib.backends.backend_agg import FigureCanvasAgg
-from django.http import HttpResponse
-import io
-    
-def see_sentences(request):
-    users = CustomUser.objects.all().order_by('date_joined')
-    start_date = users.first().date_joined.replace(hour=0, minute=0, second=0, microsecond=0)
-    end_date = timezone.now().replace(hour=0, minute=0, second=0, microsecond=0)
-    end_date = end_date + timezone.timedelta(days=1)
-    t_d = timezone.timedelta(hours=8)
-
-    total_users = 0
-    cumulative_users = []
-    x = []
-    cur_date = start_date
-    while cur_date < end_date:
-        total_users += Sentence.num_entries_range(cur_date, cur_date + t_d)
-        cumulative_users.append(total_users)
-        x.append(cur_date.strftime('%d-%H'))
-        cur_date += t_d
-
-    
-    plt.xticks(range(len(x)), x, wrap=True)
-    plt.xlabel('Time (Day-Hour)')
-    plt.ylabel('Total Sentences')
-    plt.title('Cumulative Sentence Graph')
-    plt.bar(range(len(cumulative_users)), cumulative_users)
-
-    f = matplotlib.figure.Figure()
-
-    canvas = FigureCanvasAgg(f)
-
-    buf = io.BytesIO()
-    plt.savefig(buf, format='png')
-    plt.clf()
-    plt.close(f)
-
-    response = HttpResponse(buf.getvalue(), content_type='image/png')
-
-    return response
-    
-def see_users(request):
-    users = CustomUser.objects.all().order_by('date_joined')
-    start_date = users.first().date_joined.replace(hour=0, minute=0, second=0, microsecond=0)
-    end_date = timezone.now().replace(hour=0, minute=0, second=0, microsecond=0)
-    end_date = end_date + timezone.timedelta(days=1)
-    t_d = timezone.timedelta(hours=8)
-
-    total_users = 0
-    cumulative_users = []
-    x = []
-    cur_date = start_date
-    while cur_date < end_date:
-        total_users += CustomUser.num_entries_range(cur_date, cur_date + t_d)
-        cumulative_users.append(total_users)
-        x.append(cur_date.strftime('%d-%H'))
-        cur_date += t_d
-
-    plt.xticks(range(len(x)), x, wrap=True)
-    plt.xlabel('Time (Day-Hour)')
-    plt.ylabel('Total Users')
-    plt.title('Cumulative User Graph')
-    plt.bar(range(len(cumulative_users)), cumulative_users)
-
-    f = matplotlib.figure.Figure()
-    canvas = FigureCanvasAgg(f)
-
-    buf = io.BytesIO()
-    plt.savefig(buf, format='png')
-    plt.clf()
-    plt.close(f)
-    
-    response = HttpResponse(buf.getvalue(), content_type='image/png')
-
-    return response
+from django.utils.dateparse import parse_date
+from django.views.decorators.http import condition
+
+from .charts import CHARTS, chart_key, get_chart_data, get_chart_png
+from .models import RollupState
+
+default_bucket_hours = 8
+
+
+def get_chart_range(request, first_bucket=None):
+    """
+    Bucket width and date range of the chart, from the query string:
+    ?hours=8&start=2019-11-19&end=2019-12-31, defaults to 8 hours
+    from the first rollup until the end of today
+    :return: start, end, width
+    """
+    utc = timezone.utc
+    # Rollups are hourly, so are the buckets
+    width = timezone.timedelta(hours=int(request.GET.get('hours', default_bucket_hours)))
+    if width <= timezone.timedelta(0):
+        raise ValueError("Bucket width should be positive")
+
+    start = parse_date(request.GET.get('start', ''))
+    if start is None:
+        start = (first_bucket or timezone.now()).astimezone(utc).date()
+    end = parse_date(request.GET.get('end', ''))
+    if end is None:
+        end = timezone.now().astimezone(utc).date()
+    start = timezone.datetime.combine(start, timezone.datetime.min.time(), tzinfo=utc)
+    end = timezone.datetime.combine(end, timezone.datetime.min.time(), tzinfo=utc)
+    end = end + timezone.timedelta(days=1)
+    return start, end, width
+
+
+def chart_etag(request, counter):
+    data_version = RollupState.get_data_version()
+    try:
+        start, end, width = get_chart_range(request, data_version.first_bucket)
+    except ValueError:
+        return None
+    key = chart_key(request.path, counter, start, end, width, data_version.version)
+    return hashlib.md5(key.encode()).hexdigest()
+
+
+def chart_last_modified(request, counter):
+    return RollupState.get_data_version().changed_at
+
+
+def chart_request(view):
+    """
+    Resolves the counter and the range of a chart view, answers 304 while
+    the rollups are unchanged and 400 on an invalid range
+    """
+    @condition(etag_func=chart_etag, last_modified_func=chart_last_modified)
+    def wrapper(request, counter):
+        if counter not in CHARTS:
+            raise Http404("Unknown chart")
+        data_version = RollupState.get_data_version()
+        try:
+            start, end, width = get_chart_range(request, data_version.first_bucket)
+        except ValueError as e:
+            return HttpResponseBadRequest(str(e))
+        return view(request, counter, start, end, width, data_version.version)
+    return wrapper
+
+
+@chart_request
+def see_chart(request, counter, start, end, width, version):
+    """
+    Cumulative bar chart of a rollup counter
+    """
+    png = get_chart_png(counter, start, end, width, version)
+    return HttpResponse(png, content_type='image/png')
+
 
+@chart_request
+def chart_data(request, counter, start, end, width, version):
+    """
+    Buckets of the chart, for drawing it in the browser
+    """
+    buckets = get_chart_data(counter, start, end, width, version)
+    return JsonResponse({
+        'counter': counter,
+        'hours': int(width.total_seconds()) // 3600,
+        'buckets': [{'start': s.isoformat(), 'total': total} for s, total in buckets],
+    })
@@ -0,0 +1,132 @@
+"""
+Per request instrumentation: query count, DB, template, NLP and dictionary time
+
+InstrumentationMiddleware collects the numbers of each request, logs them
+to the ``mystory.instrumentation`` logger and attaches them to the response
+as ``response.instrumentation``. ``VOCASTORY_SERVER_TIMING = True`` also
+sends them to the browser in a ``Server-Timing`` header.
+"""
+import logging
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+from django.template.backends.django import DjangoTemplates, Template
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+
+class RequestStats:
+    """
+    Numbers of one request, times are in seconds
+    """
+
+    def __init__(self):
+        self.queries = 0
+        self.timings = {'db': 0.0, 'template': 0.0, 'nlp': 0.0, 'dict': 0.0}
+        self.total = 0.0
+        # Nested renders of included templates are counted once
+        self.depth = {}
+
+    def add(self, name, duration):
+        self.timings[name] = self.timings.get(name, 0.0) + duration
+
+    def server_timing(self):
+        entries = [f'{name};dur={duration * 1000:.1f}'
+                   for name, duration in self.timings.items() if duration]
+        entries.append(f'queries;desc="{self.queries} queries"')
+        entries.append(f'total;dur={self.total * 1000:.1f}')
+        return ', '.join(entries)
+
+    def __str__(self):
+        timings = ' '.join(f'{name}={duration * 1000:.1f}ms' for name, duration in self.timings.items())
+        return f"{self.queries} queries {timings} total={self.total * 1000:.1f}ms"
+
+
+def get_stats():
+    """
+    :return: RequestStats of the current request, None outside of a request
+    """
+    return getattr(_local, 'stats', None)
+
+
+@contextmanager
+def timed(name):
+    """
+    Adds the time spent in the block to the current request, if any
+    """
+    stats = get_stats()
+    if stats is None:
+        yield
+        return
+    depth = stats.depth.get(name, 0)
+    stats.depth[name] = depth + 1
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats.depth[name] = depth
+        if depth == 0:
+            stats.add(name, time.perf_counter() - start)
+
+
+def count_query(execute, sql, params, many, context):
+    stats = get_stats()
+    if stats is None:
+        return execute(sql, params, many, context)
+    stats.queries += 1
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.add('db', time.perf_counter() - start)
+
+
+class TimedTemplate(Template):
+
+    def render(self, context=None, request=None):
+        with timed('template'):
+            return super().render(context, request)
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """
+    Django template backend timing the renders for the instrumentation
+    """
+
+    def get_template(self, template_name):
+        template = super().get_template(template_name)
+        return TimedTemplate(template.template, self)
+
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+
+class InstrumentationMiddleware:
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        stats = RequestStats()
+        _local.stats = stats
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(count_query))
+                response = self.get_response(request)
+        finally:
+            _local.stats = None
+        stats.total = time.perf_counter() - start
+
+        response.instrumentation = stats
+        if getattr(settings, 'VOCASTORY_SERVER_TIMING', False):
+            response['Server-Timing'] = stats.server_timing()
+        match = request.resolver_match
+        logger.debug("%s %s: %s", request.method, match.view_name if match else request.path, stats)
+        return response
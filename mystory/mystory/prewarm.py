@@ -0,0 +1,44 @@
+"""
+Warm up of a worker process, called from wsgi.py once the process is
+forked, so that heavy modules stay out of the URL conf import but the
+first requests do not pay for them either
+"""
+from django.conf import settings
+
+
+def load_urls():
+    from django.urls import get_resolver
+    get_resolver().url_patterns
+
+
+def load_nlp():
+    from vocastory import nlp
+    nlp.get_engine().load()
+
+
+def load_dictionary():
+    from vocastory import dictionary
+    dictionary.load()
+
+
+def load_charts():
+    from analytics import charts
+    charts.load()
+
+
+TARGETS = {
+    'urls': load_urls,
+    'nlp': load_nlp,
+    'dictionary': load_dictionary,
+    'charts': load_charts,
+}
+
+
+def prewarm(targets=None):
+    """
+    :param targets: names of TARGETS, defaults to the VOCASTORY_PREWARM setting
+    """
+    if targets is None:
+        targets = getattr(settings, 'VOCASTORY_PREWARM', [])
+    for target in targets:
+        TARGETS[target]()
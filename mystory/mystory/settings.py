@@ -38,10 +38,12 @@ INSTALLED_APPS = [
     'django.contrib.staticfiles',
     'vocastory.apps.VocastoryConfig',
     'accounts.apps.AccountsConfig',
+    'analytics.apps.AnalyticsConfig',
 ]
 AUTH_USER_MODEL = 'accounts.CustomUser'
 
 MIDDLEWARE = [
+    'mystory.instrumentation.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -55,7 +57,8 @@ ROOT_URLCONF = 'mystory.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates timing the renders for the instrumentation middleware
+        'BACKEND': 'mystory.instrumentation.TimedDjangoTemplates',
         'DIRS': [
             os.path.join(BASE_DIR, 'templates'),
         ],
@@ -85,6 +88,21 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/2.2/topics/cache/
+# Use a shared backend (e.g. memcached) in production so that all the
+# processes see the same story snapshots
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+# Story snapshots are keyed by story version, they never get stale
+VOCASTORY_SNAPSHOT_TIMEOUT = 60 * 60 * 24
+
+
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
 
@@ -128,6 +146,37 @@ STATICFILES_DIRS = [
     # os.path.join(BASE_DIR, "/opt/bitnami/apps/django/django_projects/vocastory/mystory/static"),
 ]
 
+# NLP engine used for matching the word set words in sentences,
+# use 'worker' with `python manage.py run_nlp_worker` in production
+VOCASTORY_NLP = {
+    'ENGINE': 'local',
+    'MODEL': 'en_core_web_md',
+    'ADDRESS': ('127.0.0.1', 6543),
+}
+
+# Lemmas of the words seen before, sentences made of known words skip the NLP engine.
+# BACKEND is an optional CACHES alias to share the lemmas between processes
+VOCASTORY_LEMMA_CACHE = {
+    'SIZE': 50000,
+    'SENTENCE_SIZE': 0,
+    'BACKEND': None,
+}
+
+# Meanings are served from the WordMeaning table, see import_meanings. Words missing
+# there are fetched once from REMOTE, set it to None to stay offline
+VOCASTORY_DICTIONARY = {
+    'REMOTE': 'vocastory.dictionary.fetch_pydictionary',
+    'TIMEOUT': 2.0,
+}
+
+# Sends the query count and the DB, template, NLP and dictionary
+# times of each request in a Server-Timing header
+VOCASTORY_SERVER_TIMING = False
+
+# Loaded by wsgi.py in each worker process instead of on the first request,
+# any of 'urls', 'nlp', 'dictionary' and 'charts', e.g. VOCASTORY_PREWARM=urls,nlp
+VOCASTORY_PREWARM = [t for t in os.environ.get('VOCASTORY_PREWARM', '').split(',') if t]
+
 # Modified for login/logout redirection
 LOGIN_REDIRECT_URL = '/'
 LOGOUT_REDIRECT_URL = '/'
@@ -0,0 +1,33 @@
+"""
+Test helpers shared by the apps
+"""
+
+# Most queries a view may run, by URL name, whatever the amount of data
+QUERY_BUDGETS = {
+    'home': 5,
+    'play': 6,
+    'read_story': 12,
+    'write_story': 13,
+    'see_leaderboard': 8,
+    'see_sentences': 4,
+    'see_users': 4,
+    'see_chart': 4,
+    'chart_data': 4,
+}
+
+
+class QueryBudgetMixin:
+    """
+    TestCase mixin checking the requests against QUERY_BUDGETS,
+    from the numbers the instrumentation middleware attaches to the responses
+    """
+    query_budgets = QUERY_BUDGETS
+
+    def assertWithinBudget(self, response, budget=None):
+        stats = response.instrumentation
+        name = response.resolver_match.url_name
+        if budget is None:
+            budget = self.query_budgets[name]
+        self.assertLessEqual(stats.queries, budget,
+                             f"{name} ran {stats.queries} queries, over its budget of {budget}")
+        return stats
@@ -16,3 +16,6 @@ from django.core.wsgi import get_wsgi_application
 # os.environ.setdefault("PYTHON_EGG_CACHE", "/opt/bitnami/apps/django/django_projects/vocastory/egg_cache")
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "mystory.settings")
 application = get_wsgi_application()
+
+from mystory.prewarm import prewarm  # noqa: E402
+prewarm()
@@ -1,10 +1,59 @@
 from django.contrib import admin
 
-from .models import Word, WordSet, Sentence, Story
-from .models import StoryReview
+from django.utils import timezone
 
-admin.site.register(Word)
+from . import dictionary
+from .models import Word, WordForm, WordMeaning, WordSet, Sentence, Story
+from .models import StoryReview, Job
+
+
+class WordFormInline(admin.TabularInline):
+    model = WordForm
+    extra = 0
+
+
+class WordAdmin(admin.ModelAdmin):
+    inlines = [WordFormInline]
+    search_fields = ['text']
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        # Keeps the precomputed forms in sync with the word
+        if not change or 'text' in form.changed_data:
+            obj.build_forms()
+
+
+class WordMeaningAdmin(admin.ModelAdmin):
+    list_display = ['text', 'source', 'updated_at']
+    search_fields = ['text']
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        dictionary.forget([obj.text])
+
+
+class JobAdmin(admin.ModelAdmin):
+    list_display = ['__str__', 'kind', 'status', 'progress', 'attempts', 'created_at', 'updated_at']
+    list_filter = ['status', 'kind']
+    readonly_fields = ['progress', 'created_at', 'updated_at']
+    actions = ['retry']
+
+    def progress(self, obj):
+        if not obj.total:
+            return '-'
+        return f"{obj.done}/{obj.total} ({100 * obj.done // obj.total}%)"
+
+    def retry(self, request, queryset):
+        count = queryset.exclude(status=Job.RUNNING) \
+            .update(status=Job.PENDING, attempts=0, run_after=timezone.now())
+        self.message_user(request, f"{count} jobs queued again")
+    retry.short_description = 'Retry the selected jobs'
+
+
+admin.site.register(Word, WordAdmin)
+admin.site.register(WordMeaning, WordMeaningAdmin)
 admin.site.register(WordSet)
 admin.site.register(Sentence)
 admin.site.register(Story)
 admin.site.register(StoryReview)
+admin.site.register(Job, JobAdmin)
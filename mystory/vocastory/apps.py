@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class VocastoryConfig(AppConfig):
     name = 'vocastory'
+
+    def ready(self):
+        from . import signals  # noqa: F401
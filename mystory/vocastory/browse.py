@@ -0,0 +1,36 @@
+"""
+Querysets of the browse mode, counts are annotated and related
+rows prefetched so that a page costs a fixed number of queries
+"""
+from django.db import models
+from django.db.models import OuterRef, Prefetch, Subquery
+from django.db.models.functions import Coalesce
+
+from .models import Story, Word, WordSet
+
+
+def count_of(queryset, field):
+    """
+    Correlated count of the rows of the queryset whose field is the outer pk
+    """
+    counts = queryset.filter(**{field: OuterRef('pk')}).order_by() \
+        .values(field).annotate(count=models.Count('pk')).values('count')
+    return Coalesce(Subquery(counts, output_field=models.IntegerField()), 0)
+
+
+def word_sets_for_browse():
+    """
+    Word sets with story_count, star_count and word_count, and their words prefetched
+    """
+    return WordSet.objects.annotate(
+        story_count=count_of(Story.objects.all(), 'word_set'),
+        star_count=count_of(WordSet.starred_users.through.objects.all(), 'wordset'),
+        word_count=count_of(WordSet.words.through.objects.all(), 'wordset'),
+    ).prefetch_related(Prefetch('words', queryset=Word.objects.order_by('text'))).order_by('pk')
+
+
+def stories_for_browse(word_set):
+    """
+    Stories of the word set, newest first, with their selected sentences prefetched
+    """
+    return word_set.story_set.order_by('-pk').prefetch_related(Story.prefetch_selected_sentences())
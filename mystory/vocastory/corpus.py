@@ -0,0 +1,263 @@
+"""
+Streaming import and export of word lists (plain text or CSV) and of
+story corpora (NDJSON, one story with its sentences per line).
+Rows are read and written by batches, so memory does not grow with the files
+"""
+import csv
+from itertools import islice
+
+from django.contrib.auth.hashers import make_password
+from django.db import DatabaseError, connection, transaction
+from django.db.models import Max
+from django.db.models.functions import Lower
+from django.utils.dateparse import parse_datetime
+
+from accounts.models import CustomUser
+from .matching import WordMatcher, simple_tokenize
+from .models import Sentence, Story, Word, WordSet
+from .rendering import stylize_text
+
+WORD_MAX_LENGTH = Word._meta.get_field('text').max_length
+
+
+def batched(iterable, size):
+    """
+    :return: iterator of lists of at most size items
+    """
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def read_words(f, format):
+    """
+    :param format: 'txt', one word per line, or 'csv' with a header,
+        a word column and an optional word_set column
+    :return: iterator of (text, word set title or None)
+    """
+    if format == 'csv':
+        reader = csv.DictReader(f)
+        if 'word' not in (reader.fieldnames or []):
+            raise ValueError("CSV word lists need a 'word' column")
+        for row in reader:
+            yield row['word'], row.get('word_set') or None
+    else:
+        for line in f:
+            yield line, None
+
+
+def write_words(f, rows, format):
+    """
+    :param rows: (text, word set title or None) ordered by word
+    """
+    if format == 'csv':
+        writer = csv.writer(f)
+        writer.writerow(['word', 'word_set'])
+        for text, title in rows:
+            writer.writerow([text, title or ''])
+    else:
+        previous = None
+        for text, _ in rows:
+            # One line per word whatever the number of its word sets
+            if text != previous:
+                f.write(text + '\n')
+            previous = text
+
+
+def iter_words(word_set=None):
+    """
+    :return: iterator of (text, word set title or None), streamed from the database
+    """
+    if word_set is not None:
+        rows = word_set.words.order_by('pk').values_list('text')
+        return ((text, word_set.title) for text, in rows.iterator())
+    return Word.objects.order_by('pk', 'wordset__pk') \
+        .values_list('text', 'wordset__title').iterator()
+
+
+def insert_rows(model, objs, batch_size=500):
+    """
+    Bulk inserts the objects, rows are read back on the backends where
+    bulk_create does not set the primary keys
+    :return: the stored objects in the order of objs
+    """
+    if connection.features.can_return_ids_from_bulk_insert:
+        return model.objects.bulk_create(objs, batch_size=batch_size)
+    last = model.objects.aggregate(pk=Max('pk'))['pk'] or 0
+    model.objects.bulk_create(objs, batch_size=batch_size)
+    created = list(model.objects.filter(pk__gt=last).order_by('pk'))
+    if len(created) != len(objs):
+        # Rows of another writer would be paired with the wrong records
+        raise DatabaseError(f"{len(created)} {model._meta.verbose_name_plural} read back "
+                            f"for {len(objs)} inserted, concurrent insert")
+    return created
+
+
+def store_words(texts):
+    """
+    Adds the words missing from the table, existing rows are reused whatever their case
+    :param texts: lowercased texts
+    :return: dict of text -> Word pk, number of words created
+    """
+    texts = set(texts)
+    pks = {}
+    # The oldest row wins when a text is stored more than once
+    for pk, text in Word.objects.annotate(lower=Lower('text')).filter(lower__in=texts) \
+            .order_by('-pk').values_list('pk', 'lower'):
+        pks[text] = pk
+    missing = sorted(texts - set(pks))
+    Word.objects.bulk_create([Word(text=text) for text in missing])
+    pks.update((text, pk) for pk, text in
+               Word.objects.filter(text__in=missing).order_by('-pk').values_list('pk', 'text'))
+    return pks, len(missing)
+
+
+def import_words(entries, get_word_set, batch_size=500):
+    """
+    Stores the words by batches and links them to their word sets,
+    texts are stripped and lowercased, too long ones are skipped
+    :param entries: iterable of (text, word set title or None)
+    :param get_word_set: callable title -> WordSet
+    :return: iterator of (read, created, linked, skipped) per batch
+    """
+    for batch in batched(entries, batch_size):
+        words = []
+        skipped = 0
+        for text, title in batch:
+            text = text.strip().lower()
+            if not text:
+                continue
+            if len(text) > WORD_MAX_LENGTH:
+                skipped += 1
+                continue
+            words.append((text, title))
+        with transaction.atomic():
+            pks, created = store_words(text for text, _ in words)
+            links = {}
+            for text, title in words:
+                if title is not None:
+                    links.setdefault(title, set()).add(pks[text])
+            for title, word_ids in links.items():
+                # Sends m2m_changed, the stories and the meaning prefetch follow
+                get_word_set(title).words.add(*word_ids)
+        yield len(batch), created, sum(len(ids) for ids in links.values()), skipped
+
+
+def iter_stories(stories, batch_size=500):
+    """
+    Story records with their sentences in order, read by batches of stories
+    :return: iterator of dicts
+    """
+    last = 0
+    while True:
+        batch = list(stories.filter(pk__gt=last).order_by('pk')
+                     .values_list('pk', 'word_set__title', 'completed', 'creation_date')[:batch_size])
+        if not batch:
+            return
+        last = batch[-1][0]
+        sentences = {}
+        rows = Sentence.objects.filter(story__in=[pk for pk, _, _, _ in batch]) \
+            .order_by('story', 'order', 'pk') \
+            .values_list('story', 'order', 'text', 'creator__username', 'is_selected', 'creation_date')
+        for story, order, text, creator, selected, date in rows:
+            sentences.setdefault(story, []).append({
+                'order': order,
+                'text': text,
+                'creator': creator,
+                'is_selected': selected,
+                'creation_date': date.isoformat(),
+            })
+        for pk, title, completed, date in batch:
+            yield {
+                'word_set': title,
+                'completed': completed,
+                'creation_date': date.isoformat(),
+                'sentences': sentences.get(pk, []),
+            }
+
+
+class StoryImporter:
+    """
+    Stores story records by batches. Word sets are found by title, stories
+    of unknown word sets are skipped; unknown creators are created without
+    a usable password. The sentences are linked to the words again
+    """
+
+    def __init__(self):
+        self.word_sets = {}
+        self.users = {}
+        self.password = make_password(None)
+
+    def get_word_set(self, title):
+        """
+        :return: (WordSet, WordMatcher), None if there is no such word set
+        """
+        if title not in self.word_sets:
+            word_set = WordSet.objects.filter(title=title).order_by('pk').first()
+            self.word_sets[title] = word_set and (word_set, WordMatcher.for_word_set(word_set))
+        return self.word_sets[title]
+
+    def load_users(self, usernames):
+        missing = set(usernames) - set(self.users)
+        for chunk in batched(sorted(missing), 500):
+            self.users.update(CustomUser.objects.filter(username__in=chunk)
+                              .values_list('username', 'pk'))
+            new = [username for username in chunk if username not in self.users]
+            CustomUser.objects.bulk_create(
+                [CustomUser(username=username, password=self.password) for username in new])
+            self.users.update(CustomUser.objects.filter(username__in=new)
+                              .values_list('username', 'pk'))
+
+    def import_records(self, records, batch_size=500):
+        """
+        :return: iterator of (stories, sentences, skipped) per batch
+        """
+        for batch in batched(records, batch_size):
+            yield self.store(batch)
+
+    @transaction.atomic
+    def store(self, records):
+        known = []
+        for record in records:
+            found = self.get_word_set(record['word_set'])
+            if found is not None:
+                known.append((record, found))
+        self.load_users(s['creator'] for record, _ in known for s in record['sentences'])
+
+        stories = insert_rows(Story, [
+            Story(word_set=word_set, completed=record.get('completed', False))
+            for record, (word_set, _) in known])
+
+        sentences = []
+        for story, (record, (_, matcher)) in zip(stories, known):
+            set_creation_date(story, record)
+            for entry in record['sentences']:
+                matches = matcher.match(simple_tokenize(entry['text']))
+                sentences.append((entry, matches, Sentence(
+                    story=story, creator_id=self.users[entry['creator']], order=entry['order'],
+                    text=entry['text'], stylized_text=stylize_text(entry['text'], matches),
+                    is_selected=entry.get('is_selected', False))))
+        created = insert_rows(Sentence, [sentence for _, _, sentence in sentences])
+
+        used_words = []
+        for sentence, (entry, matches, _) in zip(created, sentences):
+            set_creation_date(sentence, entry)
+            used_words.extend(Sentence.used_words.through(sentence_id=sentence.pk, word_id=word_id)
+                              for word_id in set(m.word.pk for m in matches))
+        Sentence.used_words.through.objects.bulk_create(used_words, batch_size=500)
+        # creation_date is set on insert whatever the value, the original dates are written back
+        Story.objects.bulk_update(stories, ['creation_date'], batch_size=500)
+        Sentence.objects.bulk_update(created, ['creation_date'], batch_size=500)
+        if stories:
+            # Rows of a concurrent writer in the range only get their state rebuilt
+            Story.rebuild_state(Story.objects.filter(pk__range=(stories[0].pk, stories[-1].pk)))
+        return len(stories), len(created), len(records) - len(known)
+
+
+def set_creation_date(obj, record):
+    date = parse_datetime(record.get('creation_date') or '')
+    if date is not None:
+        obj.creation_date = date
@@ -0,0 +1,223 @@
+"""
+Word meanings served from the local WordMeaning store
+
+Entries are bulk loaded with ``import_meanings``. Words missing from the
+store are optionally fetched once from a remote dictionary, with a timeout,
+and stored, configured with the ``VOCASTORY_DICTIONARY`` setting:
+
+- ``REMOTE``: dotted path of a callable text -> meanings or None, None is offline
+- ``TIMEOUT``: seconds to wait for the remote dictionary
+- ``MAX_PENDING``: remote lookups of the requests running at once, hung ones
+  included; the lookups past it are skipped
+- ``PREFETCH_CONCURRENCY``: parallel remote lookups of the prefetch jobs
+"""
+import threading
+import time
+import warnings
+from concurrent.futures import ThreadPoolExecutor, wait
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from mystory.instrumentation import timed
+from .models import WordMeaning
+
+DEFAULTS = {
+    'REMOTE': None,
+    'TIMEOUT': 2.0,
+    'MAX_PENDING': 4,
+    # Parallel remote lookups of a prefetch job
+    'PREFETCH_CONCURRENCY': 4,
+    'CACHE_TIMEOUT': 60 * 60 * 24,
+    # Words found nowhere are retried after this
+    'MISS_TIMEOUT': 60 * 60,
+}
+
+_remote = None
+# Remote lookups of the requests that have not returned yet
+_pending = 0
+_pending_lock = threading.Lock()
+
+
+def get_config():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'VOCASTORY_DICTIONARY', {}))
+    return config
+
+
+def fetch_pydictionary(text):
+    """
+    Remote lookup through PyDictionary, scrapes a web site
+    """
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        from PyDictionary import PyDictionary
+    return PyDictionary().meaning(text)
+
+
+def get_remote():
+    global _remote
+    if _remote is None:
+        path = get_config()['REMOTE']
+        _remote = import_string(path) if path else False
+    return _remote
+
+
+@receiver(setting_changed)
+def reset_remote(setting, **kwargs):
+    global _remote
+    if setting == 'VOCASTORY_DICTIONARY':
+        _remote = None
+
+
+def load():
+    """
+    Resolves the remote dictionary ahead of the first lookup
+    """
+    get_remote()
+
+
+def fetch_remote(text):
+    """
+    :return: meanings of the remote dictionary, None on miss, error or timeout
+    """
+    global _pending
+    remote = get_remote()
+    if not remote:
+        return None
+    config = get_config()
+    with _pending_lock:
+        if _pending >= config['MAX_PENDING']:
+            # Hung lookups hold every slot, the remote dictionary is not asked
+            return None
+        _pending += 1
+    result = {}
+
+    def run():
+        global _pending
+        try:
+            result['meanings'] = remote(text)
+        except Exception:
+            # Network or parsing error, the page renders without meanings
+            pass
+        finally:
+            with _pending_lock:
+                _pending -= 1
+
+    # A thread of its own, abandoned on timeout, so a hung lookup never blocks the next ones
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    thread.join(config['TIMEOUT'])
+    return result.get('meanings') or None
+
+
+def cache_key(text):
+    return f"meaning:{quote(text)}"
+
+
+@timed('dict')
+def lookup(text):
+    """
+    Read through the cache, the store and the remote dictionary
+    :return: dict of part of speech -> definitions, None if not found
+    """
+    text = text.lower()
+    config = get_config()
+    key = cache_key(text)
+    meanings = cache.get(key)
+    if meanings is not None:
+        return meanings or None
+
+    entry = WordMeaning.objects.filter(text=text).first()
+    if entry is not None:
+        meanings = entry.get_meanings()
+    else:
+        meanings = fetch_remote(text)
+        if meanings:
+            store({text: meanings}, source=config['REMOTE'])
+
+    if meanings:
+        cache.set(key, meanings, config['CACHE_TIMEOUT'])
+    else:
+        # Empty dict marks the miss
+        cache.set(key, {}, config['MISS_TIMEOUT'])
+    return meanings or None
+
+
+def stored(texts):
+    """
+    :return: set of the lowercase texts having an entry in the store
+    """
+    return set(WordMeaning.objects.filter(text__in=[t.lower() for t in texts])
+               .values_list('text', flat=True))
+
+
+def store(entries, source=''):
+    """
+    Adds the entries missing from the store
+    :param entries: dict of text -> meanings
+    """
+    WordMeaning.objects.bulk_create(
+        [WordMeaning.create(text, meanings, source) for text, meanings in entries.items()],
+        ignore_conflicts=True)
+    forget(entries)
+
+
+def prefetch(texts, progress=None, chunk_size=20, deadline=None):
+    """
+    Fetches and stores the meanings of the texts from the remote dictionary,
+    at most PREFETCH_CONCURRENCY lookups at a time
+    :param progress: called with the number of texts processed after each chunk
+    :param deadline: time.monotonic() after which the remaining texts are given up
+    :return: list of the texts whose lookup failed, not found is not a failure
+    """
+    remote = get_remote()
+    if not remote:
+        return []
+    config = get_config()
+    concurrency = config['PREFETCH_CONCURRENCY']
+    failed = []
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    try:
+        for i in range(0, len(texts), chunk_size):
+            if deadline is not None and time.monotonic() >= deadline:
+                failed.extend(texts[i:])
+                break
+            chunk = texts[i:i + chunk_size]
+            futures = [executor.submit(remote, text) for text in chunk]
+            # Each worker gets TIMEOUT per lookup of its share of the chunk
+            timeout = config['TIMEOUT'] * -(-len(chunk) // concurrency)
+            if deadline is not None:
+                timeout = max(0, min(timeout, deadline - time.monotonic()))
+            wait(futures, timeout=timeout)
+            found = {}
+            for text, future in zip(chunk, futures):
+                if not future.done():
+                    future.cancel()
+                    failed.append(text)
+                    continue
+                try:
+                    meanings = future.result()
+                except Exception:
+                    failed.append(text)
+                    continue
+                if meanings:
+                    found[text] = meanings
+            store(found, source=config['REMOTE'])
+            if progress is not None:
+                progress(i + len(chunk))
+    finally:
+        # A hung lookup keeps its thread but never holds the job past its deadline
+        executor.shutdown(wait=False)
+    return failed
+
+
+def forget(texts):
+    """
+    Drops the cached lookups of the words, after their entries changed
+    """
+    cache.delete_many([cache_key(t.lower()) for t in texts])
@@ -0,0 +1,67 @@
+"""
+Set based versions of Story.is_readable, is_writable and is_reviewable,
+each evaluates all the stories for a user in a single query
+"""
+import random
+
+from django.db import models
+from django.db.models import Exists, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from .models import Sentence, Story, StoryReview
+
+
+def in_open_round(sentences):
+    """
+    Keeps the sentences that are candidates of the open poll of their story
+    """
+    return sentences.filter(order=F('story__selected_order') + 1)
+
+
+def readable_stories(user):
+    """
+    Open stories with more than two candidates of other users,
+    none of which the user voted for
+    """
+    others = Sentence.objects \
+        .filter(story=OuterRef('pk'), order=OuterRef('selected_order') + 1) \
+        .exclude(creator=user)
+    other_count = others.order_by().values('story') \
+        .annotate(count=models.Count('pk')).values('count')
+    other_count = Subquery(other_count, output_field=models.IntegerField())
+    # Evaluated once from the votes of the user, not per story
+    voted = in_open_round(Sentence.objects.filter(voted_users=user).exclude(creator=user))
+    stories = Story.objects.filter(completed=False, word_set__isnull=False,
+                                   candidate_count__gt=2)
+    return stories.annotate(other_candidates=Coalesce(other_count, 0)) \
+        .filter(other_candidates__gt=2) \
+        .exclude(pk__in=voted.values('story'))
+
+
+def writable_stories(user):
+    """
+    Open stories the user has no candidate sentence in
+    """
+    written = in_open_round(Sentence.objects.filter(creator=user))
+    return Story.objects.filter(completed=False, word_set__isnull=False) \
+        .exclude(pk__in=written.values('story'))
+
+
+def reviewable_stories(user):
+    """
+    Completed stories the user did not review
+    """
+    reviews = StoryReview.objects.filter(story=OuterRef('pk'), creator=user)
+    return Story.objects.filter(completed=True, word_set__isnull=False) \
+        .annotate(reviewed=Exists(reviews)).filter(reviewed=False)
+
+
+def pick_random(queryset):
+    """
+    Samples one row with a count and an offset query
+    :return: random object of the queryset, None if empty
+    """
+    count = queryset.count()
+    if count == 0:
+        return None
+    return queryset.order_by('pk')[random.randrange(count)]
@@ -0,0 +1,95 @@
+"""
+Precomputed word forms, so matching can look raw tokens up
+in a table instead of running the NLP model on every sentence
+"""
+from . import nlp
+
+VOWELS = 'aeiou'
+
+# Irregular inflections the suffix rules can not produce, form -> lemma
+IRREGULAR = {
+    'am': 'be', 'is': 'be', 'are': 'be', 'was': 'be', 'were': 'be', 'been': 'be',
+    'has': 'have', 'had': 'have', 'did': 'do', 'does': 'do', 'done': 'do',
+    'went': 'go', 'gone': 'go', 'ran': 'run', 'saw': 'see', 'seen': 'see',
+    'made': 'make', 'took': 'take', 'taken': 'take', 'came': 'come',
+    'began': 'begin', 'begun': 'begin', 'broke': 'break', 'broken': 'break',
+    'brought': 'bring', 'bought': 'buy', 'caught': 'catch', 'chose': 'choose',
+    'chosen': 'choose', 'drew': 'draw', 'drawn': 'draw', 'drove': 'drive',
+    'driven': 'drive', 'ate': 'eat', 'eaten': 'eat', 'fell': 'fall',
+    'fallen': 'fall', 'felt': 'feel', 'fought': 'fight', 'found': 'find',
+    'flew': 'fly', 'flown': 'fly', 'forgot': 'forget', 'forgotten': 'forget',
+    'gave': 'give', 'given': 'give', 'grew': 'grow', 'grown': 'grow',
+    'knew': 'know', 'known': 'know', 'led': 'lead', 'left': 'leave',
+    'lost': 'lose', 'meant': 'mean', 'met': 'meet', 'paid': 'pay',
+    'rode': 'ride', 'ridden': 'ride', 'rose': 'rise', 'risen': 'rise',
+    'said': 'say', 'sold': 'sell', 'sent': 'send', 'shook': 'shake',
+    'shaken': 'shake', 'sang': 'sing', 'sung': 'sing', 'sat': 'sit',
+    'slept': 'sleep', 'spoke': 'speak', 'spoken': 'speak', 'stood': 'stand',
+    'stole': 'steal', 'stolen': 'steal', 'swam': 'swim', 'swum': 'swim',
+    'taught': 'teach', 'told': 'tell', 'thought': 'think', 'threw': 'throw',
+    'thrown': 'throw', 'understood': 'understand', 'woke': 'wake',
+    'woken': 'wake', 'wore': 'wear', 'worn': 'wear', 'won': 'win',
+    'wrote': 'write', 'written': 'write', 'better': 'good', 'best': 'good',
+    'worse': 'bad', 'worst': 'bad',
+    'children': 'child', 'men': 'man', 'women': 'woman', 'mice': 'mouse',
+    'feet': 'foot', 'teeth': 'tooth', 'geese': 'goose', 'people': 'person',
+}
+
+
+def is_cvc(word):
+    """
+    Consonant-vowel-consonant ending, doubles the last letter: stop -> stopped
+    """
+    return (len(word) >= 3 and word[-1] not in VOWELS + 'wxy'
+            and word[-2] in VOWELS and word[-3] not in VOWELS)
+
+
+def candidate_forms(lemma):
+    """
+    Regular and irregular inflections the lemma might have,
+    candidates are verified by the NLP model
+    """
+    lemma = lemma.lower()
+    forms = {lemma}
+    forms.update(f for f, l in IRREGULAR.items() if l == lemma)
+    if ' ' in lemma or not lemma.isalpha():
+        return forms
+
+    if lemma.endswith(('s', 'x', 'z', 'ch', 'sh')):
+        forms.add(lemma + 'es')
+    elif lemma.endswith('y') and len(lemma) > 1 and lemma[-2] not in VOWELS:
+        forms.update([lemma[:-1] + 'ies', lemma[:-1] + 'ied',
+                      lemma[:-1] + 'ier', lemma[:-1] + 'iest'])
+    else:
+        forms.add(lemma + 's')
+
+    if lemma.endswith('ie'):
+        forms.update([lemma + 'd', lemma[:-2] + 'ying'])
+    elif lemma.endswith('e'):
+        forms.update([lemma + 'd', lemma[:-1] + 'ing', lemma + 'r', lemma + 'st'])
+    elif is_cvc(lemma):
+        stem = lemma + lemma[-1]
+        forms.update([stem + 'ed', stem + 'ing', stem + 'er', stem + 'est'])
+    if not lemma.endswith('e'):
+        forms.update([lemma + 'ed', lemma + 'ing', lemma + 'er', lemma + 'est'])
+    return forms
+
+
+def build_forms(words, engine=None):
+    """
+    Bulk lemmatizes the candidate forms of the words in one NLP pass
+    :return: dict of word -> set of forms whose lemma is the word
+    """
+    candidates = []
+    for word in words:
+        base = word.text.lower()
+        candidates.extend((word, base, f) for f in sorted(candidate_forms(base)))
+
+    analyses = (engine or nlp.analyze_many)([f for _, _, f in candidates])
+    forms = {word: {word.text.lower()} for word in words}
+    for (word, base, form), tokens in zip(candidates, analyses):
+        if IRREGULAR.get(form) == base:
+            forms[word].add(form)
+        elif len(tokens) == 1 and tokens[0].lemma_.lower() == base:
+            forms[word].add(form)
+    return forms
@@ -0,0 +1,108 @@
+"""
+Job queue backed by the Job table, no broker needed
+
+Jobs are enqueued in the transaction of the change that needs them and
+run by ``python manage.py run_jobs``. A failing job is retried with a
+growing delay until it runs out of attempts.
+"""
+import json
+import time
+import traceback
+
+from django.db.models import Q
+from django.utils import timezone
+
+from . import dictionary
+from .models import Job, Word
+
+# Seconds before the first retry, doubled on each attempt
+RETRY_DELAY = 30
+# A running job not updated for this long is considered abandoned by its worker
+LEASE = timezone.timedelta(minutes=10)
+
+HANDLERS = {}
+
+
+def handler(kind):
+    """
+    Registers the function running the jobs of a kind,
+    called with the job and its payload as keyword arguments
+    """
+    def register(func):
+        HANDLERS[kind] = func
+        return func
+    return register
+
+
+def enqueue(kind, **payload):
+    return Job.objects.create(kind=kind, payload=json.dumps(payload))
+
+
+def due_jobs(now=None):
+    now = now or timezone.now()
+    return Job.objects.filter(
+        Q(status=Job.PENDING, run_after__lte=now)
+        | Q(status=Job.RUNNING, updated_at__lt=now - LEASE))
+
+
+def claim(job):
+    """
+    Marks the job running unless another worker claimed it first
+    :return: True if claimed
+    """
+    claimed = Job.objects.filter(pk=job.pk, status=job.status, updated_at=job.updated_at) \
+        .update(status=Job.RUNNING, attempts=job.attempts + 1, updated_at=timezone.now())
+    if claimed:
+        job.refresh_from_db()
+    return bool(claimed)
+
+
+def run(job):
+    """
+    Runs a claimed job, reschedules it on failure
+    :return: the job status
+    """
+    try:
+        HANDLERS[job.kind](job, **job.get_payload())
+    except Exception:
+        job.error = traceback.format_exc()
+        if job.attempts < job.max_attempts:
+            job.status = Job.PENDING
+            job.run_after = timezone.now() + timezone.timedelta(
+                seconds=RETRY_DELAY * 2 ** (job.attempts - 1))
+        else:
+            job.status = Job.FAILED
+    else:
+        job.status = Job.DONE
+        job.error = ''
+    job.save()
+    return job.status
+
+
+def run_due(limit=None):
+    """
+    Claims and runs the due jobs one by one
+    :return: number of jobs run
+    """
+    count = 0
+    for job in due_jobs().order_by('run_after')[:limit]:
+        if claim(job):
+            run(job)
+            count += 1
+    return count
+
+
+@handler('prefetch_meanings')
+def prefetch_meanings(job, word_ids):
+    """
+    Stores the meanings of the words missing from the dictionary store
+    """
+    texts = set(t.lower() for t in Word.objects.filter(pk__in=word_ids).values_list('text', flat=True))
+    missing = sorted(texts - dictionary.stored(texts))
+    job.set_progress(0, len(missing))
+    # Returns before the lease expires, so that the job never runs twice at once
+    deadline = time.monotonic() + LEASE.total_seconds() / 2
+    failed = dictionary.prefetch(missing, progress=job.set_progress, deadline=deadline)
+    if failed:
+        # The retry only fetches the words still missing
+        raise RuntimeError(f"Could not fetch {len(failed)} words: {', '.join(failed[:20])}")
@@ -0,0 +1,207 @@
+"""
+Process wide lemma cache in front of the NLP engine
+
+Sentences whose words were all lemmatized before are answered
+without calling the engine, configured by ``VOCASTORY_LEMMA_CACHE``.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+from . import nlp
+from .matching import Token, simple_tokenize
+
+DEFAULTS = {
+    'SIZE': 50000,
+    # Whole sentence analyses, 0 disables
+    'SENTENCE_SIZE': 0,
+    # Alias of a Django cache shared between processes, None disables
+    'BACKEND': None,
+    'TIMEOUT': None,
+    'KEY_PREFIX': 'lemma',
+}
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+class LRUCache:
+    """
+    Bounded thread safe mapping evicting the least recently used keys
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.data)
+
+    def get(self, key, default=None):
+        with self.lock:
+            try:
+                self.data.move_to_end(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self.hits += 1
+            return self.data[key]
+
+    def set(self, key, value):
+        if self.size <= 0:
+            return
+        with self.lock:
+            self.data[key] = value
+            self.data.move_to_end(key)
+            while len(self.data) > self.size:
+                self.data.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+            self.hits = self.misses = 0
+
+
+class LemmaCache:
+    """
+    Maps lowercase surface forms to lemmas
+    """
+
+    def __init__(self, config):
+        self.lemmas = LRUCache(config['SIZE'])
+        self.sentences = LRUCache(config['SENTENCE_SIZE'])
+        self.backend = caches[config['BACKEND']] if config['BACKEND'] else None
+        self.timeout = config['TIMEOUT']
+        self.prefix = config['KEY_PREFIX']
+        self.lock = threading.Lock()
+        self.nlp_calls = 0
+        self.nlp_skipped = 0
+        self.nlp_time = 0.0
+
+    def backend_key(self, form):
+        return f"{self.prefix}:{form}"
+
+    def lookup(self, forms):
+        """
+        :return: dict of the cached lemmas of the forms
+        """
+        found = {}
+        missing = []
+        for form in forms:
+            lemma = self.lemmas.get(form)
+            if lemma is None:
+                missing.append(form)
+            else:
+                found[form] = lemma
+        if missing and self.backend is not None:
+            keys = {self.backend_key(f): f for f in missing}
+            for key, lemma in self.backend.get_many(list(keys)).items():
+                found[keys[key]] = lemma
+                self.lemmas.set(keys[key], lemma)
+        return found
+
+    def store(self, tokens):
+        new = {}
+        for t in tokens:
+            if t.text.isalpha():
+                form = t.text.lower()
+                if form not in new:
+                    new[form] = t.lemma_
+                    self.lemmas.set(form, t.lemma_)
+        if new and self.backend is not None:
+            self.backend.set_many(
+                {self.backend_key(f): l for f, l in new.items()}, self.timeout)
+
+    def analyze(self, text, engine=None):
+        """
+        Tokens of the text, the engine is called only
+        when a word of the text is not cached
+        """
+        tokens = self.sentences.get(text) if self.sentences.size else None
+        if tokens is not None:
+            self.count(skipped=True)
+            return tokens
+
+        words = simple_tokenize(text)
+        lemmas = self.lookup(set(w.text.lower() for w in words))
+        if words and all(w.text.lower() in lemmas for w in words):
+            tokens = [Token(w.text, lemmas[w.text.lower()], w.idx) for w in words]
+            self.count(skipped=True)
+        else:
+            start = time.perf_counter()
+            tokens = (engine or nlp.analyze)(text)
+            self.count(elapsed=time.perf_counter() - start)
+            self.store(tokens)
+        self.sentences.set(text, tokens)
+        return tokens
+
+    def count(self, skipped=False, elapsed=0.0):
+        with self.lock:
+            if skipped:
+                self.nlp_skipped += 1
+            else:
+                self.nlp_calls += 1
+                self.nlp_time += elapsed
+
+    def stats(self):
+        """
+        Counters of the cache, saved_time estimates the NLP time spared
+        from the average duration of the engine calls
+        """
+        average = self.nlp_time / self.nlp_calls if self.nlp_calls else 0.0
+        return {
+            'size': len(self.lemmas),
+            'hits': self.lemmas.hits,
+            'misses': self.lemmas.misses,
+            'sentence_hits': self.sentences.hits,
+            'nlp_calls': self.nlp_calls,
+            'nlp_skipped': self.nlp_skipped,
+            'nlp_time': self.nlp_time,
+            'saved_time': average * self.nlp_skipped,
+        }
+
+    def clear(self):
+        self.lemmas.clear()
+        self.sentences.clear()
+        with self.lock:
+            self.nlp_calls = self.nlp_skipped = 0
+            self.nlp_time = 0.0
+
+
+def get_config():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'VOCASTORY_LEMMA_CACHE', {}))
+    return config
+
+
+def get_lemma_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = LemmaCache(get_config())
+    return _cache
+
+
+@receiver(setting_changed)
+def reset_lemma_cache(setting, **kwargs):
+    global _cache
+    # Cached lemmas depend on the engine that produced them
+    if setting in ('VOCASTORY_LEMMA_CACHE', 'VOCASTORY_NLP'):
+        _cache = None
+
+
+def analyze(text):
+    """
+    Tokenizes and lemmatizes the sentence through the lemma cache
+    :return: list of Token
+    """
+    return get_lemma_cache().analyze(text)
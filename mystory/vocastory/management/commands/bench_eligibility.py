@@ -0,0 +1,77 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from accounts.models import CustomUser
+from vocastory.eligibility import readable_stories, writable_stories, reviewable_stories
+from vocastory.eligibility import pick_random
+from vocastory.models import Sentence, Story, WordSet
+
+CHECKS = (
+    ('readable', Story.is_readable, readable_stories),
+    ('writable', Story.is_writable, writable_stories),
+    ('reviewable', Story.is_reviewable, reviewable_stories),
+)
+
+
+class Command(BaseCommand):
+    help = 'Compares per-story eligibility checks with the set based queries ' \
+           'on synthetic stories, the data is rolled back afterwards'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stories', type=int, default=10000)
+        parser.add_argument('--users', type=int, default=20)
+        parser.add_argument('--skip-legacy', action='store_true',
+                            help='Only runs the set based queries')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            user = self.generate(options['stories'], options['users'])
+            for name, check, bulk in CHECKS:
+                if not options['skip_legacy']:
+                    self.measure(f'legacy {name}', lambda: [
+                        s for s in Story.objects.filter(word_set__isnull=False)
+                        if check(s, user)])
+                self.measure(f'bulk {name}', lambda: pick_random(bulk(user)))
+            transaction.set_rollback(True)
+
+    def measure(self, name, func):
+        queries = []
+
+        def count(execute, sql, params, many, context):
+            queries.append(sql)
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(count):
+            start = time.perf_counter()
+            func()
+            elapsed = time.perf_counter() - start
+        self.stdout.write(f"{name:>18} queries={len(queries):6d} "
+                          f"time={elapsed * 1000:10.2f}ms")
+
+    def generate(self, n_stories, n_users):
+        rng = random.Random(0)
+        CustomUser.objects.bulk_create(
+            CustomUser(username=f'bench-eligibility-{i}') for i in range(n_users))
+        users = list(CustomUser.objects.filter(username__startswith='bench-eligibility-'))
+        word_set = WordSet.objects.create(title='bench', creator=users[0])
+        Story.objects.bulk_create(
+            Story(word_set=word_set, completed=rng.random() < 0.2) for _ in range(n_stories))
+        stories = list(Story.objects.filter(word_set=word_set).values_list('pk', 'completed'))
+
+        sentences = []
+        for pk, completed in stories:
+            rounds = rng.randint(0, 4)
+            for order in range(rounds + (0 if completed else 1)):
+                selected = order < rounds
+                writers = rng.sample(users, rng.randint(1, 5))
+                for i, creator in enumerate(writers):
+                    sentences.append(Sentence(
+                        story_id=pk, creator=creator, order=order, text='Bench sentence.',
+                        is_selected=selected and i == 0))
+        Sentence.objects.bulk_create(sentences, batch_size=500)
+        Story.rebuild_state(Story.objects.filter(word_set=word_set))
+        self.stdout.write(f"Generated {n_stories} stories, {len(sentences)} sentences")
+        return users[0]
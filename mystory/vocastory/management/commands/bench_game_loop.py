@@ -0,0 +1,197 @@
+import json
+import random
+import time
+from collections import Counter
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test import Client, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from accounts.models import CustomUser
+from vocastory.eligibility import readable_stories, writable_stories, reviewable_stories
+from vocastory.eligibility import pick_random
+from vocastory.models import Sentence, Story, StoryReview, Vote, WordSet
+
+SCENARIOS = ['home', 'see_leaderboard', 'play', 'read_story', 'write_story',
+             'review_story', 'charts']
+
+
+def percentile(values, fraction):
+    """
+    Nearest rank percentile
+    """
+    values = sorted(values)
+    return values[max(0, round(fraction * len(values)) - 1)]
+
+
+class Command(BaseCommand):
+    help = 'Drives the game loop views through the test client as random players and ' \
+           'reports the p50/p95 latency and the queries of each view, the data is rolled back'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=50)
+        parser.add_argument('--players', type=int, default=20,
+                            help='Users picked at random to play the iterations')
+        parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=SCENARIOS)
+        parser.add_argument('--cold-cache', action='store_true',
+                            help='Clears the cache before each request')
+        parser.add_argument('--nlp-engine', help='Overrides VOCASTORY_NLP ENGINE, e.g. stub')
+        parser.add_argument('--output', help='Writes the results as JSON to this path')
+        parser.add_argument('--compare', help='JSON results of an earlier run to compare with')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        # pick_random and the play view draw from the global generator
+        state = random.getstate()
+        random.seed(options['seed'])
+        try:
+            self.run(options)
+        finally:
+            random.setstate(state)
+
+    def run(self, options):
+        players = list(CustomUser.objects.order_by('pk').values_list('pk', flat=True))
+        if not players or not WordSet.objects.exists():
+            raise CommandError('No users or word sets, run generate_load first')
+        players = [CustomUser.objects.get(pk=pk) for pk in
+                   self.rng.sample(players, min(options['players'], len(players)))]
+
+        overrides = {}
+        if options['nlp_engine']:
+            overrides['VOCASTORY_NLP'] = {'ENGINE': options['nlp_engine']}
+        self.client = Client()
+        self.cold_cache = options['cold_cache']
+        self.samples = {}
+        before = self.get_dataset()
+        with override_settings(**overrides), transaction.atomic():
+            for i in range(options['iterations']):
+                user = players[i % len(players)]
+                self.client.force_login(user)
+                for scenario in options['scenarios']:
+                    getattr(self, f'play_{scenario}')(user)
+            # Rows written by the views, counted before the rollback
+            written = {key: count - before[key] for key, count in self.get_dataset().items()}
+            transaction.set_rollback(True)
+
+        results = {
+            'created_at': timezone.now().isoformat(),
+            'options': {k: options[k] for k in ('iterations', 'players', 'scenarios',
+                                                'cold_cache', 'nlp_engine', 'seed')},
+            'dataset': self.get_dataset(),
+            'written': written,
+            'views': {key: self.summarize(samples) for key, samples in self.samples.items()},
+        }
+        previous = None
+        if options['compare']:
+            with open(options['compare'], encoding='utf-8') as f:
+                previous = json.load(f)['views']
+        self.write_table(results['views'], previous)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump(results, f, indent=2)
+
+    def request(self, method, path, data=None):
+        """
+        Times one request, the samples are grouped by view name and method
+        """
+        if self.cold_cache:
+            cache.clear()
+        start = time.perf_counter()
+        try:
+            response = getattr(self.client, method)(path, data)
+        except Exception as e:
+            self.samples.setdefault(f'{path} {method.upper()}', []).append((None, None, repr(e)))
+            return None
+        elapsed = time.perf_counter() - start
+        key = f'{response.resolver_match.url_name} {method.upper()}'
+        self.samples.setdefault(key, []).append((elapsed, response.instrumentation,
+                                                 response.status_code))
+        return response
+
+    def summarize(self, samples):
+        timed = [(elapsed, stats) for elapsed, stats, _ in samples if elapsed is not None]
+        summary = {
+            'requests': len(samples),
+            'statuses': dict(Counter(str(status) for _, _, status in samples)),
+        }
+        if timed:
+            latencies = [elapsed * 1000 for elapsed, _ in timed]
+            queries = [stats.queries for _, stats in timed]
+            summary.update({
+                'p50_ms': percentile(latencies, 0.5),
+                'p95_ms': percentile(latencies, 0.95),
+                'max_ms': max(latencies),
+                'queries_p50': percentile(queries, 0.5),
+                'queries_max': max(queries),
+                'db_p50_ms': percentile([s.timings['db'] * 1000 for _, s in timed], 0.5),
+                'template_p50_ms': percentile([s.timings['template'] * 1000 for _, s in timed], 0.5),
+            })
+        return summary
+
+    def write_table(self, views, previous=None):
+        self.stdout.write(f"{'view':>24} {'requests':>8} {'p50':>9} {'p95':>9} "
+                          f"{'queries':>7} {'max':>4}")
+        for key, summary in sorted(views.items()):
+            if 'p50_ms' not in summary:
+                self.stdout.write(f"{key:>24} {summary['requests']:8d} failed: "
+                                  f"{', '.join(summary['statuses'])}")
+                continue
+            line = f"{key:>24} {summary['requests']:8d} {summary['p50_ms']:7.1f}ms " \
+                   f"{summary['p95_ms']:7.1f}ms {summary['queries_p50']:7d} {summary['queries_max']:4d}"
+            before = (previous or {}).get(key)
+            if before and 'p50_ms' in before:
+                line += f"  p50 {summary['p50_ms'] / before['p50_ms']:5.2f}x " \
+                        f"queries {summary['queries_max'] - before['queries_max']:+d}"
+            self.stdout.write(line)
+
+    def get_dataset(self):
+        return {model.__name__: model.objects.count()
+                for model in (CustomUser, WordSet, Story, Sentence, Vote, StoryReview)}
+
+    def play_home(self, user):
+        self.request('get', reverse('home'))
+
+    def play_see_leaderboard(self, user):
+        self.request('get', reverse('see_leaderboard'))
+
+    def play_play(self, user):
+        self.request('get', reverse('play'))
+
+    def play_read_story(self, user):
+        story = pick_random(readable_stories(user))
+        if story is None:
+            return
+        self.request('get', story.get_read_url())
+        order = story.get_candidate_index()
+        candidates = story.get_candidate_sentences(order).exclude(creator=user)
+        choice = self.rng.choice(list(candidates.values_list('pk', flat=True)))
+        self.request('post', story.get_read_url(), {'order': order, 'sentence_choice': choice})
+
+    def play_write_story(self, user):
+        story = pick_random(writable_stories(user))
+        if story is None:
+            return
+        self.request('get', story.get_write_url())
+        words = [w.text for w in story.word_set.words.all()] or ['word']
+        text = f"Then the {self.rng.choice(words)} came back."
+        self.request('post', story.get_write_url(),
+                     {'order': story.get_candidate_index(), 'sentence': text})
+
+    def play_review_story(self, user):
+        story = pick_random(reviewable_stories(user))
+        if story is None:
+            return
+        url = reverse('review_story', args=[story.pk])
+        self.request('get', url)
+        self.request('post', url, {'coherence': self.rng.randint(1, 10),
+                                   'creativity': self.rng.randint(1, 10),
+                                   'fun': self.rng.randint(1, 10), 'comment': 'Bench review'})
+
+    def play_charts(self, user):
+        self.request('get', reverse('see_sentences'))
+        self.request('get', reverse('see_users'))
+        self.request('get', reverse('see_chart', args=['votes']))
@@ -0,0 +1,91 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from vocastory.matching import WordMatcher, simple_tokenize
+from vocastory.models import WordSet
+from vocastory.rendering import get_dic_reference, stylize_text
+
+FILLER = ['the', 'a', 'quick', 'story', 'went', 'over', 'and', 'then',
+          'nobody', 'could', 'believe', 'it', 'again', 'with', 'friends']
+
+
+def legacy_match(word_set, tokens):
+    """
+    Per-token lookup that Sentence.create used to run
+    """
+    used_words = set()
+    for t in tokens:
+        found_words = word_set.words.filter(text=t.lemma_.lower())
+        found_exact = word_set.words.filter(text=t.text.lower())
+        if found_words.exists():
+            used_words.add(found_words.first())
+        elif found_exact.exists():
+            used_words.add(found_exact.first())
+    return used_words
+
+
+def legacy_stylize(text, matches):
+    """
+    Repeated str.replace styling that Sentence.create used to run
+    """
+    for m in matches:
+        t = text[m.start:m.end]
+        text = text.replace(t, get_dic_reference(m.word.id, t))
+    return text
+
+
+def indexed_match(word_set, tokens):
+    matcher = WordMatcher.for_word_set(word_set)
+    return set(m.word for m in matcher.match(tokens))
+
+
+class Command(BaseCommand):
+    help = 'Compares per-token word lookups and str.replace styling ' \
+           'with the in-memory word matcher and the span renderer'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--word-set', type=int, help='WordSet id, defaults to the first one')
+        parser.add_argument('--lengths', type=int, nargs='+', default=[5, 25, 100])
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        word_sets = WordSet.objects.order_by('pk')
+        if options['word_set'] is not None:
+            word_sets = word_sets.filter(pk=options['word_set'])
+        word_set = word_sets.first()
+        if word_set is None:
+            raise CommandError('No word set to benchmark')
+
+        vocabulary = [w.text for w in word_set.words.all()] or FILLER
+        rng = random.Random(0)
+        for length in options['lengths']:
+            words = [rng.choice(FILLER) for _ in range(length)]
+            for i in range(0, length, 5):
+                words[i] = rng.choice(vocabulary)
+            text = ' '.join(words) + '.'
+            tokens = simple_tokenize(text)
+
+            for name, func in (('legacy', legacy_match), ('indexed', indexed_match)):
+                with CaptureQueriesContext(connection) as ctx:
+                    start = time.perf_counter()
+                    for _ in range(options['repeat']):
+                        func(word_set, tokens)
+                    elapsed = (time.perf_counter() - start) / options['repeat']
+                queries = len(ctx.captured_queries) // options['repeat']
+                self.stdout.write(
+                    f"{name:>8} tokens={len(tokens):4d} "
+                    f"queries={queries:4d} time={elapsed * 1000:8.2f}ms")
+
+            matches = WordMatcher.for_word_set(word_set).match(tokens)
+            for name, func in (('replace', legacy_stylize), ('spans', stylize_text)):
+                start = time.perf_counter()
+                for _ in range(options['repeat']):
+                    func(text, matches)
+                elapsed = (time.perf_counter() - start) / options['repeat']
+                self.stdout.write(
+                    f"{name:>8} tokens={len(tokens):4d} "
+                    f"matches={len(matches):4d} time={elapsed * 1000:8.2f}ms")
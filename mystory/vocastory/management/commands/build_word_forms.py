@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from vocastory.inflection import build_forms
+from vocastory.models import Word, WordForm
+
+
+class Command(BaseCommand):
+    help = 'Precomputes the inflected forms of the words with the NLP engine'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true',
+                            help='Recomputes the forms of all words, not only the missing ones')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        words = Word.objects.order_by('pk')
+        if not options['rebuild']:
+            words = words.filter(forms__isnull=True)
+        words = list(words)
+
+        total = 0
+        batch_size = options['batch_size']
+        for i in range(0, len(words), batch_size):
+            batch = words[i:i + batch_size]
+            forms = build_forms(batch)
+            with transaction.atomic():
+                WordForm.objects.filter(word__in=batch).delete()
+                WordForm.objects.bulk_create(
+                    [WordForm(word=w, text=f) for w in batch for f in sorted(forms[w])],
+                    batch_size=batch_size)
+            total += sum(len(f) for f in forms.values())
+            self.stdout.write(f"{min(i + batch_size, len(words))}/{len(words)} words")
+        self.stdout.write(self.style.SUCCESS(f"Stored {total} forms for {len(words)} words"))
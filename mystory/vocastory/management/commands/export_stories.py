@@ -0,0 +1,40 @@
+import json
+import sys
+import time
+
+from django.core.management.base import BaseCommand
+
+from vocastory.corpus import iter_stories
+from vocastory.models import Story
+
+
+class Command(BaseCommand):
+    help = 'Streams the stories, one JSON story with its sentences per line'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="NDJSON file, '-' writes to the standard output")
+        parser.add_argument('--completed', action='store_true', help='Only the completed stories')
+        parser.add_argument('--batch-size', type=int, default=500, help='Stories per batch')
+
+    def handle(self, *args, **options):
+        stories = Story.objects.filter(word_set__isnull=False)
+        if options['completed']:
+            stories = stories.filter(completed=True)
+
+        started = time.perf_counter()
+        count = sentences = 0
+        f = sys.stdout if options['path'] == '-' else open(options['path'], 'w', encoding='utf-8')
+        try:
+            for record in iter_stories(stories, options['batch_size']):
+                f.write(json.dumps(record) + '\n')
+                count += 1
+                sentences += len(record['sentences'])
+        finally:
+            if f is not sys.stdout:
+                f.close()
+        elapsed = time.perf_counter() - started
+        # The report stays out of the exported data
+        out = self.stderr if options['path'] == '-' else self.stdout
+        out.write(self.style.SUCCESS(
+            f"Wrote {count} stories and {sentences} sentences in {elapsed:.1f}s, "
+            f"{sentences / elapsed:.0f} sentences/s"))
@@ -0,0 +1,47 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from vocastory.corpus import iter_words, write_words
+from vocastory.models import WordSet
+
+
+class Command(BaseCommand):
+    help = 'Streams the words, one per line or CSV with word and word_set columns'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Output file, '-' writes to the standard output")
+        parser.add_argument('--format', choices=['txt', 'csv'],
+                            help='Defaults to the extension of the path')
+        parser.add_argument('--word-set', help='Title of the word set to export, all words by default')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        format = options['format'] or ('csv' if path.endswith('.csv') else 'txt')
+        word_set = None
+        if options['word_set']:
+            word_set = WordSet.objects.filter(title=options['word_set']).order_by('pk').first()
+            if word_set is None:
+                raise CommandError(f"No word set {options['word_set']!r}")
+
+        started = time.perf_counter()
+        count = 0
+
+        def counted(rows):
+            nonlocal count
+            for row in rows:
+                count += 1
+                yield row
+
+        f = sys.stdout if path == '-' else open(path, 'w', encoding='utf-8', newline='')
+        try:
+            write_words(f, counted(iter_words(word_set)), format)
+        finally:
+            if f is not sys.stdout:
+                f.close()
+        elapsed = time.perf_counter() - started
+        # The report stays out of the exported data
+        out = self.stderr if path == '-' else self.stdout
+        out.write(self.style.SUCCESS(
+            f"Wrote {count} rows in {elapsed:.1f}s, {count / elapsed:.0f} rows/s"))
@@ -0,0 +1,184 @@
+import random
+import time
+
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Max
+
+from accounts.models import CustomUser
+from vocastory.models import Sentence, Story, StoryReview, Vote, Word, WordSet
+
+TEMPLATES = [
+    'The {} looked at the {} and laughed.',
+    'Nobody expected a {} to carry the {}.',
+    'Then the {} ran over the {} again.',
+    'A {} and a {} became friends.',
+]
+
+
+def word_text(prefix, number):
+    """
+    Letters only, so that the tokenizer matches the generated words
+    """
+    letters = ''
+    while True:
+        number, digit = divmod(number, 26)
+        letters = chr(ord('a') + digit) + letters
+        if not number:
+            return prefix + letters
+
+
+class Command(BaseCommand):
+    help = 'Generates a synthetic dataset of users, word sets, stories, sentences, ' \
+           'votes and reviews with bulk inserts, to benchmark at production scale'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--word-sets', type=int, default=50)
+        parser.add_argument('--words', type=int, default=10, help='Words per word set')
+        parser.add_argument('--stories', type=int, default=5000)
+        parser.add_argument('--rounds', type=int, default=8, help='Most rounds of a story')
+        parser.add_argument('--writers', type=int, default=5, help='Most candidates of a round')
+        parser.add_argument('--voters', type=int, default=6, help='Most votes of a round')
+        parser.add_argument('--completed', type=float, default=0.3,
+                            help='Share of the stories that are completed')
+        parser.add_argument('--prefix', default='load',
+                            help='Prefix of the generated usernames and word set titles')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        if options['users'] < options['writers'] + options['voters']:
+            raise CommandError('Needs more users than the writers and voters of a round')
+        prefix = options['prefix']
+        if CustomUser.objects.filter(username__startswith=f'{prefix}-').exists():
+            raise CommandError(f"Users named {prefix}-* exist, use another --prefix")
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.rows = 0
+        started = time.perf_counter()
+
+        users = self.generate_users(prefix, options['users'])
+        word_sets = self.generate_word_sets(prefix, users, options['word_sets'], options['words'])
+        for done in range(0, options['stories'], self.batch_size):
+            count = min(self.batch_size, options['stories'] - done)
+            with transaction.atomic():
+                self.generate_stories(users, word_sets, count, options)
+            self.report(f"{done + count} stories", started)
+
+        call_command('rebuild_stats', stdout=self.stdout)
+        call_command('refresh_rollups', rebuild=True, stdout=self.stdout)
+        self.report('Done,', started, self.style.SUCCESS)
+
+    def report(self, step, started, style=str):
+        elapsed = time.perf_counter() - started
+        self.stdout.write(style(f"{step} {self.rows} rows in {elapsed:.1f}s, "
+                                f"{self.rows / elapsed:.0f} rows/s"))
+
+    def insert(self, model, objs):
+        """
+        Bulk inserts in batches, the primary keys are not set on every backend
+        """
+        model.objects.bulk_create(objs, batch_size=self.batch_size)
+        self.rows += len(objs)
+
+    def last_pk(self, model):
+        return model.objects.aggregate(pk=Max('pk'))['pk'] or 0
+
+    def generate_users(self, prefix, count):
+        # Hashing is slow on purpose, all the users share one unusable password
+        password = make_password(None)
+        for start in range(0, count, self.batch_size):
+            with transaction.atomic():
+                self.insert(CustomUser, [
+                    CustomUser(username=f'{prefix}-{i}', password=password)
+                    for i in range(start, min(start + self.batch_size, count))])
+        return list(CustomUser.objects.filter(username__startswith=f'{prefix}-')
+                    .values_list('pk', flat=True))
+
+    @transaction.atomic
+    def generate_word_sets(self, prefix, users, count, words_per_set):
+        last_word, last_word_set = self.last_pk(Word), self.last_pk(WordSet)
+        self.insert(Word, [Word(text=word_text(prefix, i)) for i in range(count * words_per_set)])
+        words = list(Word.objects.filter(pk__gt=last_word).order_by('pk')
+                     .values_list('pk', 'text'))
+        self.insert(WordSet, [WordSet(title=f'{prefix} {i}', creator_id=self.rng.choice(users))
+                              for i in range(count)])
+        word_sets = list(WordSet.objects.filter(pk__gt=last_word_set).order_by('pk')
+                         .values_list('pk', flat=True))
+
+        vocabulary = {}
+        links, stars = [], []
+        for i, pk in enumerate(word_sets):
+            own = words[i * words_per_set:(i + 1) * words_per_set]
+            vocabulary[pk] = [text for _, text in own]
+            links.extend(WordSet.words.through(wordset_id=pk, word_id=word) for word, _ in own)
+            stars.extend(WordSet.starred_users.through(wordset_id=pk, customuser_id=user)
+                         for user in self.rng.sample(users, self.rng.randint(0, 5)))
+        self.insert(WordSet.words.through, links)
+        self.insert(WordSet.starred_users.through, stars)
+        return vocabulary
+
+    def generate_stories(self, users, word_sets, count, options):
+        rng = self.rng
+        last_story, last_sentence = self.last_pk(Story), self.last_pk(Sentence)
+        word_set_ids = list(word_sets)
+        self.insert(Story, [Story(word_set_id=rng.choice(word_set_ids),
+                                  completed=rng.random() < options['completed'])
+                            for _ in range(count)])
+        stories = list(Story.objects.filter(pk__gt=last_story).order_by('pk')
+                       .values_list('pk', 'word_set_id', 'completed'))
+
+        sentences, reviews = [], []
+        for pk, word_set, completed in stories:
+            vocabulary = word_sets[word_set] or ['word']
+            if completed:
+                rounds = rng.randint(1, options['rounds'])
+                reviews.extend(self.build_reviews(pk, users))
+            else:
+                # The open round has candidates but no selection
+                rounds = rng.randint(0, options['rounds'] - 1)
+            for order in range(rounds + (0 if completed else 1)):
+                writers = rng.sample(users, rng.randint(1, options['writers']))
+                for i, creator in enumerate(writers):
+                    text = rng.choice(TEMPLATES).format(*rng.sample(vocabulary * 2, 2))
+                    sentences.append(Sentence(story_id=pk, creator_id=creator, order=order,
+                                              text=text, stylized_text=text,
+                                              is_selected=order < rounds and i == 0))
+        self.insert(Sentence, sentences)
+        self.insert(StoryReview, reviews)
+        self.insert(Vote, self.build_votes(last_sentence, users, options['voters']))
+
+    def build_reviews(self, story, users):
+        rng = self.rng
+        return [StoryReview(story_id=story, creator_id=user, flag=False,
+                            coherence=rng.randint(1, 10), creativity=rng.randint(1, 10),
+                            fun=rng.randint(1, 10),
+                            comment=rng.choice(['', 'Lovely story', 'Could be funnier']))
+                for user in rng.sample(users, rng.randint(0, 3))]
+
+    def build_votes(self, last_sentence, users, max_voters):
+        """
+        Each voter of a round votes once, mostly for the selected sentence
+        """
+        rng = self.rng
+        rounds = {}
+        for pk, story, order, creator, selected in Sentence.objects \
+                .filter(pk__gt=last_sentence).order_by('pk') \
+                .values_list('pk', 'story_id', 'order', 'creator_id', 'is_selected'):
+            rounds.setdefault((story, order), []).append((pk, creator, selected))
+
+        votes = []
+        for candidates in rounds.values():
+            writers = set(creator for _, creator, _ in candidates)
+            selected = [pk for pk, _, is_selected in candidates if is_selected]
+            voters = set(rng.sample(users, rng.randint(0, max_voters))) - writers
+            for voter in voters:
+                if selected and rng.random() < 0.7:
+                    sentence = selected[0]
+                else:
+                    sentence = rng.choice(candidates)[0]
+                votes.append(Vote(user_id=voter, sentence_id=sentence))
+        return votes
@@ -0,0 +1,60 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from vocastory import dictionary
+from vocastory.models import WordMeaning
+
+
+class Command(BaseCommand):
+    help = 'Bulk loads word meanings from a JSON lines file of {"word": ..., "meanings": {...}}'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--replace', action='store_true',
+                            help='Overwrites the meanings of the words already stored')
+        parser.add_argument('--source', default='import')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def read_entries(self, f):
+        for number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entry = json.loads(line)
+                yield entry['word'], entry['meanings']
+            except (ValueError, KeyError) as e:
+                raise CommandError(f"Invalid entry on line {number}: {e}")
+
+    def store(self, batch, replace, source):
+        entries = {}
+        for text, meanings in batch:
+            entry = WordMeaning.create(text, meanings, source)
+            entries[entry.text] = entry
+        with transaction.atomic():
+            if replace:
+                WordMeaning.objects.filter(text__in=entries).delete()
+            WordMeaning.objects.bulk_create(entries.values(), ignore_conflicts=True)
+        dictionary.forget(entries)
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        total = 0
+        batch = []
+        batch_size = options['batch_size']
+        with open(options['path'], encoding='utf-8') as f:
+            for entry in self.read_entries(f):
+                batch.append(entry)
+                if len(batch) == batch_size:
+                    self.store(batch, options['replace'], options['source'])
+                    total += len(batch)
+                    batch = []
+            if batch:
+                self.store(batch, options['replace'], options['source'])
+                total += len(batch)
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Read {total} entries in {elapsed:.1f}s, {WordMeaning.objects.count()} words stored"))
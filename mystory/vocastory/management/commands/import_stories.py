@@ -0,0 +1,51 @@
+import json
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from vocastory.corpus import StoryImporter
+
+
+class Command(BaseCommand):
+    help = 'Streams a story corpus, one JSON story with its sentences per line, ' \
+           'the word sets must exist, see import_words'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="NDJSON file, '-' reads the standard input")
+        parser.add_argument('--batch-size', type=int, default=500, help='Stories per batch')
+
+    def read_records(self, f):
+        for number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+                if not isinstance(record['sentences'], list) or 'word_set' not in record:
+                    raise ValueError('sentences should be a list')
+                for sentence in record['sentences']:
+                    sentence['text'], sentence['creator'], sentence['order']
+            except (ValueError, KeyError, TypeError) as e:
+                raise CommandError(f"Invalid story on line {number}: {e!r}")
+            yield record
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        totals = [0, 0, 0]
+        f = sys.stdin if options['path'] == '-' else open(options['path'], encoding='utf-8')
+        try:
+            importer = StoryImporter()
+            for counts in importer.import_records(self.read_records(f), options['batch_size']):
+                totals = [t + c for t, c in zip(totals, counts)]
+                if options['verbosity'] > 1:
+                    self.stdout.write(f"{totals[0]} stories stored")
+        finally:
+            if f is not sys.stdin:
+                f.close()
+
+        stories, sentences, skipped = totals
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Stored {stories} stories and {sentences} sentences in {elapsed:.1f}s, "
+            f"{sentences / elapsed:.0f} sentences/s, {skipped} stories of unknown word sets skipped"))
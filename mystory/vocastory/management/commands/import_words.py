@@ -0,0 +1,64 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts.models import CustomUser
+from vocastory.corpus import import_words, read_words
+from vocastory.models import WordSet
+
+
+class Command(BaseCommand):
+    help = 'Streams a word list, one word per line or CSV with word and word_set columns, ' \
+           'into the Word table, reusing the existing words'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Word list, '-' reads the standard input")
+        parser.add_argument('--format', choices=['txt', 'csv'],
+                            help='Defaults to the extension of the path')
+        parser.add_argument('--word-set', help='Title of the word set to add the words to')
+        parser.add_argument('--creator', help='Username of the creator of the missing word sets')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def get_word_set(self, title):
+        if title not in self.word_sets:
+            word_set = WordSet.objects.filter(title=title).order_by('pk').first()
+            if word_set is None:
+                if self.creator is None:
+                    raise CommandError(f"No word set {title!r}, pass --creator to create it")
+                word_set = WordSet.objects.create(title=title, creator=self.creator)
+            self.word_sets[title] = word_set
+        return self.word_sets[title]
+
+    def handle(self, *args, **options):
+        path = options['path']
+        format = options['format'] or ('csv' if path.endswith('.csv') else 'txt')
+        self.word_sets = {}
+        self.creator = None
+        if options['creator']:
+            self.creator = CustomUser.objects.filter(username=options['creator']).first()
+            if self.creator is None:
+                raise CommandError(f"No user {options['creator']!r}")
+
+        started = time.perf_counter()
+        totals = [0, 0, 0, 0]
+        f = sys.stdin if path == '-' else open(path, encoding='utf-8', newline='')
+        try:
+            entries = read_words(f, format)
+            if options['word_set']:
+                entries = ((text, title or options['word_set']) for text, title in entries)
+            for counts in import_words(entries, self.get_word_set, options['batch_size']):
+                totals = [t + c for t, c in zip(totals, counts)]
+                if options['verbosity'] > 1:
+                    self.stdout.write(f"{totals[0]} words read")
+        except ValueError as e:
+            raise CommandError(e)
+        finally:
+            if f is not sys.stdin:
+                f.close()
+
+        read, created, linked, skipped = totals
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Read {read} words in {elapsed:.1f}s, {read / elapsed:.0f} words/s: "
+            f"{created} new, {linked} word set links, {skipped} too long"))
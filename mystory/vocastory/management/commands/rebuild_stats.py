@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from accounts.models import CustomUser
+from vocastory.models import Sentence, Story
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the denormalized counters from the source tables'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            count = Sentence.rebuild_vote_counts()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt the vote counts of {count} sentences"))
+        with transaction.atomic():
+            count = Story.rebuild_state()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt the poll state of {count} stories"))
+        with transaction.atomic():
+            count = Story.rebuild_scores()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt the scores of {count} stories"))
+        with transaction.atomic():
+            count = CustomUser.rebuild_points()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt the points of {count} users"))
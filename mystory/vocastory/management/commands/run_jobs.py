@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from vocastory import jobs
+
+
+class Command(BaseCommand):
+    help = 'Runs the background jobs of the Job table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help='Runs the due jobs and exits instead of polling')
+        parser.add_argument('--interval', type=float, default=5,
+                            help='Seconds between two polls of the Job table')
+
+    def handle(self, *args, **options):
+        try:
+            while True:
+                count = jobs.run_due()
+                if count:
+                    self.stdout.write(f"Ran {count} jobs")
+                if options['once']:
+                    break
+                if not count:
+                    time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
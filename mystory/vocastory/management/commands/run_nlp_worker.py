@@ -0,0 +1,28 @@
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+
+from vocastory.nlp import NLPWorker, get_config
+
+
+class Command(BaseCommand):
+    help = 'Runs the NLP worker that serves the web processes with a warm spaCy model'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', help='Overrides the host of VOCASTORY_NLP ADDRESS')
+        parser.add_argument('--port', type=int, help='Overrides the port of VOCASTORY_NLP ADDRESS')
+
+    def handle(self, *args, **options):
+        config = get_config()
+        host, port = config['ADDRESS']
+        config['ADDRESS'] = (options['host'] or host, options['port'] or port)
+
+        worker = NLPWorker(config)
+        try:
+            address = worker.bind()
+        except ImproperlyConfigured as e:
+            raise CommandError(e)
+        self.stdout.write(f"Loading {config['MODEL']}, serving on {address[0]}:{address[1]}")
+        try:
+            worker.serve_forever()
+        except KeyboardInterrupt:
+            pass
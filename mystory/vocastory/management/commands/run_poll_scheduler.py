@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from vocastory.models import Story
+
+
+class Command(BaseCommand):
+    help = 'Closes the sentence polls whose deadline passed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help='Checks the due polls and exits instead of polling')
+        parser.add_argument('--interval', type=float, default=10,
+                            help='Seconds between two checks of the due polls')
+
+    def handle(self, *args, **options):
+        try:
+            while True:
+                checked, closed = Story.close_due_polls()
+                if checked:
+                    self.stdout.write(f"Checked {checked} polls, closed {closed}")
+                if options['once']:
+                    break
+                if not checked:
+                    time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,94 @@
+import re
+from collections import namedtuple
+
+# Minimal token interface shared with spaCy tokens (text, lemma_, idx)
+Token = namedtuple('Token', ['text', 'lemma_', 'idx'])
+
+# A word-set word found in a sentence, with its character span
+Match = namedtuple('Match', ['word', 'start', 'end'])
+
+WORD_RE = re.compile(r"[^\W\d_]+(?:['’][^\W\d_]+)*")
+
+
+def simple_tokenize(text):
+    """
+    Splits the text into word tokens without any NLP model,
+    lemma is the lowercase surface form
+    """
+    return [Token(m.group(), m.group().lower(), m.start())
+            for m in WORD_RE.finditer(text)]
+
+
+def merge_matches(*match_lists):
+    """
+    Matches of several passes over the same text, the first pass wins on a position
+    :return: list of Match ordered by position in the text
+    """
+    merged = {}
+    for matches in match_lists:
+        for m in matches:
+            merged.setdefault(m.start, m)
+    return [merged[start] for start in sorted(merged)]
+
+
+class WordMatcher:
+    """
+    In-memory index over the vocabulary of a WordSet,
+    all lookups are answered without touching the database
+    """
+
+    def __init__(self, words, forms=()):
+        """
+        :param forms: (form text, word) pairs of the precomputed forms
+        """
+        self.words = list(words)
+        self.index = {}
+        for word in self.words:
+            self.index.setdefault(word.text.lower(), word)
+        with_forms = set()
+        for text, word in forms:
+            self.index.setdefault(text.lower(), word)
+            with_forms.add(word.pk)
+        # Raw tokens are enough when every word has its forms
+        self.complete = all(word.pk in with_forms for word in self.words)
+
+    @classmethod
+    def for_word_set(cls, word_set):
+        """
+        Loads the word set vocabulary and its forms with a single query
+        """
+        Word = word_set.words.model
+        rows = word_set.words.order_by('pk', 'forms__pk') \
+            .values_list('pk', 'text', 'forms__text')
+        words = {}
+        forms = []
+        for pk, text, form in rows:
+            if pk not in words:
+                words[pk] = Word.from_db(rows.db, ['id', 'text'], (pk, text))
+            if form is not None:
+                forms.append((form, words[pk]))
+        return cls(list(words.values()), forms)
+
+    def __len__(self):
+        return len(self.index)
+
+    def lookup(self, token):
+        """
+        :return: Word matching the lemma or the surface form, might be None
+        """
+        word = self.index.get(token.lemma_.lower())
+        if word is None:
+            word = self.index.get(token.text.lower())
+        return word
+
+    def match(self, tokens):
+        """
+        Matches all the tokens in one pass
+        :return: list of Match ordered by position in the text
+        """
+        matches = []
+        for t in tokens:
+            word = self.lookup(t)
+            if word is not None:
+                matches.append(Match(word, t.idx, t.idx + len(t.text)))
+        return matches
@@ -1,32 +1,24 @@
+import json
+import random
 import string
 from django.utils import timezone
-from django.db import models
-from django.db.models import F, Q
-from django.db.models.functions import Length
+from django.db import IntegrityError, models, transaction
+from django.db.models import F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce, Length
 from django.db.models import CharField
 from django.urls import reverse
+from django.utils.functional import cached_property
 
-from accounts.models import CustomUser
+from accounts.models import CustomUser, Notification
+from .inflection import build_forms
+from .lemmas import analyze
+from .matching import WordMatcher, merge_matches, simple_tokenize
+from .rendering import stylize_text
+from .snapshots import StorySnapshot
 
-# NLP engine only loaded if needed
-nlp_engine = None
 CharField.register_lookup(Length, 'len')
 
 
-def nlp(*args, **kwargs):
-    """
-    This method tokenizes the sentence
-    """
-    global nlp_engine
-    if nlp_engine is None:
-        import warnings
-        with warnings.catch_warnings():
-            warnings.simplefilter("ignore")
-            import spacy
-            nlp_engine = spacy.load("en_core_web_md")
-    return nlp_engine(*args, **kwargs)
-
-
 class Word(models.Model):
     text = CharField(max_length=30)
 
@@ -36,6 +28,59 @@ class Word(models.Model):
     def get_absolute_url(self):
         return reverse("show_word_meaning", kwargs={'word_id': self.id})
 
+    def build_forms(self):
+        """
+        Replaces the precomputed forms of the word
+        """
+        forms = build_forms([self])[self]
+        self.forms.all().delete()
+        WordForm.objects.bulk_create(WordForm(word=self, text=f) for f in forms)
+
+
+class WordMeaning(models.Model):
+    """
+    Dictionary entry of a word, filled by import_meanings
+    or on demand by the remote dictionary
+    """
+    text = CharField(max_length=60, unique=True)  # Lowercase word
+    meanings = models.TextField()  # JSON of part of speech -> definitions
+    source = CharField(max_length=255, blank=True)  # Dotted path of the remote dictionary
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.text
+
+    def get_meanings(self):
+        return json.loads(self.meanings)
+
+    @classmethod
+    def create(cls, text, meanings, source=''):
+        return cls(text=text.lower(), meanings=json.dumps(meanings), source=source)
+
+
+class WordForm(models.Model):
+    """
+    Inflected form of a word, e.g. ran, running, runs -> run
+    """
+    word = models.ForeignKey(Word,
+                             on_delete=models.CASCADE,
+                             related_name='forms')
+    text = CharField(max_length=40, db_index=True)
+
+    class Meta:
+        unique_together = ['word', 'text']
+
+    def __str__(self):
+        return self.text
+
+
+def new_version():
+    """
+    Random rather than incremented, so that a version cached in a
+    rolled back transaction is never reused
+    """
+    return random.getrandbits(31)
+
 
 class WordSet(models.Model):
     title = CharField(max_length=50)
@@ -47,10 +92,17 @@ class WordSet(models.Model):
     starred_users = models.ManyToManyField(
         'accounts.CustomUser',
         related_name='starred_word_sets')
+    # Key of the cached word set cards, changes with the title and the words
+    version = models.IntegerField(default=new_version)
 
     def __str__(self):
         return self.title
 
+    def save(self, *args, **kwargs):
+        if self.pk is not None:
+            self.version = new_version()
+        super().save(*args, **kwargs)
+
     def get_absolute_url(self):
         return reverse("browse_wordset_stories", kwargs={'wordset_id': self.id})
 
@@ -66,93 +118,250 @@ class Story(models.Model):
         on_delete=models.CASCADE,
         null=True)
 
+    # Running totals of the reviews, kept by StoryReview.create_or_edit
+    review_count = models.IntegerField(default=0)
+    coherence_sum = models.IntegerField(default=0)
+    creativity_sum = models.IntegerField(default=0)
+    fun_sum = models.IntegerField(default=0)
+    commented_count = models.IntegerField(default=0)
+    score = models.FloatField(default=0)
+    # State of the sentence poll, kept by Sentence.create and select_sentence
+    selected_order = models.IntegerField(default=-1)
+    candidate_count = models.IntegerField(default=0)
+    last_candidate_date = models.DateTimeField(null=True)
+    # Next check of the poll by the scheduler, None while it waits for votes
+    poll_due = models.DateTimeField(null=True)
+    # Changes with the selected sentences, keys the snapshot cache
+    version = models.IntegerField(default=new_version)
+
+    class Meta:
+        indexes = [
+            # Top stories
+            models.Index(fields=['completed', '-score'], name='story_completed_score_idx'),
+            # Open stories with enough candidates to read
+            models.Index(fields=['completed', 'candidate_count'], name='story_open_idx'),
+            # Polls due for a check
+            models.Index(fields=['poll_due'], name='story_poll_due_idx'),
+        ]
+
+    # Votes of the leading candidate -> time after the last candidate when the poll closes
+    POLL_RULES = [
+        (5, timezone.timedelta(0)),
+        (3, timezone.timedelta(minutes=5)),
+        (2, timezone.timedelta(minutes=50)),
+    ]
+
+    REVIEW_TOTALS = ['review_count', 'coherence_sum', 'creativity_sum',
+                     'fun_sum', 'commented_count']
+
     @classmethod
     def get_stories_scored(cls):
-        stories = cls.objects.filter(completed=True).annotate(
-            q_score=
-            models.Avg('review_set__coherence')
-            + models.Avg('review_set__creativity')
-            + models.Avg('review_set__fun'),
-            p_score=models.Count(
-                'review_set',
-                filter=Q(review_set__comment__len__gte=5),
-                output_field=models.FloatField(),
-                distinct=True),
-            score=F('q_score') + F('p_score'),
-        )
-        return stories
+        return cls.objects.filter(completed=True)
 
     @classmethod
     def get_top_stories_ordered(cls):
         return cls.get_stories_scored().order_by('-score')
 
+    @staticmethod
+    def prefetch_selected_sentences():
+        """
+        Prefetch of the selected sentences in order, used by get_text and get_stylized_text
+        """
+        return models.Prefetch(
+            'sentence_set', to_attr='selected_sentences',
+            queryset=Sentence.objects.filter(is_selected=True).order_by('order'))
+
+    @staticmethod
+    def prefetch_selected_sentences_lazily(stories):
+        """
+        The selected sentences of all the stories are prefetched when the
+        first story needs them, pages whose cards are cached skip the query
+        """
+        for story in stories:
+            story.page = stories
+        return stories
+
+    @classmethod
+    def get_top_stories(cls, cursor=None, limit=10):
+        """
+        Page of the completed stories by score, their selected sentences are
+        prefetched lazily, pass the returned cursor to get the next page
+        :return: list of stories, cursor of the next page or None
+        """
+        stories = cls.get_stories_scored().order_by('-score', 'pk')
+        if cursor:
+            score, pk = cursor.split(':')
+            score, pk = float(score), int(pk)
+            stories = stories.filter(Q(score__lt=score) | Q(score=score, pk__gt=pk))
+        stories = list(stories[:limit + 1])
+        if len(stories) <= limit:
+            return cls.prefetch_selected_sentences_lazily(stories), None
+        last = stories[limit - 1]
+        return cls.prefetch_selected_sentences_lazily(stories[:limit]), f"{last.score!r}:{last.pk}"
+
+    @classmethod
+    def rebuild_scores(cls, batch_size=500):
+        """
+        Recomputes the review totals and scores of all stories
+        :return: number of stories updated
+        """
+        stories = cls.objects.annotate(
+            r_count=models.Count('review_set'),
+            r_coherence=Coalesce(models.Sum('review_set__coherence'), 0),
+            r_creativity=Coalesce(models.Sum('review_set__creativity'), 0),
+            r_fun=Coalesce(models.Sum('review_set__fun'), 0),
+            r_commented=models.Count(
+                'review_set',
+                filter=Q(review_set__comment__len__gte=StoryReview.COMMENT_MIN_LENGTH)),
+        ).order_by('pk')
+
+        updated = []
+        for story in stories.iterator():
+            story.set_review_totals((story.r_count, story.r_coherence, story.r_creativity,
+                                     story.r_fun, story.r_commented))
+            updated.append(story)
+        cls.objects.bulk_update(updated, cls.REVIEW_TOTALS + ['score'], batch_size=batch_size)
+        return len(updated)
+
+    @classmethod
+    def rebuild_state(cls, stories=None, batch_size=500):
+        """
+        Recomputes the poll state columns from the sentences
+        :return: number of stories updated
+        """
+        stories = cls.objects.all() if stories is None else stories
+        selected = Sentence.objects.filter(story=OuterRef('pk'), is_selected=True) \
+            .order_by('-order').values('order')[:1]
+        stories = stories.annotate(
+            s_order=Coalesce(Subquery(selected, output_field=models.IntegerField()), -1))
+        candidates = Sentence.objects \
+            .filter(story=OuterRef('pk'), order=OuterRef('s_order') + 1) \
+            .order_by().values('story')
+        stories = stories.annotate(
+            s_count=Subquery(candidates.annotate(c=models.Count('pk')).values('c'),
+                             output_field=models.IntegerField()),
+            s_date=Subquery(candidates.annotate(d=models.Max('creation_date')).values('d'),
+                            output_field=models.DateTimeField()),
+        ).order_by('pk')
+
+        updated = []
+        for story in stories.iterator():
+            story.selected_order = story.s_order
+            story.candidate_count = story.s_count or 0
+            story.last_candidate_date = story.s_date
+            # The scheduler computes the next check of the open polls
+            story.poll_due = story.s_date if story.candidate_count else None
+            updated.append(story)
+        cls.objects.bulk_update(
+            updated, ['selected_order', 'candidate_count', 'last_candidate_date', 'poll_due'],
+            batch_size=batch_size)
+        return len(updated)
+
+    def set_review_totals(self, totals):
+        for field, value in zip(self.REVIEW_TOTALS, totals):
+            setattr(self, field, value)
+        self.score = self.compute_score()
+
+    def compute_score(self):
+        """
+        Sum of the average coherence, creativity and fun,
+        plus one point per commented review
+        """
+        if self.review_count == 0:
+            return 0
+        average = (self.coherence_sum + self.creativity_sum + self.fun_sum) / self.review_count
+        return average + self.commented_count
+
+    def add_review_totals(self, old, new):
+        """
+        Applies the change of a review to the running totals and the score,
+        should run in the transaction saving the review
+        :param old: totals of the review before the change, None if created
+        :param new: totals of the review after the change
+        """
+        old = old or (0,) * len(self.REVIEW_TOTALS)
+        Story.objects.filter(pk=self.pk).update(**{
+            field: F(field) + (n - o)
+            for field, o, n in zip(self.REVIEW_TOTALS, old, new)
+        })
+        self.refresh_from_db(fields=self.REVIEW_TOTALS)
+        self.score = self.compute_score()
+        Story.objects.filter(pk=self.pk).update(score=self.score)
 
     def get_sentence_set_with_vote(self):
-        return self.sentence_set \
-            .annotate(votes=models.Count('voted_users'))
+        return self.sentence_set.annotate(votes=F('vote_count'))
 
     def get_selected_sentences(self, order):
         return self.sentence_set.filter(is_selected=True, order__lte=order) \
             .order_by('order')
 
+    @cached_property
+    def snapshot(self):
+        return StorySnapshot.get(self)
+
+    def bump_version(self):
+        """
+        Invalidates the cached snapshot, called when the selected
+        sentences or the completion of the story change
+        """
+        self.version = new_version()
+        Story.objects.filter(pk=self.pk).update(version=self.version)
+        self.__dict__.pop('snapshot', None)
+
     def get_stylized_last_two(self):
         """
-        :return:
+        :return: stylized text of the last two selected sentences
+        """
+        return self.snapshot.stylized_last_two or " "
+
+    def get_prefetched_sentences(self):
+        """
+        :return: selected sentences prefetched by prefetch_selected_sentences, None if not
         """
-        order = self.get_last_selected_index()
-        if order == -1:
-            return " "
-        sentences = list(self.get_selected_sentences(order))
-        return " ".join([i.stylized_text for i in sentences[-2:]])
+        page = getattr(self, 'page', None)
+        if page is not None and not hasattr(self, 'selected_sentences'):
+            models.prefetch_related_objects(page, self.prefetch_selected_sentences())
+        return getattr(self, 'selected_sentences', None)
 
     def get_stylized_text(self):
         """
         Gets the text for selected sentences for visualization
         """
-        order = self.get_last_selected_index()
-        if order == -1:
-            return " "
-        sentences = self.get_selected_sentences(order)
-        return " ".join([i.stylized_text for i in sentences])
+        sentences = self.get_prefetched_sentences()
+        if sentences is not None:
+            return " ".join(s.stylized_text for s in sentences) or " "
+        return self.snapshot.stylized_text or " "
 
     def get_text(self):
         """
         Gets the text for selected sentences for visualization
         """
-        order = self.get_last_selected_index()
-        if order == -1:
-            return " "
-        sentences = self.get_selected_sentences(order)
-        return " ".join([i.text for i in sentences])
+        sentences = self.get_prefetched_sentences()
+        if sentences is not None:
+            return " ".join(s.text for s in sentences) or " "
+        return self.snapshot.text or " "
 
     def get_used_word_list(self):
-        order = self.get_last_selected_index()
-        sentences = self.get_selected_sentences(order)
-        used_words = set()
-        for sentence in sentences:
-            used_words.update(set(sentence.used_words.all()))
-        return list(used_words)
+        return self.snapshot.get_used_word_list()
 
     def get_unused_word_list(self):
-        used_words = set(self.get_used_word_list())
-        all_words = set(self.word_set.words.all())
-        return list(all_words.difference(used_words))
+        return self.snapshot.get_unused_word_list()
 
     def get_last_selected_index(self):
         """
         :return: order of the last selected sentence, might be -1
         """
-        selected = self.sentence_set.filter(is_selected=True).order_by('-order')
-        if not selected.exists():
-            return -1
-        return selected[0].order
+        return self.selected_order
 
     def get_candidate_index(self):
-        return self.get_last_selected_index() + 1
+        return self.selected_order + 1
 
     def is_readable(self, user):
         if self.completed:
             return False
+        # Needs more than two candidates of other users
+        if self.candidate_count < 3:
+            return False
         candidates = self.get_candidate_sentences(self.get_candidate_index())
         candidates = candidates.exclude(creator=user)
         candidate_ids = candidates.values_list('pk', flat=True)
@@ -165,6 +374,8 @@ class Story(models.Model):
     def is_writable(self, user):
         if self.completed:
             return False
+        if self.candidate_count == 0:
+            return True
         candidates = self.get_candidate_sentences(self.get_candidate_index())
         if candidates.filter(creator=user).exists():
             return False
@@ -186,29 +397,95 @@ class Story(models.Model):
             return []
         return self.sentence_set.filter(order=order)
 
-    def close_sentence_poll(self):
-        if self.completed:
-            return
+    def get_poll_state(self):
+        """
+        :return: leading candidate and the time
+            the poll closes, None while the poll waits for candidates or votes
+        """
+        if self.completed or self.candidate_count == 0:
+            return None, None
+        leader = self.get_candidate_sentences(self.get_candidate_index()) \
+            .order_by('-vote_count', 'pk').first()
+        if leader is None:
+            return None, None
+        for min_votes, wait in self.POLL_RULES:
+            if leader.vote_count >= min_votes:
+                return leader, self.last_candidate_date + wait
+        return leader, None
+
+    def close_sentence_poll(self, now=None):
+        """
+        Selects the leading candidate if the poll deadline passed
+        :return: True if the poll was closed
+        """
+        leader, deadline = self.get_poll_state()
+        if deadline is None or (now or timezone.now()) < deadline:
+            return False
+        return self.select_sentence(leader)
+
+    def select_sentence(self, sentence):
+        """
+        Closes the poll with the sentence, only the first concurrent close moves the story forward
+        :return: True if the poll was closed
+        """
         order = self.get_candidate_index()
-        candidate_sentences = self.get_candidate_sentences(order)
-        if len(candidate_sentences) == 0:
-            return
-        candidate_sentences = candidate_sentences.order_by('-creation_date')
-        delta = timezone.now() - candidate_sentences[0].creation_date
-        candidate_sentences = candidate_sentences \
-            .annotate(votes=models.Count('voted_users')).order_by('-votes')
-
-        if (delta > timezone.timedelta(minutes=50) and candidate_sentences[0].votes > 1)\
-                or candidate_sentences[0].votes > 4 \
-                or (delta > timezone.timedelta(minutes=5) and candidate_sentences[0].votes > 2):
-            sentence = Sentence.objects.get(id=candidate_sentences[0].id)
-            sentence.is_selected = True
-            sentence.save()
+        closed = Story.objects.filter(pk=self.pk, selected_order=self.selected_order) \
+            .update(selected_order=order, candidate_count=0, last_candidate_date=None,
+                    poll_due=None)
+        if not closed:
+            return False
+        self.selected_order, self.candidate_count, self.last_candidate_date = order, 0, None
+        self.poll_due = None
+        sentence.selected_at = timezone.now()
+        Sentence.objects.filter(pk=sentence.pk).update(is_selected=True,
+                                                       selected_at=sentence.selected_at)
+        CustomUser.award_selection(sentence)
+        Notification.notify_selection(sentence)
+        self.bump_version()
+        return True
+
+    def request_poll_check(self):
+        """
+        Has the poll scheduler check the poll, after a vote
+        """
+        Story.objects.filter(pk=self.pk, completed=False).update(poll_due=timezone.now())
+
+    def check_poll(self, now=None):
+        """
+        Closes the poll if its deadline passed, otherwise schedules the next check
+        :return: True if the poll was closed
+        """
+        now = now or timezone.now()
+        leader, deadline = self.get_poll_state()
+        if deadline is not None and now >= deadline:
+            if not self.select_sentence(leader):
+                return False
+            self.finish_story()
+            return True
+        # A vote since the poll was read asks for an earlier check, keep it
+        Story.objects.filter(pk=self.pk, poll_due=self.poll_due).update(poll_due=deadline)
+        self.poll_due = deadline
+        return False
+
+    @classmethod
+    def close_due_polls(cls, now=None, limit=100):
+        """
+        Checks the polls whose check time passed, run by the poll scheduler
+        :return: number of polls checked and closed
+        """
+        now = now or timezone.now()
+        stories = list(cls.objects.filter(poll_due__lte=now).order_by('poll_due')[:limit])
+        closed = 0
+        for story in stories:
+            with transaction.atomic():
+                closed += story.check_poll(now)
+        return len(stories), closed
 
     def finish_story(self):
         if len(self.get_unused_word_list()) == 0:
             self.completed = True
-            self.save()
+            self.save(update_fields=['completed'])
+            self.bump_version()
 
     def get_read_url(self):
         return reverse("read_story", kwargs={'story_id': self.id})
@@ -227,18 +504,35 @@ class Sentence(models.Model):
     order = models.IntegerField(default=0)  # Order in the story
     used_words = models.ManyToManyField(Word)  # Used words from the WordSet
     is_selected = models.BooleanField(default=False)
+    # Set when the poll closes with the sentence, None for older or imported selections
+    selected_at = models.DateTimeField(null=True)
     # Story reference for the sentence
     story = models.ForeignKey(Story,
                               on_delete=models.CASCADE)
     voted_users = models.ManyToManyField(
         'accounts.CustomUser',
+        through='Vote',
         related_name='voted_sentences')
+    # Number of votes, kept by vote_sentence
+    vote_count = models.IntegerField(default=0)
 
     # User reference for the sentence
     creator = models.ForeignKey('accounts.CustomUser',
                                 on_delete=models.CASCADE,
                                 related_name='created_sentences')
 
+    class Meta:
+        indexes = [
+            # Candidates of a poll
+            models.Index(fields=['story', 'order'], name='sentence_story_order_idx'),
+            # Selected sentences of a story, partial where supported
+            models.Index(fields=['story', 'order'], condition=Q(is_selected=True),
+                         name='sentence_selected_idx'),
+            # Selected sentences of a user, for points and notifications
+            models.Index(fields=['creator', 'is_selected'], name='sentence_creator_selected_idx'),
+            models.Index(fields=['creation_date'], name='sentence_date_idx'),
+        ]
+
     @classmethod
     def create(cls, order, text, story, creator):
         """
@@ -251,43 +545,27 @@ class Sentence(models.Model):
             return None
         text = text + '.' if text[-1] not in string.punctuation else text
 
-        def get_dic_reference(id, t):
-            text = "<a href='" \
-                   + "/vocastory/show_meaning/" \
-                   + str(id) \
-                   + "/'>"
-            text += t
-            text += "</a>"
-            return text
-
         sentence = cls(text=text, order=order, story=story, creator=creator)
-        text_tokens = nlp(text)
-        used_words = set()
-        for t in text_tokens:
-            t_l = t.lemma_.lower()
-            found_words = word_set.words.filter(text=t_l)
-            found_exact = word_set.words.filter(text=t.text.lower())
-            if found_words.exists():
-                text = text.replace(
-                    t.text,
-                    get_dic_reference(found_words.first().id, t.text)
-                )
-                used_words.update(found_words)
-            elif found_exact.exists():
-                text = text.replace(
-                    t.text,
-                    get_dic_reference(found_exact.first().id, t.text)
-                )
-                used_words.update(found_exact)
+        matcher = WordMatcher.for_word_set(word_set)
+        matches = []
+        if matcher.complete:
+            # Every word has its forms precomputed, raw tokens usually match
+            matches = matcher.match(simple_tokenize(text))
+        if len(set(m.word for m in matches)) < len(matcher.words):
+            # Inflections missing from the precomputed forms need the lemmas
+            matches = merge_matches(matches, matcher.match(analyze(text)))
+        used_words = set(m.word for m in matches)
 
         if len(used_words) == 0:
             return None
         else:
-            sentence.stylized_text = text
-            sentence.save()
-            for word in used_words:
-                sentence.used_words.add(word)
+            sentence.stylized_text = stylize_text(text, matches)
             sentence.save()
+            sentence.used_words.add(*used_words)
+            # Counts as a candidate only if written for the open poll
+            Story.objects.filter(pk=story.pk, selected_order=order - 1).update(
+                candidate_count=F('candidate_count') + 1,
+                last_candidate_date=sentence.creation_date)
         return sentence
 
     @classmethod
@@ -295,18 +573,54 @@ class Sentence(models.Model):
         return cls.objects.filter(creation_date__gte=date1, creation_date__lt=date2).count()
     
     def vote_sentence(self, user):
+        """
+        Records the vote unless the user already voted, the unique
+        constraint decides between concurrent votes
+        :return: True if the vote was recorded
+        """
         if user is None:
             return False
+        try:
+            with transaction.atomic():
+                Vote.objects.create(user=user, sentence=self)
+                Sentence.objects.filter(pk=self.pk).update(vote_count=F('vote_count') + 1)
+        except IntegrityError:
+            return False
+        self.vote_count += 1
+        return True
 
-        if user not in self.voted_users.all():
-            self.voted_users.add(user)
-            return True
-        return False
+    @classmethod
+    def rebuild_vote_counts(cls, batch_size=500):
+        """
+        :return: number of sentences updated
+        """
+        updated = []
+        for sentence in cls.objects.annotate(votes=models.Count('vote')).order_by('pk').iterator():
+            sentence.vote_count = sentence.votes
+            updated.append(sentence)
+        cls.objects.bulk_update(updated, ['vote_count'], batch_size=batch_size)
+        return len(updated)
 
     def __str__(self):
         return self.text
 
 
+class Vote(models.Model):
+    # Keeps the table and columns of the former automatic voted_users table,
+    # see vocastory.upgrades for the migration of existing databases
+    user = models.ForeignKey('accounts.CustomUser',
+                             on_delete=models.CASCADE,
+                             db_column='customuser_id')
+    sentence = models.ForeignKey(Sentence,
+                                 on_delete=models.CASCADE)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'vocastory_sentence_voted_users'
+        # One vote per user and sentence, also the index of the votes of a user
+        unique_together = ['user', 'sentence']
+
+
 class StoryReview(models.Model):
     creation_date = models.DateTimeField(auto_now_add=True)
     creator = models.ForeignKey('accounts.CustomUser',
@@ -321,16 +635,75 @@ class StoryReview(models.Model):
     fun = models.IntegerField(default=0, null=True)
     comment = CharField(null=True, max_length=200)
 
+    # Reviews with a comment at least this long get an extra point
+    COMMENT_MIN_LENGTH = 5
+
     class Meta:
         unique_together = ['creator', 'story']
 
     @classmethod
     def create_or_edit(cls, user, story, flag, coherence, creativity, fun, comment):
-        review, _ = cls.objects.get_or_create(creator=user, story=story)
-        review.flag = flag
-        review.coherence = coherence
-        review.creativity = creativity
-        review.fun = fun
-        review.comment = comment
-        review.save()
+        with transaction.atomic():
+            review, created = cls.objects.select_for_update() \
+                .get_or_create(creator=user, story=story)
+            old = None if created else review.get_totals()
+            review.flag = flag
+            review.coherence = coherence
+            review.creativity = creativity
+            review.fun = fun
+            review.comment = comment
+            review.save()
+            story.add_review_totals(old, review.get_totals())
         return review
+
+    def get_totals(self):
+        """
+        :return: contribution of the review to the story totals
+        """
+        return (1, self.coherence or 0, self.creativity or 0, self.fun or 0,
+                int(len(self.comment or '') >= self.COMMENT_MIN_LENGTH))
+
+
+class Job(models.Model):
+    """
+    Background task run by the run_jobs worker, see jobs.py
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = [(s, s) for s in (PENDING, RUNNING, DONE, FAILED)]
+
+    kind = CharField(max_length=50)
+    payload = models.TextField(default='{}')  # JSON keyword arguments of the handler
+    status = CharField(max_length=10, choices=STATUSES, default=PENDING)
+    attempts = models.IntegerField(default=0)
+    max_attempts = models.IntegerField(default=3)
+    # Progress reported by the handler
+    total = models.IntegerField(default=0)
+    done = models.IntegerField(default=0)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    # Not run before, delays the retries
+    run_after = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='job_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} #{self.pk} ({self.status})"
+
+    def get_payload(self):
+        return json.loads(self.payload)
+
+    def set_progress(self, done, total=None):
+        """
+        Saves the progress, also renews the lease of the running job
+        """
+        self.done = done
+        if total is not None:
+            self.total = total
+        self.save(update_fields=['done', 'total', 'updated_at'])
@@ -0,0 +1,314 @@
+"""
+NLP service layer
+
+Sentences are analyzed by one of the engines below, selected with
+the ``VOCASTORY_NLP['ENGINE']`` setting:
+
+- ``local``: spaCy model loaded once in the current process
+- ``worker``: thin client of the ``run_nlp_worker`` process
+- ``stub``: deterministic rule based engine without spaCy, for tests
+"""
+import ipaddress
+import queue
+import threading
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.crypto import salted_hmac
+
+from mystory.instrumentation import timed
+from .matching import Token, simple_tokenize
+
+# Only the tokenizer, tagger and lemmatizer are needed for matching
+DISABLED_PIPES = ['parser', 'ner']
+
+DEFAULTS = {
+    'ENGINE': 'local',
+    'MODEL': 'en_core_web_md',
+    'ADDRESS': ('127.0.0.1', 6543),
+    # Requests are unpickled, None derives a key from SECRET_KEY for loopback addresses
+    'AUTHKEY': None,
+    'BATCH_SIZE': 64,
+    'BATCH_WAIT': 0.005,
+}
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_config():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, 'VOCASTORY_NLP', {}))
+    if isinstance(config['ADDRESS'], list):
+        config['ADDRESS'] = tuple(config['ADDRESS'])
+    return config
+
+
+def get_authkey(config):
+    """
+    :return: bytes of AUTHKEY, derived from SECRET_KEY if not set
+    """
+    if config['AUTHKEY']:
+        return config['AUTHKEY'].encode()
+    return salted_hmac('vocastory.nlp.authkey', 'worker').hexdigest().encode()
+
+
+def is_loopback(address):
+    """
+    Unix socket paths and loopback hosts are only reachable from this machine
+    """
+    if isinstance(address, str):
+        return True
+    host = address[0]
+    if host == 'localhost':
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def load_model(name):
+    """
+    Loads the spaCy model without the unused pipeline components
+    """
+    import warnings
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        import spacy
+        return spacy.load(name, disable=DISABLED_PIPES)
+
+
+def to_tokens(doc):
+    return [Token(t.text, t.lemma_, t.idx) for t in doc]
+
+
+class LocalEngine:
+    """
+    Runs the spaCy model inside the current process
+    """
+
+    def __init__(self, config):
+        self.model_name = config['MODEL']
+        self.batch_size = config['BATCH_SIZE']
+        self.model = None
+        self.lock = threading.Lock()
+
+    def load(self):
+        if self.model is None:
+            with self.lock:
+                if self.model is None:
+                    self.model = load_model(self.model_name)
+        return self.model
+
+    def analyze(self, text):
+        return to_tokens(self.load()(text))
+
+    def analyze_many(self, texts):
+        docs = self.load().pipe(texts, batch_size=self.batch_size)
+        return [to_tokens(doc) for doc in docs]
+
+
+class StubEngine:
+    """
+    Deterministic engine with a small rule based lemmatizer
+    """
+    IRREGULAR = {
+        'am': 'be', 'is': 'be', 'are': 'be', 'was': 'be', 'were': 'be', 'been': 'be',
+        'has': 'have', 'had': 'have', 'did': 'do', 'does': 'do', 'done': 'do',
+        'went': 'go', 'gone': 'go', 'ran': 'run', 'saw': 'see', 'seen': 'see',
+        'made': 'make', 'took': 'take', 'taken': 'take', 'came': 'come',
+        'children': 'child', 'men': 'man', 'women': 'woman', 'mice': 'mouse',
+    }
+
+    def __init__(self, config=None):
+        pass
+
+    def load(self):
+        return None
+
+    @classmethod
+    def lemmatize(cls, text):
+        t = text.lower()
+        if t in cls.IRREGULAR:
+            return cls.IRREGULAR[t]
+        if len(t) > 4 and t.endswith(('ies', 'ied')):
+            return t[:-3] + 'y'
+        if len(t) > 5 and t.endswith('ing'):
+            t = t[:-3]
+        elif len(t) > 4 and t.endswith('ed'):
+            t = t[:-2]
+        elif len(t) > 3 and t.endswith('s') and not t.endswith('ss'):
+            return t[:-1]
+        else:
+            return t
+        # Undo consonant doubling: running -> run, stopped -> stop
+        if len(t) > 2 and t[-1] == t[-2] and t[-1] not in 'aeiouls':
+            t = t[:-1]
+        return t
+
+    def analyze(self, text):
+        return [Token(t.text, self.lemmatize(t.text), t.idx)
+                for t in simple_tokenize(text)]
+
+    def analyze_many(self, texts):
+        return [self.analyze(text) for text in texts]
+
+
+class WorkerEngine:
+    """
+    Thin client of the NLP worker, keeps one connection per thread
+    """
+
+    def __init__(self, config):
+        self.address = config['ADDRESS']
+        self.authkey = get_authkey(config)
+        self.local = threading.local()
+
+    def load(self):
+        """
+        Nothing to load, the model lives in the worker process
+        """
+
+    def request(self, texts):
+        for attempt in range(2):
+            conn = getattr(self.local, 'conn', None)
+            try:
+                if conn is None:
+                    conn = Client(self.address, authkey=self.authkey)
+                    self.local.conn = conn
+                conn.send(texts)
+                status, result = conn.recv()
+                break
+            except (EOFError, OSError):
+                # Worker restarted, reconnect once
+                self.local.conn = None
+                if attempt:
+                    raise
+        if status != 'ok':
+            raise RuntimeError(f"NLP worker failed: {result}")
+        return [[Token(*t) for t in tokens] for tokens in result]
+
+    def analyze(self, text):
+        return self.request([text])[0]
+
+    def analyze_many(self, texts):
+        return self.request(list(texts))
+
+
+ENGINES = {
+    'local': LocalEngine,
+    'worker': WorkerEngine,
+    'stub': StubEngine,
+}
+
+
+def get_engine():
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                config = get_config()
+                _engine = ENGINES[config['ENGINE']](config)
+    return _engine
+
+
+@receiver(setting_changed)
+def reset_engine(setting, **kwargs):
+    global _engine
+    if setting == 'VOCASTORY_NLP':
+        _engine = None
+
+
+def analyze(text):
+    """
+    Tokenizes and lemmatizes the sentence
+    :return: list of Token
+    """
+    with timed('nlp'):
+        return get_engine().analyze(text)
+
+
+def analyze_many(texts):
+    with timed('nlp'):
+        return get_engine().analyze_many(texts)
+
+
+class NLPWorker:
+    """
+    Long lived process holding a warm spaCy model,
+    requests of all the connected clients are batched through nlp.pipe
+    """
+
+    def __init__(self, config=None, engine=None):
+        self.config = config or get_config()
+        self.engine = engine or LocalEngine(self.config)
+        self.pending = queue.Queue()
+        self.listener = None
+
+    def bind(self):
+        if not self.config['AUTHKEY'] and not is_loopback(self.config['ADDRESS']):
+            # Anyone holding the key runs code in the worker, the derived one may be public
+            raise ImproperlyConfigured(
+                "Set VOCASTORY_NLP['AUTHKEY'] to serve on a non loopback address")
+        self.listener = Listener(self.config['ADDRESS'], authkey=get_authkey(self.config))
+        return self.listener.address
+
+    def serve_forever(self):
+        if self.listener is None:
+            self.bind()
+        self.engine.load()
+        threading.Thread(target=self.batch_loop, daemon=True).start()
+        with self.listener:
+            while True:
+                try:
+                    conn = self.listener.accept()
+                except (OSError, AuthenticationError):
+                    # Failed handshake, keep serving the others
+                    continue
+                threading.Thread(target=self.handle, args=(conn,), daemon=True).start()
+
+    def handle(self, conn):
+        reply = queue.Queue(maxsize=1)
+        with conn:
+            while True:
+                try:
+                    texts = conn.recv()
+                except (EOFError, OSError):
+                    return
+                self.pending.put((texts, reply))
+                conn.send(reply.get())
+
+    def next_batch(self):
+        """
+        Waits for a request, then collects the ones arriving shortly after
+        """
+        batch = [self.pending.get()]
+        size = len(batch[0][0])
+        while size < self.config['BATCH_SIZE']:
+            try:
+                item = self.pending.get(timeout=self.config['BATCH_WAIT'])
+            except queue.Empty:
+                break
+            batch.append(item)
+            size += len(item[0])
+        return batch
+
+    def batch_loop(self):
+        while True:
+            batch = self.next_batch()
+            texts = [text for texts, _ in batch for text in texts]
+            try:
+                results = [[tuple(t) for t in tokens]
+                           for tokens in self.engine.analyze_many(texts)]
+            except Exception as e:
+                for _, reply in batch:
+                    reply.put(('error', repr(e)))
+                continue
+            for texts, reply in batch:
+                reply.put(('ok', results[:len(texts)]))
+                results = results[len(texts):]
@@ -0,0 +1,30 @@
+from django.utils.html import escape
+
+DIC_REFERENCE = "<a href='/vocastory/show_meaning/{}/'>{}</a>"
+
+
+def get_dic_reference(word_id, text):
+    """
+    Dictionary link markup for a word
+    """
+    return DIC_REFERENCE.format(word_id, escape(text))
+
+
+def stylize_text(text, matches):
+    """
+    Links the matched spans of the text to their dictionary pages
+    in a single pass, only the given occurrences are linked
+    :param matches: iterable of Match(word, start, end) in text coordinates
+    :return: html of the text
+    """
+    parts = []
+    cursor = 0
+    for m in sorted(matches, key=lambda m: m.start):
+        if m.start < cursor:
+            # Overlapping spans are never linked twice
+            continue
+        parts.append(escape(text[cursor:m.start]))
+        parts.append(get_dic_reference(m.word.id, text[m.start:m.end]))
+        cursor = m.end
+    parts.append(escape(text[cursor:]))
+    return ''.join(parts)
@@ -0,0 +1,36 @@
+from django.db.models.signals import m2m_changed
+from django.dispatch import receiver
+
+from . import dictionary, jobs
+from .models import Story, WordSet, new_version
+
+
+@receiver(m2m_changed, sender=WordSet.words.through)
+def word_set_words_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Unused word lists of the stories and the word set cards depend on the word set words
+    """
+    # Clearing has no pk_set, the links are read before they are removed
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if reverse:
+        # Word side, pk_set holds the word sets
+        word_sets = WordSet.objects.filter(words=instance) if pk_set is None \
+            else WordSet.objects.filter(pk__in=pk_set)
+    else:
+        word_sets = WordSet.objects.filter(pk=instance.pk)
+    stories = Story.objects.filter(word_set__in=word_sets.values('pk'))
+    Story.objects.filter(pk__in=stories.values('pk')).update(version=new_version())
+    WordSet.objects.filter(pk__in=word_sets.values('pk')).update(version=new_version())
+
+
+@receiver(m2m_changed, sender=WordSet.words.through)
+def word_set_words_added(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Prefetches the meanings of the new words in the background,
+    so that the first clicks on them are served from the store
+    """
+    if action != 'post_add' or not pk_set or not dictionary.get_remote():
+        return
+    word_ids = [instance.pk] if reverse else sorted(pk_set)
+    jobs.enqueue('prefetch_meanings', word_ids=word_ids)
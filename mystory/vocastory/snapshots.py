@@ -0,0 +1,78 @@
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+
+
+class StorySnapshot:
+    """
+    Selected sentences and word usage of a story version,
+    computed once and shared through the cache
+    """
+
+    def __init__(self, sentences, used_words, all_words):
+        """
+        :param sentences: (order, text, stylized_text) of the selected sentences
+        :param used_words: (id, text) of the words used by the selected sentences
+        :param all_words: (id, text) of the word set words
+        """
+        self.sentences = sentences
+        self.used_words = used_words
+        used_ids = set(pk for pk, _ in used_words)
+        self.unused_words = [w for w in all_words if w[0] not in used_ids]
+
+    @classmethod
+    def build(cls, story):
+        Sentence = apps.get_model('vocastory', 'Sentence')
+        Word = apps.get_model('vocastory', 'Word')
+        selected = Sentence.objects.filter(story=story, is_selected=True)
+        sentences = list(selected.order_by('order').values_list('order', 'text', 'stylized_text'))
+        used_words = list(Word.objects.filter(sentence__in=selected).distinct()
+                          .order_by('pk').values_list('pk', 'text'))
+        all_words = []
+        if story.word_set_id is not None:
+            all_words = list(Word.objects.filter(wordset=story.word_set_id)
+                             .order_by('pk').values_list('pk', 'text'))
+        return cls(sentences, used_words, all_words)
+
+    @staticmethod
+    def cache_key(story):
+        return f"story-snapshot:{story.pk}:{story.version}"
+
+    @classmethod
+    def get(cls, story):
+        """
+        Snapshot of the current story version, built on cache miss
+        """
+        key = cls.cache_key(story)
+        snapshot = cache.get(key)
+        if snapshot is None:
+            snapshot = cls.build(story)
+            cache.set(key, snapshot, getattr(settings, 'VOCASTORY_SNAPSHOT_TIMEOUT', None))
+        return snapshot
+
+    @property
+    def last_selected_index(self):
+        return self.sentences[-1][0] if self.sentences else -1
+
+    @property
+    def text(self):
+        return " ".join(text for _, text, _ in self.sentences)
+
+    @property
+    def stylized_text(self):
+        return " ".join(stylized for _, _, stylized in self.sentences)
+
+    @property
+    def stylized_last_two(self):
+        return " ".join(stylized for _, _, stylized in self.sentences[-2:])
+
+    @staticmethod
+    def to_words(rows):
+        Word = apps.get_model('vocastory', 'Word')
+        return [Word.from_db('default', ['id', 'text'], row) for row in rows]
+
+    def get_used_word_list(self):
+        return self.to_words(self.used_words)
+
+    def get_unused_word_list(self):
+        return self.to_words(self.unused_words)
@@ -1,3 +1,818 @@
-from django.test import TestCase
+import io
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import DatabaseError, connection
+from django.db.models import F
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from accounts.models import CustomUser
+from mystory.testing import QueryBudgetMixin
+from . import corpus, dictionary, jobs
+from .matching import WordMatcher, Token, simple_tokenize
+from .models import Word, WordForm, WordMeaning, WordSet, Story, Sentence, StoryReview, Job, Vote
+from .eligibility import readable_stories, writable_stories, reviewable_stories, pick_random
+from .lemmas import LemmaCache, get_config as get_lemma_config
+from .nlp import NLPWorker, StubEngine, WorkerEngine, get_authkey
+from .rendering import stylize_text
+
+
+class WordMatcherTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user('writer', password='pass')
+        cls.word_set = WordSet.objects.create(title='Test', creator=cls.user)
+        cls.words = {t: Word.objects.create(text=t) for t in ('run', 'brave', 'castle')}
+        cls.word_set.words.add(*cls.words.values())
+
+    def test_matches_lemma_and_surface_form(self):
+        tokens = [Token('Ran', 'run', 0), Token('to', 'to', 4), Token('castle', 'castle', 7)]
+        matches = WordMatcher.for_word_set(self.word_set).match(tokens)
+        self.assertEqual([m.word for m in matches], [self.words['run'], self.words['castle']])
+        self.assertEqual([(m.start, m.end) for m in matches], [(0, 3), (7, 13)])
+
+    def test_query_count_does_not_grow_with_sentence(self):
+        for length in (5, 200):
+            tokens = simple_tokenize(' '.join(['brave knight'] * length))
+            with self.assertNumQueries(1):
+                matches = WordMatcher.for_word_set(self.word_set).match(tokens)
+            self.assertEqual(len(matches), length)
+
+
+class StylizeTextTests(TestCase):
+
+    def test_links_only_matched_occurrences(self):
+        on, one = Word(id=1, text='on'), Word(id=2, text='one')
+        text = 'One went on and on.'
+        matches = [m for m in WordMatcher([on, one]).match(simple_tokenize(text))
+                   if m.start != 16]
+        self.assertEqual(
+            stylize_text(text, matches),
+            "<a href='/vocastory/show_meaning/2/'>One</a> went "
+            "<a href='/vocastory/show_meaning/1/'>on</a> and on.")
+
+    def test_escapes_user_text(self):
+        word = Word(id=3, text='brave')
+        text = '<b>brave</b>'
+        self.assertEqual(
+            stylize_text(text, WordMatcher([word]).match(simple_tokenize(text))),
+            "&lt;b&gt;<a href='/vocastory/show_meaning/3/'>brave</a>&lt;/b&gt;")
+
+
+@override_settings(VOCASTORY_NLP={'ENGINE': 'stub'})
+class SentenceCreateTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user('writer', password='pass')
+        cls.word_set = WordSet.objects.create(title='Test', creator=cls.user)
+        cls.word = Word.objects.create(text='run')
+        cls.word_set.words.add(cls.word)
+        cls.story = Story.objects.create(word_set=cls.word_set)
+
+    def test_create_links_inflected_word(self):
+        sentence = Sentence.create(0, 'They were running home', self.story, self.user)
+        self.assertEqual(
+            sentence.stylized_text,
+            "They were <a href='/vocastory/show_meaning/%d/'>running</a> home." % self.word.id)
+        self.assertEqual(list(sentence.used_words.all()), [self.word])
+
+    def test_create_with_forms_skips_nlp(self):
+        self.word.build_forms()
+        self.assertIn('running', set(self.word.forms.values_list('text', flat=True)))
+        with mock.patch('vocastory.models.analyze') as analyze:
+            sentence = Sentence.create(0, 'Ran away', self.story, self.user)
+        analyze.assert_not_called()
+        self.assertEqual(list(sentence.used_words.all()), [self.word])
+
+    def test_create_falls_back_to_nlp(self):
+        leaf = Word.objects.create(text='leaf')
+        self.word_set.words.add(leaf)
+        self.word.build_forms()
+        leaf.build_forms()
+        self.assertNotIn('leaves', set(leaf.forms.values_list('text', flat=True)))
+        tokens = [Token('Leaves', 'leaf', 0), Token('fell', 'fall', 7)]
+        with mock.patch('vocastory.models.analyze', return_value=tokens) as analyze:
+            sentence = Sentence.create(0, 'Leaves fell', self.story, self.user)
+        analyze.assert_called_once_with('Leaves fell.')
+        self.assertEqual(list(sentence.used_words.all()), [leaf])
+
+    def test_create_merges_forms_and_nlp(self):
+        leaf = Word.objects.create(text='leaf')
+        self.word_set.words.add(leaf)
+        self.word.build_forms()
+        leaf.build_forms()
+        tokens = [Token('Leaves', 'leaf', 0), Token('were', 'be', 7), Token('running', 'run', 12)]
+        with mock.patch('vocastory.models.analyze', return_value=tokens) as analyze:
+            sentence = Sentence.create(0, 'Leaves were running', self.story, self.user)
+        analyze.assert_called_once_with('Leaves were running.')
+        self.assertEqual(set(sentence.used_words.all()), {self.word, leaf})
+        self.assertEqual(sentence.stylized_text.count('<a '), 2)
+
+    def test_create_without_word_set_words(self):
+        self.assertIsNone(Sentence.create(0, 'Nothing to see here', self.story, self.user))
+
+
+class NLPWorkerTests(TestCase):
+
+    def test_worker_round_trip(self):
+        config = {'ADDRESS': ('127.0.0.1', 0), 'AUTHKEY': 'test',
+                  'BATCH_SIZE': 8, 'BATCH_WAIT': 0.001}
+        worker = NLPWorker(config, engine=StubEngine())
+        config['ADDRESS'] = worker.bind()
+        threading.Thread(target=worker.serve_forever, daemon=True).start()
+
+        client = WorkerEngine(config)
+        self.assertEqual(client.analyze('Mice ran'), StubEngine().analyze('Mice ran'))
+        self.assertEqual(len(client.analyze_many(['a b', 'c'])), 2)
+
+    def test_default_key_stays_on_loopback(self):
+        config = {'ADDRESS': ('0.0.0.0', 0), 'AUTHKEY': None}
+        with self.assertRaises(ImproperlyConfigured):
+            NLPWorker(config, engine=StubEngine()).bind()
+        key = get_authkey(config)
+        with override_settings(SECRET_KEY='other'):
+            self.assertNotEqual(get_authkey(config), key)
+
+        config = {'ADDRESS': ('127.0.0.1', 0), 'AUTHKEY': None, 'BATCH_SIZE': 8, 'BATCH_WAIT': 0.001}
+        worker = NLPWorker(config, engine=StubEngine())
+        config['ADDRESS'] = worker.bind()
+        threading.Thread(target=worker.serve_forever, daemon=True).start()
+        self.assertEqual(WorkerEngine(config).analyze('Mice ran'), StubEngine().analyze('Mice ran'))
+
+
+class LemmaCacheTests(TestCase):
+
+    def setUp(self):
+        self.calls = []
+
+    def engine(self, text):
+        self.calls.append(text)
+        return StubEngine().analyze(text)
+
+    def test_skips_engine_when_all_words_cached(self):
+        cache = LemmaCache(get_lemma_config())
+        cache.analyze('The children ran home', self.engine)
+        tokens = cache.analyze('Home the children ran', self.engine)
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual([t.lemma_ for t in tokens], ['home', 'the', 'child', 'run'])
+        self.assertEqual(tokens[3].idx, 18)
+        cache.analyze('The children ran away', self.engine)
+        self.assertEqual(len(self.calls), 2)
+        stats = cache.stats()
+        self.assertEqual((stats['nlp_calls'], stats['nlp_skipped']), (2, 1))
+
+    def test_size_is_bounded(self):
+        config = dict(get_lemma_config(), SIZE=2)
+        cache = LemmaCache(config)
+        cache.analyze('one two three', self.engine)
+        self.assertEqual(len(cache.lemmas), 2)
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_shared_backend(self):
+        config = dict(get_lemma_config(), BACKEND='default')
+        LemmaCache(config).analyze('brave knights', self.engine)
+        LemmaCache(config).analyze('knights brave', self.engine)
+        self.assertEqual(len(self.calls), 1)
+
+
+class StoryScoreTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [CustomUser.objects.create_user(f'reviewer{i}', password='pass') for i in range(3)]
+        cls.story = Story.objects.create(completed=True)
+
+    def test_score_follows_review_edits(self):
+        StoryReview.create_or_edit(self.users[0], self.story, False, 6, 6, 6, 'Lovely story')
+        StoryReview.create_or_edit(self.users[1], self.story, False, 2, 4, 6, '')
+        self.assertEqual(self.story.score, (6 + 6 + 6 + 2 + 4 + 6) / 2 + 1)
+
+        StoryReview.create_or_edit(self.users[1], self.story, False, 10, 10, 10, 'Much better')
+        story = Story.objects.get(pk=self.story.pk)
+        self.assertEqual((story.review_count, story.commented_count), (2, 2))
+        self.assertEqual(story.score, 48 / 2 + 2)
+
+        Story.objects.filter(pk=story.pk).update(score=0, review_count=0)
+        Story.rebuild_scores()
+        self.assertEqual(Story.objects.get(pk=story.pk).score, 48 / 2 + 2)
+
+    def test_top_stories_only_completed(self):
+        Story.objects.create(completed=False)
+        self.assertEqual(list(Story.get_top_stories_ordered()), [self.story])
+
+    def test_top_stories_pages(self):
+        stories = [Story.objects.create(completed=True, score=s) for s in (5, 3, 5, 1)]
+        page, cursor = Story.get_top_stories(limit=2)
+        self.assertEqual(page, [stories[0], stories[2]])
+        page, cursor = Story.get_top_stories(cursor, limit=2)
+        self.assertEqual(page, [stories[1], stories[3]])
+        page, cursor = Story.get_top_stories(cursor, limit=2)
+        self.assertEqual((page, cursor), ([self.story], None))
+
+    def test_home_queries_do_not_grow(self):
+        user = self.users[0]
+        self.client.force_login(user)
+        for count in (2, 8):
+            cache.clear()
+            for i in range(count):
+                story = Story.objects.create(completed=True, score=i)
+                Sentence.objects.create(story=story, creator=user, is_selected=True,
+                                        text=f'Story {i}.', stylized_text=f'Story {i}.')
+            # Session, user, notifications, stories and their sentences
+            with self.assertNumQueries(5):
+                response = self.client.get(reverse('home'))
+            self.assertContains(response, 'Story 1.')
+            # The cards are cached, the sentences are not read
+            with self.assertNumQueries(4):
+                response = self.client.get(reverse('home'))
+            self.assertContains(response, 'Story 1.')
+
+
+class StorySnapshotTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user('writer', password='pass')
+        cls.word_set = WordSet.objects.create(title='Test', creator=cls.user)
+        cls.words = [Word.objects.create(text=t) for t in ('brave', 'castle')]
+        cls.word_set.words.add(*cls.words)
+        cls.story = Story.objects.create(word_set=cls.word_set)
+        sentence = Sentence.objects.create(story=cls.story, creator=cls.user, order=0,
+                                           text='A brave king.', stylized_text='A <a>brave</a> king.',
+                                           is_selected=True)
+        sentence.used_words.add(cls.words[0])
+
+    def test_story_text_is_cached_per_version(self):
+        story = Story.objects.get(pk=self.story.pk)
+        self.assertEqual(story.get_text(), 'A brave king.')
+        self.assertEqual(story.get_unused_word_list(), [self.words[1]])
+
+        story = Story.objects.get(pk=self.story.pk)
+        with self.assertNumQueries(0):
+            story.get_stylized_text()
+            story.get_stylized_last_two()
+            story.get_used_word_list()
+
+        Sentence.objects.create(story=story, creator=self.user, order=1, text='The castle.',
+                                stylized_text='The castle.', is_selected=True)
+        story.bump_version()
+        self.assertEqual(story.get_text(), 'A brave king. The castle.')
+
+    def test_word_set_change_invalidates(self):
+        story = Story.objects.get(pk=self.story.pk)
+        self.assertEqual(len(story.get_unused_word_list()), 1)
+        self.word_set.words.add(Word.objects.create(text='dragon'))
+        story = Story.objects.get(pk=self.story.pk)
+        self.assertEqual(len(story.get_unused_word_list()), 2)
+
+
+class EligibilityTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [CustomUser.objects.create_user(f'player{i}', password='pass') for i in range(5)]
+        word_set = WordSet.objects.create(title='Test', creator=cls.users[0])
+        cls.stories = [Story.objects.create(word_set=word_set) for _ in range(6)]
+        Story.objects.create(word_set=None)
+
+        def add(story, creator, order, selected=False, voters=()):
+            sentence = Sentence.objects.create(story=story, creator=creator, order=order,
+                                               text='Some text.', is_selected=selected)
+            sentence.voted_users.add(*voters)
+
+        u = cls.users
+        # Three candidates of others for player0 and player4
+        for creator in u[1:4]:
+            add(cls.stories[0], creator, 0)
+        # player1 voted on the open round, the old round does not count
+        add(cls.stories[1], u[0], 0, selected=True)
+        add(cls.stories[1], u[2], 0, voters=[u[4]])
+        for creator in u[1:4]:
+            add(cls.stories[1], creator, 1, voters=[u[1]] if creator == u[2] else [])
+        add(cls.stories[2], u[0], 0)
+        cls.stories[3].completed = True
+        cls.stories[3].save()
+        cls.stories[4].completed = True
+        cls.stories[4].save()
+        StoryReview.create_or_edit(u[0], cls.stories[4], False, 1, 1, 1, '')
+        Story.rebuild_state()
+
+    def test_matches_per_story_checks(self):
+        stories = Story.objects.filter(word_set__isnull=False)
+        for user in self.users:
+            for bulk, check in ((readable_stories, Story.is_readable),
+                                (writable_stories, Story.is_writable),
+                                (reviewable_stories, Story.is_reviewable)):
+                expected = set(s.pk for s in stories if check(s, user))
+                self.assertEqual(set(bulk(user).values_list('pk', flat=True)), expected)
+
+    def test_query_count_is_constant(self):
+        for story in self.stories:
+            Sentence.objects.create(story=story, creator=self.users[1], order=0, text='More.')
+        with self.assertNumQueries(2):
+            pick_random(writable_stories(self.users[0]))
+
+
+@override_settings(VOCASTORY_NLP={'ENGINE': 'stub'})
+class SentencePollTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [CustomUser.objects.create_user(f'player{i}', password='pass') for i in range(8)]
+        word_set = WordSet.objects.create(title='Test', creator=cls.users[0])
+        word_set.words.add(Word.objects.create(text='brave'))
+        cls.story = Story.objects.create(word_set=word_set)
+
+    def test_candidates_and_selection_update_state(self):
+        sentences = [Sentence.create(0, f'A brave knight number {i}', self.story, u)
+                     for i, u in enumerate(self.users[:3])]
+        story = Story.objects.get(pk=self.story.pk)
+        self.assertEqual((story.selected_order, story.candidate_count), (-1, 3))
+        self.assertEqual(story.last_candidate_date, sentences[-1].creation_date)
+        self.assertTrue(story.is_readable(self.users[3]))
+
+        for voter in self.users[3:8]:
+            sentences[1].vote_sentence(voter)
+        story.close_sentence_poll()
+        story = Story.objects.get(pk=self.story.pk)
+        self.assertEqual((story.selected_order, story.candidate_count), (0, 0))
+        self.assertIsNone(story.last_candidate_date)
+        self.assertTrue(Sentence.objects.get(pk=sentences[1].pk).is_selected)
+        self.assertEqual(CustomUser.objects.get(pk=self.users[1].pk).points, 10)
+        self.assertEqual(CustomUser.objects.get(pk=self.users[3].pk).points, 2)
+
+        # Stale sentences of the closed round are not candidates anymore
+        Sentence.create(0, 'A late brave answer', story, self.users[4])
+        self.assertEqual(Story.objects.get(pk=self.story.pk).candidate_count, 0)
+
+    def test_vote_once(self):
+        sentence = Sentence.create(0, 'A brave knight', self.story, self.users[0])
+        for voter in self.users[1:6]:
+            # Insert and counter update, whatever the number of voters
+            with self.assertNumQueries(4):
+                self.assertTrue(sentence.vote_sentence(voter))
+        self.assertFalse(sentence.vote_sentence(self.users[1]))
+        sentence = Sentence.objects.get(pk=sentence.pk)
+        self.assertEqual((sentence.vote_count, sentence.voted_users.count()), (5, 5))
+
+        Sentence.objects.filter(pk=sentence.pk).update(vote_count=0)
+        Sentence.rebuild_vote_counts()
+        self.assertEqual(Sentence.objects.get(pk=sentence.pk).vote_count, 5)
+
+    def test_poll_scheduler(self):
+        sentences = [Sentence.create(0, f'A brave knight number {i}', self.story, u)
+                     for i, u in enumerate(self.users[:3])]
+        for voter in self.users[3:6]:
+            sentences[2].vote_sentence(voter)
+            Story.objects.get(pk=self.story.pk).request_poll_check()
+        self.assertEqual(Story.close_due_polls(), (1, 0))
+        # Three votes close the poll five minutes after the last candidate
+        story = Story.objects.get(pk=self.story.pk)
+        self.assertEqual(story.poll_due, sentences[-1].creation_date + timezone.timedelta(minutes=5))
+        self.assertEqual(Story.close_due_polls(), (0, 0))
+
+        later = story.poll_due + timezone.timedelta(seconds=1)
+        self.assertEqual(Story.close_due_polls(later), (1, 1))
+        story = Story.objects.get(pk=self.story.pk)
+        self.assertEqual((story.selected_order, story.poll_due), (0, None))
+        self.assertTrue(Sentence.objects.get(pk=sentences[2].pk).is_selected)
+
+    def test_vote_view_defers_closing(self):
+        sentences = [Sentence.create(0, f'A brave knight number {i}', self.story, u)
+                     for i, u in enumerate(self.users[:3])]
+        for voter in self.users[3:7]:
+            sentences[0].vote_sentence(voter)
+        self.client.force_login(self.users[7])
+        response = self.client.post(self.story.get_read_url(),
+                                    {'order': 0, 'sentence_choice': sentences[0].pk})
+        self.assertEqual(response.status_code, 302)
+        story = Story.objects.get(pk=self.story.pk)
+        self.assertEqual(story.selected_order, -1)
+        self.assertIsNotNone(story.poll_due)
+        Story.close_due_polls()
+        self.assertEqual(Story.objects.get(pk=self.story.pk).selected_order, 0)
+
+
+class BrowseTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user('writer', password='pass')
+        cls.small, cls.popular = [WordSet.objects.create(title=t, creator=cls.user)
+                                  for t in ('Small', 'Popular')]
+        cls.popular.words.add(*[Word.objects.create(text=t) for t in ('brave', 'castle')])
+        cls.popular.starred_users.add(cls.user)
+        Story.objects.bulk_create([Story(word_set=cls.small) for _ in range(3)])
+        Story.objects.bulk_create([Story(word_set=cls.popular, completed=i % 2 == 0)
+                                   for i in range(300)])
+        Sentence.objects.bulk_create([
+            Sentence(story=story, creator=cls.user, is_selected=True,
+                     text='A brave knight.', stylized_text='A brave knight.')
+            for story in Story.objects.all()])
+
+    def setUp(self):
+        cache.clear()
+
+    def test_story_list_queries_are_fixed(self):
+        for word_set in (self.small, self.popular):
+            # Word set with its counts, its words, the stories and their sentences
+            with self.assertNumQueries(4):
+                response = self.client.get(word_set.get_absolute_url(), {'page': 2})
+            self.assertContains(response, 'A brave kn')
+        self.assertEqual(response.context['page'].paginator.num_pages, 15)
+        self.assertContains(response, '1 stars')
+
+    def test_story_cards_are_shared_by_browse_and_home(self):
+        Story.objects.filter(word_set=self.small).update(completed=True, score=100)
+        self.client.force_login(self.user)
+        self.client.get(self.small.get_absolute_url())
+        response = self.client.get(reverse('home'))
+        # The cards cached by the browse page get the wrapper of the home page
+        self.assertEqual(response.content.decode().count('card-text shadow-sm'),
+                         len(response.context['stories']))
+
+    def test_word_set_list(self):
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('browse_word_sets'))
+        word_sets = list(response.context['word_sets'])
+        self.assertEqual([(w.story_count, w.star_count, w.word_count) for w in word_sets],
+                         [(3, 0, 0), (300, 1, 2)])
+
+    def test_word_set_card_follows_title_and_words(self):
+        self.client.get(reverse('browse_word_sets'))
+        word_set = WordSet.objects.get(pk=self.popular.pk)
+        word_set.title = 'Renamed'
+        word_set.save()
+        # Same counts, other words
+        word_set.words.remove(Word.objects.get(text='brave'))
+        word_set.words.add(Word.objects.create(text='dragon'))
+        response = self.client.get(reverse('browse_word_sets'))
+        self.assertContains(response, 'Renamed')
+        self.assertContains(response, 'dragon')
+        self.assertNotContains(response, 'brave')
+
+
+class QueryPlanTests(TestCase):
+    """
+    Fails when a hot query falls back to a full table scan
+    """
+    FULL_SCAN = re.compile(r'\bSCAN (?:TABLE )?\w+\b(?! USING)')
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user('player', password='pass')
+        cls.story = Story.objects.create(word_set=WordSet.objects.create(title='Test', creator=cls.user))
+
+    def get_querysets(self):
+        now = timezone.now()
+        story, user = self.story, self.user
+        return {
+            'top_stories': Story.get_top_stories_ordered()[:10],
+            'selected_sentences': story.get_selected_sentences(story.get_last_selected_index()),
+            'candidate_sentences': story.get_candidate_sentences(story.get_candidate_index()),
+            'sentence_entries_range': Sentence.objects.filter(
+                creation_date__gte=now, creation_date__lt=now),
+            'user_entries_range': CustomUser.objects.filter(
+                date_joined__gte=now, date_joined__lt=now),
+            'reviews_of_user': story.review_set.filter(creator=user),
+            'readable_stories': readable_stories(user),
+            'writable_stories': writable_stories(user),
+            'reviewable_stories': reviewable_stories(user),
+            'leaderboard': CustomUser.get_leaderboard()[:50],
+            'rank': user.ranked_above(),
+            'selected_of_user': user.created_sentences.filter(is_selected=True),
+            'due_polls': Story.objects.filter(poll_due__lte=now).order_by('poll_due')[:100],
+            'due_jobs': jobs.due_jobs(now),
+            'unread_notifications': user.notifications.filter(read_at__isnull=True).order_by('-pk')[:10],
+            'notification_feed': user.notifications.filter(pk__lt=100).order_by('-pk')[:20],
+        }
+
+    def test_no_full_table_scans(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('Plan format is specific to SQLite')
+        for name, queryset in self.get_querysets().items():
+            plan = queryset.explain()
+            with self.subTest(query=name):
+                self.assertIsNone(self.FULL_SCAN.search(plan), plan)
+
+
+@override_settings(VOCASTORY_NLP={'ENGINE': 'stub'})
+class QueryBudgetTests(QueryBudgetMixin, TestCase):
+    """
+    Game loop views against QUERY_BUDGETS, with enough rows for N+1 queries to show
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [CustomUser.objects.create_user(f'player{i}', password='pass', points=i)
+                     for i in range(12)]
+        cls.player = cls.users[0]
+        word_set = WordSet.objects.create(title='Test', creator=cls.player)
+        word_set.words.add(*[Word.objects.create(text=t) for t in ('brave', 'castle')])
+        cls.story = Story.objects.create(word_set=word_set)
+        for i, user in enumerate(cls.users[1:6]):
+            Sentence.create(0, f'A brave knight number {i}', cls.story, user)
+        for i in range(12):
+            story = Story.objects.create(word_set=word_set, completed=True, score=i)
+            Sentence.objects.create(story=story, creator=cls.users[i], is_selected=True,
+                                    text=f'Story {i}.', stylized_text=f'Story {i}.')
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.player)
+
+    def test_game_loop_views(self):
+        self.assertWithinBudget(self.client.get(reverse('home')))
+        self.assertWithinBudget(self.client.get(reverse('see_leaderboard')))
+        self.assertWithinBudget(self.client.get(reverse('see_leaderboard')))
+        response = self.client.get(self.story.get_read_url())
+        self.assertEqual(response.status_code, 200)
+        self.assertWithinBudget(response)
+        candidate = self.story.get_candidate_sentences(0).first()
+        self.assertWithinBudget(self.client.post(self.story.get_read_url(),
+                                                 {'order': 0, 'sentence_choice': candidate.pk}))
+        url = self.story.get_write_url()
+        self.assertWithinBudget(self.client.get(url))
+        self.assertWithinBudget(self.client.post(url, {'order': 0, 'sentence': 'A brave castle.'}))
+
+    def test_play_loop(self):
+        # Read, write and review branches
+        for val in (0.1, 0.5, 0.95):
+            with mock.patch('vocastory.views.random.uniform', return_value=val):
+                response = self.client.get(reverse('play'))
+            self.assertEqual(response.status_code, 302)
+            self.assertWithinBudget(response)
+
+    @override_settings(VOCASTORY_SERVER_TIMING=True)
+    def test_server_timing(self):
+        response = self.client.get(reverse('home'))
+        stats = response.instrumentation
+        self.assertGreater(stats.timings['template'], 0)
+        self.assertIn(f'queries;desc="{stats.queries} queries"', response['Server-Timing'])
+        self.assertIn('total;dur=', response['Server-Timing'])
+
+
+def fixture_remote(text):
+    """
+    Stand-in of the remote dictionary
+    """
+    if text == 'slow':
+        time.sleep(0.5)
+    if text == 'broken':
+        raise ConnectionError(text)
+    if text in ('remote', 'slow'):
+        return {'Noun': [f'definition of {text}']}
+    return None
+
+
+@override_settings(VOCASTORY_DICTIONARY={'REMOTE': 'vocastory.tests.fixture_remote', 'TIMEOUT': 0.1})
+class DictionaryTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        path = os.path.join(settings.BASE_DIR, 'fixtures', 'meanings.jsonl')
+        call_command('import_meanings', path, stdout=io.StringIO())
+        cls.word = Word.objects.create(text='Heed')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_lookup_from_store(self):
+        with self.assertNumQueries(1):
+            meanings = dictionary.lookup('Heed')
+        self.assertEqual(meanings['Verb'], ['pay close attention to; give heed to'])
+        with self.assertNumQueries(0):
+            self.assertEqual(dictionary.lookup('heed'), meanings)
+
+    def test_lookup_remote(self):
+        self.assertEqual(dictionary.lookup('remote'), {'Noun': ['definition of remote']})
+        self.assertEqual(WordMeaning.objects.get(text='remote').source, 'vocastory.tests.fixture_remote')
+        self.assertIsNone(dictionary.lookup('unknown'))
+        # Slower than the timeout
+        self.assertIsNone(dictionary.lookup('slow'))
+        self.assertFalse(WordMeaning.objects.filter(text='slow').exists())
+
+    def test_hung_lookups_do_not_block_the_next_ones(self):
+        release = threading.Event()
+        remote = mock.Mock(side_effect=lambda text: release.wait() and None)
+        config = {'REMOTE': 'vocastory.tests.fixture_remote', 'TIMEOUT': 0.05, 'MAX_PENDING': 2}
+        with override_settings(VOCASTORY_DICTIONARY=config), \
+                mock.patch('vocastory.dictionary.get_remote', return_value=remote):
+            for text in ('hung', 'stuck', 'skipped'):
+                self.assertIsNone(dictionary.fetch_remote(text))
+            # The third lookup is not submitted while two hang
+            self.assertEqual(remote.call_count, 2)
+            release.set()
+            deadline = time.monotonic() + 1
+            while dictionary._pending and time.monotonic() < deadline:
+                time.sleep(0.01)
+        self.assertEqual(dictionary.fetch_remote('remote'), {'Noun': ['definition of remote']})
+
+    def test_source_fits_the_default_remote(self):
+        remote = 'vocastory.dictionary.fetch_pydictionary'
+        with override_settings(VOCASTORY_DICTIONARY={'REMOTE': remote}), \
+                mock.patch('vocastory.dictionary.fetch_pydictionary', fixture_remote):
+            dictionary.lookup('remote')
+            dictionary.prefetch(['slow'])
+        entries = WordMeaning.objects.filter(text__in=['remote', 'slow'])
+        self.assertEqual(len(entries), 2)
+        for entry in entries:
+            self.assertEqual(entry.source, remote)
+            # SQLite does not enforce the length
+            entry.full_clean()
+
+    def test_prefetch_does_not_wait_for_hung_lookups(self):
+        start = time.monotonic()
+        self.assertEqual(dictionary.prefetch(['slow', 'remote']), ['slow'])
+        self.assertLess(time.monotonic() - start, 0.4)
+        self.assertTrue(WordMeaning.objects.filter(text='remote').exists())
+        # Past the deadline the remaining words are given up
+        self.assertEqual(dictionary.prefetch(['unknown'], deadline=time.monotonic()), ['unknown'])
+
+    def test_show_word_meaning(self):
+        response = self.client.get(self.word.get_absolute_url())
+        self.assertContains(response, 'paying particular notice')
+
+
+@override_settings(VOCASTORY_DICTIONARY={'REMOTE': 'vocastory.tests.fixture_remote', 'TIMEOUT': 1})
+class JobTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user('tester', password='pass')
+        cls.word_set = WordSet.objects.create(title='Test', creator=cls.user)
+        WordMeaning.objects.create(text='heed', meanings='{}')
+        cls.words = [Word.objects.create(text=t) for t in ('remote', 'heed', 'unknown')]
+
+    def test_prefetch_on_words_added(self):
+        self.word_set.words.add(*self.words)
+        job = Job.objects.get(kind='prefetch_meanings')
+        self.assertEqual(jobs.run_due(), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.done, job.total, job.attempts), (Job.DONE, 2, 2, 1))
+        self.assertTrue(WordMeaning.objects.filter(text='remote').exists())
+        self.assertEqual(jobs.run_due(), 0)
+
+    def test_retry(self):
+        broken = Word.objects.create(text='broken')
+        job = jobs.enqueue('prefetch_meanings', word_ids=[broken.pk, self.words[0].pk])
+        jobs.run_due()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.PENDING, 1))
+        self.assertIn('broken', job.error)
+        # Words fetched by the failed attempt are kept
+        self.assertTrue(WordMeaning.objects.filter(text='remote').exists())
+        self.assertEqual(jobs.run_due(), 0)
+
+        for _ in range(job.max_attempts - 1):
+            Job.objects.filter(pk=job.pk).update(run_after=timezone.now())
+            jobs.run_due()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.FAILED, job.max_attempts))
+
+    def test_claim_once(self):
+        job = jobs.enqueue('prefetch_meanings', word_ids=[])
+        other = Job.objects.get(pk=job.pk)
+        self.assertTrue(jobs.claim(job))
+        self.assertFalse(jobs.claim(other))
+
+
+class LoadTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command('generate_load', users=30, word_sets=3, stories=20, batch_size=8,
+                     stdout=io.StringIO())
+
+    def setUp(self):
+        cache.clear()
+
+    def test_generated_data_is_consistent(self):
+        self.assertEqual(Story.objects.count(), 20)
+        self.assertEqual(WordSet.objects.get(title='load 0').words.count(), 10)
+        for story in Story.objects.filter(completed=True):
+            self.assertEqual(story.get_last_selected_index() + 1,
+                             story.sentence_set.filter(is_selected=True).count())
+        self.assertEqual(sum(Sentence.objects.values_list('vote_count', flat=True)),
+                         Vote.objects.count())
+        # Writers never vote in their own round
+        self.assertFalse(Vote.objects.filter(sentence__creator=F('user')).exists())
+
+    def test_bench_game_loop(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'bench.json')
+            call_command('bench_game_loop', iterations=2, nlp_engine='stub', output=path,
+                         stdout=io.StringIO())
+            with open(path, encoding='utf-8') as f:
+                results = json.load(f)
+        self.assertEqual(results['dataset']['Story'], 20)
+        # The writes succeed before the rollback
+        self.assertEqual(results['views']['write_story POST']['statuses'], {'302': 2})
+        self.assertEqual(results['written']['Sentence'], 2)
+        for key in ('home GET', 'see_leaderboard GET', 'play GET', 'see_sentences GET'):
+            self.assertEqual(results['views'][key]['requests'], 2)
+            self.assertIn('p95_ms', results['views'][key])
+        # The benchmark data is rolled back
+        self.assertEqual(Story.objects.count(), 20)
+
+
+@override_settings(VOCASTORY_DICTIONARY={'REMOTE': None})
+class CorpusTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user('writer', password='pass')
+        cls.word_set = WordSet.objects.create(title='Castle', creator=cls.user)
+        cls.word_set.words.add(Word.objects.create(text='brave'))
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def write(self, name, content):
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        return path
+
+    def test_import_words(self):
+        path = self.write('words.txt', 'Brave\nknight\n\nknight\n' + 'x' * 31 + '\n')
+        call_command('import_words', path, word_set='Castle', batch_size=2, stdout=io.StringIO())
+        self.assertEqual(sorted(self.word_set.words.values_list('text', flat=True)),
+                         ['brave', 'knight'])
+        self.assertEqual(Word.objects.filter(text='brave').count(), 1)
+
+        path = self.write('words.csv', 'word,word_set\nknight,Castle\ndragon,Cave\n')
+        with self.assertRaises(CommandError):
+            call_command('import_words', path, stdout=io.StringIO())
+        call_command('import_words', path, creator='writer', stdout=io.StringIO())
+        self.assertEqual(Word.objects.count(), 3)
+        self.assertEqual([w.text for w in WordSet.objects.get(title='Cave').words.all()], ['dragon'])
+
+        out = os.path.join(self.directory.name, 'out.csv')
+        call_command('export_words', out, stdout=io.StringIO())
+        with open(out, encoding='utf-8') as f:
+            self.assertEqual(f.read().split(), ['word,word_set', 'brave,Castle', 'knight,Castle',
+                                                'dragon,Cave'])
+
+    def test_import_words_reuses_any_case(self):
+        knight = Word.objects.create(text='Knight')
+        path = self.write('words.txt', 'knight\nKNIGHT\n')
+        call_command('import_words', path, word_set='Castle', stdout=io.StringIO())
+        self.assertEqual(Word.objects.filter(text__iexact='knight').count(), 1)
+        self.assertIn(knight, self.word_set.words.all())
+
+    @mock.patch.object(connection.features, 'can_return_ids_from_bulk_insert', False)
+    def test_insert_rows_detects_concurrent_inserts(self):
+        bulk_create = Word.objects.bulk_create
+
+        def racing_bulk_create(objs, **kwargs):
+            Word.objects.create(text='racer')
+            return bulk_create(objs, **kwargs)
+
+        with mock.patch.object(Word.objects, 'bulk_create', racing_bulk_create):
+            with self.assertRaises(DatabaseError):
+                corpus.insert_rows(Word, [Word(text='knight'), Word(text='dragon')])
+        created = corpus.insert_rows(Word, [Word(text='knight'), Word(text='dragon')])
+        self.assertEqual([w.text for w in created], ['knight', 'dragon'])
+
+    def test_story_round_trip(self):
+        story = Story.objects.create(word_set=self.word_set, completed=True)
+        for order, text in enumerate(['A brave knight.', 'The end.']):
+            Sentence.objects.create(story=story, creator=self.user, order=order,
+                                    text=text, stylized_text=text, is_selected=True)
+        Sentence.objects.filter(story=story).update(
+            creation_date=timezone.datetime(2019, 12, 1, tzinfo=timezone.utc))
+        path = os.path.join(self.directory.name, 'stories.ndjson')
+        call_command('export_stories', path, stdout=io.StringIO())
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps({'word_set': 'Unknown', 'sentences': []}) + '\n')
+            f.write(json.dumps({'word_set': 'Castle', 'sentences': [
+                {'order': 0, 'text': 'Brave new writer.', 'creator': 'newcomer'}]}) + '\n')
+        story.delete()
+
+        out = io.StringIO()
+        call_command('import_stories', path, batch_size=2, stdout=out)
+        self.assertIn('Stored 2 stories and 3 sentences', out.getvalue())
+        self.assertIn('1 stories of unknown word sets skipped', out.getvalue())
+        story = Story.objects.get(completed=True)
+        self.assertEqual((story.selected_order, story.get_text()), (1, 'A brave knight. The end.'))
+        sentence = story.sentence_set.get(order=0)
+        self.assertEqual(sentence.creation_date.date(), timezone.datetime(2019, 12, 1).date())
+        self.assertEqual([w.text for w in sentence.used_words.all()], ['brave'])
+        self.assertIn('show_meaning', sentence.stylized_text)
+        self.assertFalse(CustomUser.objects.get(username='newcomer').has_usable_password())
@@ -0,0 +1,57 @@
+"""
+Migration operations of the databases created before a model change that
+makemigrations cannot detect on its own. Put them in an empty migration:
+python manage.py makemigrations vocastory --empty --name vote_table
+then set operations = upgrades.VOTE_TABLE in the generated file
+"""
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+from django.utils import timezone
+
+
+def set_vote_dates(apps, schema_editor):
+    """
+    The votes cast before created_at existed count at the creation of their sentence
+    """
+    Vote = apps.get_model('vocastory', 'Vote')
+    Sentence = apps.get_model('vocastory', 'Sentence')
+    Vote.objects.update(created_at=Subquery(
+        Sentence.objects.filter(pk=OuterRef('sentence')).values('creation_date')[:1]))
+
+
+# Sentence.voted_users goes through Vote, which keeps the rows of the
+# automatic table; Django cannot add through= to an existing M2M field
+VOTE_TABLE = [
+    migrations.SeparateDatabaseAndState(state_operations=[
+        migrations.CreateModel(
+            name='Vote',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False,
+                                        verbose_name='ID')),
+                ('user', models.ForeignKey(db_column='customuser_id', on_delete=models.CASCADE,
+                                           to=settings.AUTH_USER_MODEL)),
+                ('sentence', models.ForeignKey(on_delete=models.CASCADE,
+                                               to='vocastory.Sentence')),
+            ],
+            options={'db_table': 'vocastory_sentence_voted_users'},
+        ),
+        migrations.AlterField(
+            model_name='sentence',
+            name='voted_users',
+            field=models.ManyToManyField(related_name='voted_sentences', through='vocastory.Vote',
+                                         to=settings.AUTH_USER_MODEL),
+        ),
+    ]),
+    migrations.AddField(
+        model_name='vote',
+        name='created_at',
+        field=models.DateTimeField(auto_now_add=True, default=timezone.now),
+        preserve_default=False,
+    ),
+    migrations.RunPython(set_vote_dates, migrations.RunPython.noop),
+    migrations.AlterUniqueTogether(
+        name='vote',
+        unique_together={('user', 'sentence')},
+    ),
+]
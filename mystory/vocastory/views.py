@@ -4,32 +4,25 @@ from django.shortcuts import render, get_object_or_404, redirect
 from django.http import HttpResponseForbidden, HttpResponseBadRequest
 from django.http import HttpResponse, HttpResponseRedirect
 from django.contrib import messages
+from django.core.paginator import Paginator
 from django.urls import reverse
 from django.db import transaction
 
+from . import dictionary
 from .models import Story, Sentence, WordSet
 from .models import Word, StoryReview
+from .eligibility import readable_stories, writable_stories, reviewable_stories
+from .eligibility import pick_random
+from .browse import word_sets_for_browse, stories_for_browse
 from .forms import SentenceInputForm, SentenceSelectForm, StoryRatingForm
 from accounts.models import CustomUser
 
-dict_engine = None
 read_chance = 0.45
 write_chance = 0.45
 review_chance = 0.1
-
-
-def dict(*args, **kwargs):
-    """
-    This method tokenizes the sentence
-    """
-    global dict_engine
-    if dict_engine is None:
-        import warnings
-        with warnings.catch_warnings():
-            warnings.simplefilter("ignore")
-            from PyDictionary import PyDictionary
-            dict_engine = PyDictionary()
-    return dict_engine.meaning(*args, **kwargs)
+leaderboard_page_size = 50
+top_stories_page_size = 10
+browse_page_size = 20
 
 
 def home_view(request):
@@ -37,14 +30,17 @@ def home_view(request):
     This creates the home view when first
     enter to the website
     """
-    with transaction.atomic():
-        top_stories = Story.get_top_stories_ordered()
-        notifications = None
-        if request.user.is_authenticated:
-            notifications = CustomUser.objects.get(pk=request.user.id).get_notifications()
+    try:
+        top_stories, next_cursor = Story.get_top_stories(request.GET.get('top'), top_stories_page_size)
+    except ValueError:
+        return HttpResponseBadRequest("Invalid page")
+    notifications = None
+    if request.user.is_authenticated:
+        notifications = request.user.get_notifications()
 
     context = {
         'stories': top_stories,
+        'next_cursor': next_cursor,
         'notifications': notifications,
     }
     return render(request, 'home.html', context)
@@ -69,7 +65,7 @@ def read_story(request, story_id):
         form = SentenceSelectForm()
         choices = []
         for i in story.get_candidate_sentences(order):
-            if i.creator != user:
+            if i.creator_id != user.id:
                 choices.append((i.id, i.text))
         form.fields['sentence_choice'].choices = choices
         context = {'story': story, 'form': form}
@@ -81,12 +77,9 @@ def read_story(request, story_id):
         order = int(request.POST.get("order", "-1"))
         candidates = story.get_candidate_sentences(order)
         chosen_sentence = candidates.get(id=form.data['sentence_choice'])
-        with transaction.atomic():
-            chosen_sentence.vote_sentence(user)
-            # This selects sentence is certain conditions
-            # are fulfilled, and finishes the story
-            story.close_sentence_poll()
-            story.finish_story()
+        chosen_sentence.vote_sentence(user)
+        # The poll scheduler closes the poll and finishes the story
+        story.request_poll_check()
         messages.info(request, 'Your response is recorded')
 
     return HttpResponseRedirect(reverse('home'))
@@ -189,7 +182,9 @@ def browse_word_sets(request):
     :param request:
     :return:
     """
-    context = {'word_sets': WordSet.objects.all()}
+    paginator = Paginator(word_sets_for_browse(), browse_page_size)
+    page = paginator.get_page(request.GET.get('page'))
+    context = {'word_sets': page, 'page': page}
     return render(request, 'browse_mode/index.html', context)
 
 
@@ -200,14 +195,18 @@ def browse_story_list(request, wordset_id):
     :param wordset_id:
     :return:
     """
-    word_set = get_object_or_404(WordSet, id=wordset_id)
-    context = {'word_set': word_set, 'story_list': word_set.story_set.all()}
+    word_set = get_object_or_404(word_sets_for_browse(), id=wordset_id)
+    # The story count is annotated, the paginator does not count again
+    paginator = Paginator(stories_for_browse(word_set), browse_page_size)
+    paginator.count = word_set.story_count
+    page = paginator.get_page(request.GET.get('page'))
+    context = {'word_set': word_set, 'story_list': page, 'page': page}
     return render(request, 'browse_mode/browse_story.html', context)
 
 
 def show_word_meaning(request, word_id):
     word = get_object_or_404(Word, id=word_id)
-    meaning = dict(word.text)
+    meaning = dictionary.lookup(word.text)
     return render(request, 'show_meaning.html', {"word": word, "word_info": meaning})
 
 
@@ -239,51 +238,43 @@ def play_loop(request):
     # word_sets = current_user.starred_word_sets.all()
     word_sets = WordSet.objects.all()
 
-    if len(word_sets) == 0:
+    if not word_sets.exists():
         return HttpResponseBadRequest("No word set :(")
 
     val = random.uniform(0, 1)
     if val < read_chance:
-        readable_stories = []
-        for word_set in word_sets:
-            stories = word_set.story_set.all()
-            for s in stories:
-                if s.is_readable(current_user):
-                    readable_stories.append(s)
-        if len(readable_stories) == 0:
+        story = pick_random(readable_stories(current_user))
+        if story is None:
             messages.info(request, "You read all the stories, check back little later!")
             return HttpResponseRedirect(reverse('home'))
-        else:
-            story = random.choice(readable_stories)
         return HttpResponseRedirect(reverse('read_story', args=(story.id,)))
     elif val < read_chance + write_chance:
-        writable_stories = []
-        for word_set in word_sets:
-            stories = word_set.story_set.all()
-            for s in stories:
-                if s.is_writable(current_user):
-                    writable_stories.append(s)
-        if len(writable_stories) == 0:
+        story = pick_random(writable_stories(current_user))
+        if story is None:
             # Will create a new story if no suitable story to write
-            rand_wordset = random.choice(word_sets)
+            rand_wordset = pick_random(word_sets)
             story = Story(word_set=rand_wordset)
             story.save()
-        else:
-            story = random.choice(writable_stories)
         return HttpResponseRedirect(reverse('write_story', args=(story.id,)))
     else:
-        reviewable_stories = []
-        for word_set in word_sets:
-            stories = word_set.story_set.all()
-            for s in stories:
-                if s.is_reviewable(current_user):
-                    reviewable_stories.append(s)
-        if len(reviewable_stories) == 0:
+        story = pick_random(reviewable_stories(current_user))
+        if story is None:
             return HttpResponseRedirect(reverse('play'))
-        story = random.choice(reviewable_stories)
         return HttpResponseRedirect(reverse('review_story', args=(story.id,)))
 
 
 def see_leaderboard(request):
-    users_scored = CustomUser.get_users_scored().order_by('-score')
-    return render(request, 'leaderboard.html', {'users_scored': users_scored})
+    """
+    Ranked users, paginated, with the neighbours of the current user
+    """
+    paginator = Paginator(CustomUser.get_leaderboard(), leaderboard_page_size)
+    page = paginator.get_page(request.GET.get('page'))
+    context = {'users_scored': page, 'page': page}
+    if request.user.is_authenticated:
+        user = CustomUser.objects.get(pk=request.user.id)
+        rank = user.get_rank()
+        neighbours = user.get_neighbours()
+        first_rank = rank - neighbours.index(user)
+        context['my_rank'] = rank
+        context['neighbours'] = [(first_rank + i, u) for i, u in enumerate(neighbours)]
+    return render(request, 'leaderboard.html', context)